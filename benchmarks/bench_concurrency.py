@@ -0,0 +1,104 @@
+"""
+Benchmark of the read throughput of the API under concurrent clients,
+while a full robot health recompute writes in the background, with each
+SQLite database profile.
+
+Usage: python benchmarks/bench_concurrency.py [robot_count] [client_count ...]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_propagation import build_fleet
+from src import app, async_crud
+from src.database import Base, get_async_db, create_async_database_engine
+
+DEFAULT_ROBOTS = 100_000
+DEFAULT_CLIENTS = [1, 16, 128]
+DURATION = 3.0
+PROFILES = ["default", "performance"]
+
+
+async def client(http, deadline, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await http.get("/robots/", params={"limit": 10, "isHealthy": True})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def recompute(session_factory, deadline):
+    runs = 0
+    while time.perf_counter() < deadline:
+        async with session_factory() as db:
+            await async_crud.update_robots_health_status(db)
+        runs += 1
+    return runs
+
+
+async def measure(session_factory, client_count):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        deadline = time.perf_counter() + DURATION
+        recomputes = asyncio.create_task(recompute(session_factory, deadline))
+        await asyncio.gather(*(client(http, deadline, latencies) for _ in range(client_count)))
+        runs = await recomputes
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    print(f"{client_count:>5} clients  {len(latencies) / DURATION:9.1f} req/s  "
+          f"p50={p50 * 1000:7.1f} ms  p99={p99 * 1000:7.1f} ms  recomputes={runs}")
+
+
+def run(robot_count, client_counts):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/bench.db"
+        engine = create_engine(url)
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            build_fleet(db, robot_count)
+        finally:
+            db.close()
+            engine.dispose()
+
+        for profile in PROFILES:
+            print(f"{robot_count} robots, {profile} profile, {DURATION:.0f} s per run")
+            asyncio.run(serve(f"sqlite:///{tmp}/bench.db", profile, client_counts))
+
+
+async def serve(url, profile, client_counts):
+    # The async engine is bound to the event loop: every run shares the same loop
+    async_engine = create_async_database_engine(url, profile)
+    session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        for client_count in client_counts:
+            await measure(session_factory, client_count)
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    # Request logs would dominate the measurement
+    logging.disable(logging.INFO)
+    robot_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROBOTS
+    client_counts = [int(arg) for arg in sys.argv[2:]] or DEFAULT_CLIENTS
+    run(robot_count, client_counts)
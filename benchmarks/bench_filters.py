@@ -0,0 +1,74 @@
+"""
+Benchmark of filtered GET /robots/ latency, without and with the dependency indexes.
+
+Usage: python benchmarks/bench_filters.py [robot_count ...]
+"""
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import Base
+from src import crud
+from bench_propagation import build_fleet
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEPENDENCY_INDEXES = ["ix_robots_alimentation_power", "ix_robots_guidage_health", "ix_robots_licence_health", "ix_robots_health"]
+QUERY_COUNT = 200
+
+
+def random_filters(rng, parent_count):
+    filters = {}
+    parent = rng.choice(["alimentation_id", "guidage_id", "licence_id", None])
+    if parent is not None:
+        filters[parent] = rng.randint(1, parent_count)
+    if parent is None or rng.random() < 0.5:
+        filters["isHealthy"] = rng.random() < 0.5
+    return filters
+
+
+def measure(db, parent_count, seed=0):
+    rng = random.Random(seed)
+    durations = []
+    for _ in range(QUERY_COUNT):
+        filters = random_filters(rng, parent_count)
+        start = time.perf_counter()
+        crud.list_robots(db, limit=10, include_total=True, **filters)
+        durations.append(time.perf_counter() - start)
+    quantiles = statistics.quantiles(durations, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000
+
+
+def run(robot_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            build_fleet(db, robot_count)
+            parent_count = max(robot_count // 100, 1)
+            after = measure(db, parent_count)
+            for name in DEPENDENCY_INDEXES:
+                db.execute(text(f"DROP INDEX {name}"))
+            db.commit()
+            before = measure(db, parent_count)
+        finally:
+            db.close()
+            engine.dispose()
+    print(f"{robot_count:>9} robots  before p50={before[0]:8.2f} ms p99={before[1]:8.2f} ms  "
+          f"after p50={after[0]:8.2f} ms p99={after[1]:8.2f} ms")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.ERROR)
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
@@ -0,0 +1,66 @@
+"""
+Benchmark of the batch load-shedding solver.
+
+Usage: python benchmarks/bench_power.py [robot_count ...]
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import crud, models
+from src.database import Base
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def build_fleet(db, robot_count, seed=0):
+    rng = random.Random(seed)
+    alimentation_count = max(robot_count // 20, 1)
+    # Around 20 robots of 20 units on average per alimentation: a few of them are overloaded
+    db.execute(insert(models.Alimentation), [
+        {"alimentationType": models.AlimentationType.NUCLEAIRE, "isHealthy": True, "capacity": rng.choice([500, 600, 800])}
+        for _ in range(alimentation_count)
+    ])
+    db.execute(insert(models.Robot), [
+        {
+            "name": f"Robot_{i}",
+            "isHealthy": True,
+            "alimentation_id": rng.randint(1, alimentation_count),
+            "guidage_id": 1,
+            "licence_id": 1,
+            "motor": rng.choice(list(models.MotorType)),
+        }
+        for i in range(robot_count)
+    ])
+    db.commit()
+
+
+def run(robot_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            build_fleet(db, robot_count)
+            start = time.perf_counter()
+            turned_off = crud.update_power_health_status(db)
+            elapsed = time.perf_counter() - start
+        finally:
+            db.close()
+            engine.dispose()
+    print(f"{robot_count:>9} robots  {elapsed * 1000:9.1f} ms  turned_off={turned_off}")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.ERROR)
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
@@ -0,0 +1,70 @@
+"""
+Benchmark of the set-based robot health propagation.
+
+Usage: python benchmarks/bench_propagation.py [robot_count ...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, propagation
+from src.database import Base
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 200_000]
+
+
+def build_fleet(db, robot_count, seed=0):
+    rng = random.Random(seed)
+    parent_count = max(robot_count // 100, 1)
+    expiration_date = datetime.now() + timedelta(days=30)
+    db.execute(insert(models.Alimentation), [
+        {"alimentationType": models.AlimentationType.NUCLEAIRE, "isHealthy": rng.random() > 0.1, "capacity": 10_000}
+        for _ in range(parent_count)
+    ])
+    db.execute(insert(models.Guidage), [{"isHealthy": rng.random() > 0.1} for _ in range(parent_count)])
+    db.execute(insert(models.Licence), [
+        {"isHealthy": rng.random() > 0.1, "expiration_date": expiration_date} for _ in range(parent_count)
+    ])
+    db.execute(insert(models.Robot), [
+        {
+            "name": f"Robot_{i}",
+            "isHealthy": rng.random() > 0.2,
+            "alimentation_id": rng.randint(1, parent_count),
+            "guidage_id": rng.randint(1, parent_count),
+            "licence_id": rng.randint(1, parent_count),
+            "motor": rng.choice(list(models.MotorType)),
+        }
+        for i in range(robot_count)
+    ])
+    db.commit()
+
+
+def run(robot_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            build_fleet(db, robot_count)
+            start = time.perf_counter()
+            result = propagation.propagate_robots_health(db)
+            elapsed = time.perf_counter() - start
+        finally:
+            db.close()
+            engine.dispose()
+    print(f"{robot_count:>9} robots  {elapsed * 1000:9.1f} ms  "
+          f"disabled={result['disabled']} recovered={result['recovered']}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
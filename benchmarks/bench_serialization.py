@@ -0,0 +1,120 @@
+"""
+Benchmark of the serialization of large pages: rows per second served by
+GET /robots/?limit=1000, and by the NDJSON export, walking the whole fleet.
+The response cache is cleared before every request, so each page is read
+from the database and serialized.
+
+The fleet is the seeded one of fleet.py; suite.py runs the same requests,
+so their results can be compared across commits.
+
+Usage: python benchmarks/bench_serialization.py [robot_count] [page_size] [seed]
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fleet import FleetSpec, create_fleet_database
+from src import app
+from src.database import get_db, get_async_db, create_database_engine, create_async_database_engine
+from src.response_cache import response_cache
+
+DEFAULT_ROBOTS = 100_000
+DEFAULT_PAGE_SIZE = 1000
+PASSES = 3
+
+
+@contextlib.asynccontextmanager
+async def client(url):
+    """HTTP client calling the application in process, on the database at the URL"""
+    async_engine = create_async_database_engine(url)
+    session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    engine = create_database_engine(url)
+    sync_session_factory = sessionmaker(bind=engine)
+
+    async def override_get_async_db():
+        async with session_factory() as session:
+            yield session
+
+    def override_get_db():
+        with sync_session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_db] = override_get_db
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            yield http
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+        app.dependency_overrides.pop(get_db, None)
+        await async_engine.dispose()
+        engine.dispose()
+
+
+async def walk_pages(http, page_size, max_pages=None):
+    """Read the pages through the cursors, every one or the first max_pages, returning the number of robots"""
+    rows = 0
+    params = {"limit": page_size}
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        response_cache.clear()
+        response = await http.get("/robots/", params=params)
+        response.raise_for_status()
+        page = response.json()
+        rows += len(page["robots"])
+        pages += 1
+        if page["next_cursor"] is None:
+            break
+        params["cursor"] = page["next_cursor"]
+    return rows
+
+
+async def export(http):
+    rows = 0
+    async with http.stream("GET", "/robots/export") as response:
+        async for line in response.aiter_lines():
+            rows += bool(line)
+    return rows
+
+
+async def measure(name, run):
+    rates = []
+    for _ in range(PASSES):
+        start = time.perf_counter()
+        rows = await run()
+        rates.append(rows / (time.perf_counter() - start))
+    print(f"  {name:<28} {max(rates):12,.0f} rows/s")
+
+
+async def serve(url, page_size):
+    async with client(url) as http:
+        await measure(f"GET /robots/?limit={page_size}", lambda: walk_pages(http, page_size))
+        await measure("GET /robots/export", lambda: export(http))
+
+
+def run(robot_count, page_size, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/bench.db"
+        create_fleet_database(url, FleetSpec(robot_count, seed))
+        print(f"{robot_count} robots")
+        asyncio.run(serve(url, page_size))
+
+
+if __name__ == "__main__":
+    # Request logs would dominate the measurement
+    logging.disable(logging.INFO)
+    robot_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROBOTS
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PAGE_SIZE
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    run(robot_count, page_size, seed)
@@ -0,0 +1,118 @@
+"""
+Seeded synthetic fleet generator, writing directly through the models.
+
+The same seed and parameters always produce the same fleet, so benchmark
+results can be compared across commits.
+
+Usage: python benchmarks/fleet.py <database_url> [robot_count] [seed]
+"""
+import math
+import os
+import random
+import sys
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models
+from src.database import Base, create_database_engine
+
+# Rows per INSERT executemany, bounding the memory used for large fleets
+INSERT_BATCH_SIZE = 50_000
+
+
+@dataclass
+class FleetSpec:
+    robot_count: int
+    seed: int = 0
+    # Fan-out: average number of robots linked to each parent
+    robots_per_alimentation: int = 20
+    robots_per_guidage: int = 100
+    robots_per_licence: int = 100
+    unhealthy_parent_ratio: float = 0.05
+    unhealthy_robot_ratio: float = 0.1
+    # Licences still healthy but past their expiration date, for the licence sweep
+    expired_licence_ratio: float = 0.05
+    # Capacity of the alimentations relative to the average load of their robots
+    capacity_factor: float = 1.1
+
+    def parent_count(self, robots_per_parent: int) -> int:
+        return max(math.ceil(self.robot_count / robots_per_parent), 1)
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _insert(db, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            db.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.execute(insert(model), batch)
+
+
+def generate_fleet(db, spec: FleetSpec):
+    """Insert the alimentations, guidages, licences and robots described by the spec, and commit"""
+    rng = random.Random(spec.seed)
+    now = datetime.now()
+    alimentation_count = spec.parent_count(spec.robots_per_alimentation)
+    guidage_count = spec.parent_count(spec.robots_per_guidage)
+    licence_count = spec.parent_count(spec.robots_per_licence)
+    average_consumption = sum(models.MOTOR_CONSUMPTION.values()) / len(models.MOTOR_CONSUMPTION)
+    average_load = spec.robots_per_alimentation * average_consumption
+
+    _insert(db, models.Alimentation, (
+        {
+            "alimentationType": rng.choice(list(models.AlimentationType)),
+            "isHealthy": rng.random() >= spec.unhealthy_parent_ratio,
+            "capacity": int(average_load * spec.capacity_factor * rng.uniform(0.8, 1.2)),
+        }
+        for _ in range(alimentation_count)
+    ))
+    _insert(db, models.Guidage, ({"isHealthy": rng.random() >= spec.unhealthy_parent_ratio} for _ in range(guidage_count)))
+    _insert(db, models.Licence, (
+        {
+            "isHealthy": rng.random() >= spec.unhealthy_parent_ratio,
+            "expiration_date": now + timedelta(days=-1 if rng.random() < spec.expired_licence_ratio else 30),
+        }
+        for _ in range(licence_count)
+    ))
+    motors = list(models.MotorType)
+    _insert(db, models.Robot, (
+        {
+            "name": f"Robot_{i}",
+            "isHealthy": rng.random() >= spec.unhealthy_robot_ratio,
+            "alimentation_id": rng.randint(1, alimentation_count),
+            "guidage_id": rng.randint(1, guidage_count),
+            "licence_id": rng.randint(1, licence_count),
+            "motor": rng.choice(motors),
+        }
+        for i in range(spec.robot_count)
+    ))
+    db.commit()
+
+
+def create_fleet_database(url: str, spec: FleetSpec):
+    """Create the schema at the URL and fill it with the fleet"""
+    engine = create_database_engine(url)
+    try:
+        Base.metadata.create_all(bind=engine)
+        with sessionmaker(bind=engine)() as db:
+            generate_fleet(db, spec)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    url = sys.argv[1]
+    robot_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    create_fleet_database(url, FleetSpec(robot_count, seed))
+    print(f"{robot_count} robots written to {url}")
@@ -0,0 +1,233 @@
+"""
+Benchmark suite of the hot paths of the dependency engine, on seeded
+synthetic fleets, writing machine-readable results.
+
+Every measured run starts from a fresh copy of the generated fleet, so runs
+changing the robots health measure the same work.
+
+Usage:
+    python benchmarks/suite.py [--sizes 1000 10000 ...] [--repeat N] [--seed S]
+        [--robots-per-alimentation N] [--robots-per-guidage N] [--robots-per-licence N]
+        [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_serialization
+from fleet import FleetSpec, create_fleet_database
+from src import crud, pagination, schemas, simulation
+from src.database import create_database_engine
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def _first_page(db, spec):
+    crud.list_robots(db, limit=10)
+
+
+def _filtered_page_with_total(db, spec):
+    crud.list_robots(db, limit=10, include_total=True, isHealthy=True, alimentation_id=1)
+
+
+def _deep_page(db, spec):
+    # Keyset pagination: the cursor of the last page costs as much as the first one
+    robots, cursor = crud.get_robots(db, limit=10)
+    for _ in range(100):
+        robots, cursor = crud.get_robots(db, limit=10, cursor=cursor)
+
+
+def _most_loaded(db, spec):
+    crud.get_most_loaded_alimentations(db, limit=10)
+    crud.get_most_loaded_alimentations(db, limit=10, by="headroom")
+
+
+def _parent_pages(db, spec):
+    crud.get_alimentations(db, limit=10)
+    crud.get_guidages(db, limit=10)
+    crud.get_licences(db, limit=10)
+
+
+def _simulate_failure(db, spec):
+    # Reuses the snapshot of the previous runs on the same copy, the first run loads it
+    crud.simulate_status_changes(db, schemas.SimulationRequest(failures=[
+        schemas.SimulatedFailure(entity_type=schemas.EntityType.alimentation, id=1),
+        schemas.SimulatedFailure(entity_type=schemas.EntityType.guidage, id=1),
+    ]))
+
+
+def _simulate_failure_cold(db, spec):
+    simulation.snapshots.clear()
+    _simulate_failure(db, spec)
+
+
+def _serve(db, request):
+    """Run the requests through the application, on the database of the session"""
+    async def run():
+        async with bench_serialization.client(db.get_bind().url.render_as_string(hide_password=False)) as http:
+            await request(http)
+    asyncio.run(run())
+
+
+def _serialize_pages(db, spec):
+    # Ten pages of 1000 robots, each read from the database and serialized
+    _serve(db, lambda http: bench_serialization.walk_pages(http, 1000, max_pages=10))
+
+
+def _export_ndjson(db, spec):
+    _serve(db, bench_serialization.export)
+
+
+# Benchmarks changing the fleet, each run on a fresh copy
+WRITE_BENCHMARKS = {
+    "update_robots_health_status": lambda db, spec: crud.update_robots_health_status(db),
+    "update_power_health_status": lambda db, spec: crud.update_power_health_status(db),
+    "update_licences_health_status": lambda db, spec: crud.update_licences_health_status(db),
+}
+
+# Read-only benchmarks, sharing one copy
+READ_BENCHMARKS = {
+    "list_robots_first_page": _first_page,
+    "list_robots_filtered_with_total": _filtered_page_with_total,
+    "get_robots_101_pages": _deep_page,
+    "list_parents_first_page": _parent_pages,
+    "most_loaded_alimentations": _most_loaded,
+    "simulate_failure": _simulate_failure,
+    "simulate_failure_cold_snapshot": _simulate_failure_cold,
+    "get_robots_10_pages_of_1000": _serialize_pages,
+    "export_ndjson": _export_ndjson,
+}
+
+
+def _copy(template, work):
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(template, work)
+    # The cached simulation snapshot was read from the replaced file
+    simulation.snapshots.clear()
+
+
+def _timed(url, benchmark, spec):
+    pagination.count_cache.clear()
+    engine = create_database_engine(url)
+    try:
+        with sessionmaker(autocommit=False, autoflush=False, bind=engine)() as db:
+            start = time.perf_counter()
+            benchmark(db, spec)
+            return time.perf_counter() - start
+    finally:
+        engine.dispose()
+
+
+def run_size(spec, repeat, tmp):
+    template = os.path.join(tmp, f"fleet-{spec.robot_count}.db")
+    start = time.perf_counter()
+    create_fleet_database(f"sqlite:///{template}", spec)
+    print(f"{spec.robot_count:>9} robots generated in {time.perf_counter() - start:.1f} s")
+
+    work = os.path.join(tmp, "work.db")
+    results = []
+    for name, benchmark in {**WRITE_BENCHMARKS, **READ_BENCHMARKS}.items():
+        durations = []
+        for _ in range(repeat):
+            if name in WRITE_BENCHMARKS or not durations:
+                _copy(template, work)
+            durations.append(_timed(f"sqlite:///{work}", benchmark, spec))
+        result = {
+            "benchmark": name,
+            "robots": spec.robot_count,
+            "runs": durations,
+            "min": min(durations),
+            "median": statistics.median(durations),
+        }
+        results.append(result)
+        print(f"{'':>9} {name:<34} min={result['min'] * 1000:10.2f} ms  median={result['median'] * 1000:10.2f} ms")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(result["benchmark"], result["robots"]): result for result in json.load(f)["results"]}
+    print(f"\nCompared to {baseline_path} (median, lower is better):")
+    for result in results:
+        reference = baseline.get((result["benchmark"], result["robots"]))
+        if reference is not None:
+            ratio = result["median"] / reference["median"]
+            print(f"{result['robots']:>9} {result['benchmark']:<34} x{ratio:6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dependency engine on synthetic fleets")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Robot counts of the fleets")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fleet generator")
+    parser.add_argument("--robots-per-alimentation", type=int, default=20)
+    parser.add_argument("--robots-per-guidage", type=int, default=100)
+    parser.add_argument("--robots-per-licence", type=int, default=100)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="Results of a previous run to compare with")
+    args = parser.parse_args()
+
+    # Request logs and overload warnings would dominate the measurement
+    logging.disable(logging.WARNING)
+
+    specs = [
+        FleetSpec(
+            size,
+            seed=args.seed,
+            robots_per_alimentation=args.robots_per_alimentation,
+            robots_per_guidage=args.robots_per_guidage,
+            robots_per_licence=args.robots_per_licence,
+        )
+        for size in args.sizes
+    ]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for spec in specs:
+            results.extend(run_size(spec, args.repeat, tmp))
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "fleets": [spec.as_dict() for spec in specs],
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,146 @@
+import atexit
+import json
 import logging
 import logging.config
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
 
-LOGGING_CONFIG = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "default": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "default",
-        }
-    },
-    "root": {
-        "handlers": ["console"],
-        "level": "DEBUG",
-    },
+# "json" writes one JSON object per line, "text" a human readable line
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+# Per-module levels, e.g. LOG_LEVELS="src.crud=WARNING,src.workers=DEBUG"
+DEFAULT_LOG_LEVELS = {
+    "aiosqlite": "WARNING",
+    "asyncio": "WARNING",
 }
 
+# Loggers whose INFO and DEBUG records are sampled: only 1 record of every N is written,
+# per message. LOG_SAMPLING="src.crud=100" overrides them, LOG_SAMPLING="" disables sampling.
+DEFAULT_LOG_SAMPLING = {
+    "src.crud": 10,
+    "src.routers": 10,
+}
+
+# Attributes of every LogRecord, the others were passed in extra= and are added to the JSON output
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+def _parse_mapping(value: str, convert=str) -> dict:
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, setting = item.split("=", 1)
+            mapping[name.strip()] = convert(setting.strip())
+    return mapping
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as a JSON object, with the values passed in extra= as fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through only 1 of every N records below WARNING of the configured loggers,
+    counted per message template so that rare messages are not drowned out.
+    The most specific logger prefix applies.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def rate(self, name: str) -> int:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        if rate <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % rate:
+            return False
+        if count:
+            record.sampled = rate
+        return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue records as they are: the message is formatted by the listener thread,
+    instead of the thread which logged it. Arguments are not copied, so only log
+    values which are not modified afterwards.
+    """
+
+    def prepare(self, record):
+        return record
+
+_listener = None
+
 def setup_logging():
-    logging.config.dictConfig(LOGGING_CONFIG)
+    """
+    Configure the loggers to enqueue their records, written to the console by a
+    background QueueListener thread so that no I/O happens on the request path.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    console = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        console.setFormatter(JsonFormatter())
+    else:
+        console.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    sampling = os.environ.get("LOG_SAMPLING")
+    rates = DEFAULT_LOG_SAMPLING if sampling is None else _parse_mapping(sampling, int)
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(rates))
+
+    levels = {**DEFAULT_LOG_LEVELS, **_parse_mapping(os.environ.get("LOG_LEVELS", ""))}
+    logging.config.dictConfig({
+        "version": 1,
+        "disable_existing_loggers": False,
+        "loggers": {name: {"level": level} for name, level in levels.items()},
+    })
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Write the records still queued and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
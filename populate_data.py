@@ -1,3 +1,4 @@
+import argparse
 import requests
 import random
 from datetime import datetime, timedelta
@@ -45,6 +46,54 @@ def create_robot(name, alimentation_id, guidage_id, licence_id, motor):
     response.raise_for_status()
     return response.json()
 
+def build_licences(count):
+    return [
+        {
+            "isHealthy": True,
+            "expiration_date": (datetime.utcnow() + timedelta(days=random.randint(30, 365))).isoformat()
+        }
+        for _ in range(count)
+    ]
+
+def build_robots(count, alimentation_ids, guidage_ids, licence_ids):
+    motor_types = ["PETIT", "MOYEN", "GRAND"]
+    return [
+        {
+            "name": f"Robot_{i+1}",
+            "isHealthy": True,
+            "alimentation_id": random.choice(alimentation_ids),
+            "guidage_id": guidage_ids[i % len(guidage_ids)],
+            "licence_id": licence_ids[i % len(licence_ids)],
+            "motor": random.choice(motor_types)
+        }
+        for i in range(count)
+    ]
+
+def bulk_create(path, items, batch_size=10000):
+    """Create items through a bulk endpoint, one request per batch"""
+    ids = []
+    for start in range(0, len(items), batch_size):
+        response = requests.post(f"{BASE_URL}/{path}/bulk", json=items[start:start + batch_size])
+        response.raise_for_status()
+        ids.extend(response.json()["ids"])
+    return ids
+
+def main_bulk(robot_count, licence_count, guidage_count, alimentation_count):
+    print("Creating licences...")
+    licence_ids = bulk_create("licences", build_licences(licence_count))
+    print("Creating guidages...")
+    guidage_ids = bulk_create("guidages", [{"isHealthy": True} for _ in range(guidage_count)])
+    print("Creating alimentations...")
+    alimentation_ids = bulk_create("alimentations", [
+        {"alimentationType": "SOLAIRE", "isHealthy": True, "capacity": 50} if i % 2 == 0 else
+        {"alimentationType": "NUCLEAIRE", "isHealthy": True, "capacity": 100}
+        for i in range(alimentation_count)
+    ])
+    print("Creating robots...")
+    robot_ids = bulk_create("robots", build_robots(robot_count, alimentation_ids, guidage_ids, licence_ids))
+    print(f"Created {len(licence_ids)} licences, {len(guidage_ids)} guidages, "
+          f"{len(alimentation_ids)} alimentations and {len(robot_ids)} robots.")
+
 def main():
     # Create licences
     print("Creating licences...")
@@ -77,4 +126,14 @@ def main():
     print("Created 100 robots.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Populate the API with test data")
+    parser.add_argument("--bulk", action="store_true", help="use the bulk endpoints")
+    parser.add_argument("--robots", type=int, default=100, help="number of robots (bulk mode)")
+    parser.add_argument("--licences", type=int, default=10, help="number of licences (bulk mode)")
+    parser.add_argument("--guidages", type=int, default=3, help="number of guidages (bulk mode)")
+    parser.add_argument("--alimentations", type=int, default=100, help="number of alimentations (bulk mode)")
+    args = parser.parse_args()
+    if args.bulk:
+        main_bulk(args.robots, args.licences, args.guidages, args.alimentations)
+    else:
+        main()
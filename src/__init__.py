@@ -1,49 +1,118 @@
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from src import models, crud
-from src.database import engine, SessionLocal
-from src.routers import robots, alimentations, guidages, licences
+from src import config, models, metrics
+from src.database import engine
+from src.graph_cache import graph_cache
+from src.response_cache import response_cache
+from src.health_stream import health_stream
+from src.startup import warmup
+from src.workers import coordinator
+from src.routers import robots, alimentations, guidages, licences, status, events
 from logging_config import setup_logging
 import logging
+import time
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+warmup.add("graph_cache", graph_cache.warm)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifespan events"""
     # Startup
-    logger.info("Starting up - updating license health statuses")
-    db = SessionLocal()
-    try:
-        crud.update_licences_health_status(db)
-        logger.info("License health status update completed at startup")
-    except Exception as e:
-        logger.error(f"Error updating license health status at startup: {e}")
-    finally:
-        db.close()
+    if config.CREATE_SCHEMA:
+        models.Base.metadata.create_all(bind=engine)
+
+    # The leader worker sweeps expired licences in the scheduler thread, without blocking the startup
+    logger.info("Starting up - joining the other workers")
+    coordinator.start()
+
+    # Requests are served meanwhile, the caches reading through until they are loaded
+    logger.info("Warming up the caches in the background")
+    warmup.start()
     
     yield
     
     # Shutdown
     logger.info("Application shutting down")
+    coordinator.stop()
 
 app = FastAPI(lifespan=lifespan)
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Queries and commits of the request are counted by the engine event hooks of src/metrics.py
+    stats = metrics.RequestStats()
+    token = metrics.request_stats.set(stats)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.record_request(request.method, route.path if route else "unmatched", status_code, time.perf_counter() - start, stats)
+        metrics.request_stats.reset(token)
+
 @app.get("/")
 def read_root():
-    logger.info("Root endpoint called")
+    logger.debug("Root endpoint called")
     return {"message": "Welcome to the API"}
 
 @app.get("/health")
 def read_health():
-    logger.info("Health endpoint called")
+    logger.debug("Health endpoint called")
     return {"status": "Healthy"}
 
+@app.get("/ready")
+def read_ready(warm: bool = False):
+    """
+    Ready once the application started, the caches being loaded in the background.
+    With warm=true, only once they are loaded.
+    """
+    status = warmup.status()
+    if not coordinator.is_leader:
+        sweep = "follower"
+    else:
+        sweep = "done" if coordinator.scheduler.last_run_at is not None else "running"
+    status["tasks"]["licence_sweep"] = {"status": sweep, "last_run_at": coordinator.scheduler.last_run_at}
+    ready = status["started"] and (status["warm"] or not warm)
+    return JSONResponse(jsonable_encoder({"ready": ready, **status}), status_code=200 if ready else 503)
+
+@app.get("/health/cache")
+def read_cache_stats():
+    logger.debug("Cache stats endpoint called")
+    return graph_cache.stats()
+
+@app.get("/health/recompute")
+def read_recompute_stats():
+    logger.debug("Recompute stats endpoint called")
+    return coordinator.recompute.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+metrics.CounterFunction("graph_cache_hits", "Lookups answered by the dependency graph cache", lambda: graph_cache.hits)
+metrics.CounterFunction("graph_cache_misses", "Lookups of the dependency graph cache read through from the database", lambda: graph_cache.misses)
+metrics.GaugeFunction("graph_cache_entries", "Entries held by the dependency graph cache", graph_cache.size)
+metrics.CounterFunction("response_cache_hits", "GET responses served from the response cache", lambda: response_cache.hits)
+metrics.CounterFunction("response_cache_misses", "GET responses read from the database", lambda: response_cache.misses)
+metrics.CounterFunction("response_cache_not_modified", "GET requests answered 304 Not Modified", lambda: response_cache.not_modified)
+metrics.GaugeFunction("health_stream_subscribers", "Clients subscribed to the health event streams of this worker", health_stream.subscription_count)
+metrics.CounterFunction("health_stream_events_published", "Health events published to the subscribers of this worker", lambda: health_stream.published)
+metrics.CounterFunction("health_stream_dropped_subscribers", "Health stream subscribers dropped for falling behind", lambda: health_stream.dropped)
+metrics.GaugeFunction("recompute_queue_depth", "Health recomputes waiting for the recompute scheduler", lambda: coordinator.recompute.queue_depth)
+metrics.GaugeFunction("recompute_last_run_duration_seconds", "Duration of the last health recompute", lambda: coordinator.recompute.last_run_duration)
+
 app.include_router(robots.router)
 app.include_router(alimentations.router)
 app.include_router(guidages.router)
 app.include_router(licences.router)
+app.include_router(status.router)
+app.include_router(events.router)
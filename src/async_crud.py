@@ -0,0 +1,50 @@
+"""
+Async versions of the crud functions, for AsyncSession.
+
+Each function runs its synchronous counterpart through AsyncSession.run_sync:
+the queries go through the async driver, so the event loop keeps serving other
+requests while the database works.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud
+import functools
+
+def _run_sync(fn):
+    @functools.wraps(fn)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(fn, *args, **kwargs)
+    return wrapper
+
+get_robot = _run_sync(crud.get_robot)
+get_robots = _run_sync(crud.get_robots)
+list_robots = _run_sync(crud.list_robots)
+create_robot = _run_sync(crud.create_robot)
+create_robots = _run_sync(crud.create_robots)
+update_robot_status = _run_sync(crud.update_robot_status)
+
+get_alimentation = _run_sync(crud.get_alimentation)
+get_alimentations = _run_sync(crud.get_alimentations)
+create_alimentation = _run_sync(crud.create_alimentation)
+create_alimentations = _run_sync(crud.create_alimentations)
+get_most_loaded_alimentations = _run_sync(crud.get_most_loaded_alimentations)
+check_robot_attachment = _run_sync(crud.check_robot_attachment)
+
+get_guidage = _run_sync(crud.get_guidage)
+get_guidages = _run_sync(crud.get_guidages)
+create_guidage = _run_sync(crud.create_guidage)
+create_guidages = _run_sync(crud.create_guidages)
+
+get_licence = _run_sync(crud.get_licence)
+get_licences = _run_sync(crud.get_licences)
+create_licence = _run_sync(crud.create_licence)
+create_licences = _run_sync(crud.create_licences)
+update_licence_status = _run_sync(crud.update_licence_status)
+update_licences_health_status = _run_sync(crud.update_licences_health_status)
+expire_licences = _run_sync(crud.expire_licences)
+get_next_licence_expiration = _run_sync(crud.get_next_licence_expiration)
+
+update_power_health_status = _run_sync(crud.update_power_health_status)
+update_robots_health_status = _run_sync(crud.update_robots_health_status)
+update_robots_health_for_parent = _run_sync(crud.update_robots_health_for_parent)
+apply_status_changes = _run_sync(crud.apply_status_changes)
+simulate_status_changes = _run_sync(crud.simulate_status_changes)
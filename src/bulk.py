@@ -0,0 +1,26 @@
+from fastapi import HTTPException, Request
+from pydantic import TypeAdapter, ValidationError
+from typing import List
+import json
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+async def read_items(request: Request, schema):
+    """
+    Read a bulk body, either a JSON array or NDJSON (one object per line),
+    and validate all of its items in one pass.
+    """
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_MEDIA_TYPES:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a list of objects")
+    try:
+        return TypeAdapter(List[schema]).validate_python(items)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
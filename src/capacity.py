@@ -0,0 +1,106 @@
+"""
+Per-alimentation load aggregates, maintained by database triggers.
+
+Every INSERT, DELETE and UPDATE of the health, alimentation or motor of a robot
+adjusts the aggregates of the alimentations it leaves and joins, whichever code
+path runs it: ORM flushes, bulk inserts, and the set-based propagation and
+load-shedding UPDATEs alike. Reading the load of an alimentation is then one
+primary key lookup.
+"""
+from sqlalchemy import event, func, select, text, update
+from . import models, power
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRIGGERS = ("robots_load_insert", "robots_load_update", "robots_load_delete", "alimentations_load_insert")
+
+# Robot columns the aggregates depend on
+ROBOT_COLUMNS = '"isHealthy", alimentation_id, motor'
+
+def _consumption(row: str) -> str:
+    cases = " ".join(f"WHEN '{motor.name}' THEN {consumption}" for motor, consumption in models.MOTOR_CONSUMPTION.items())
+    return f"CASE {row}.motor {cases} ELSE 0 END"
+
+def _adjust(row: str, sign: str) -> str:
+    """UPDATE adding (sign "+") or removing (sign "-") the robot row to the aggregates of its alimentation"""
+    assignments = [f'current_load = current_load {sign} CASE WHEN {row}."isHealthy" THEN {_consumption(row)} ELSE 0 END']
+    assignments += [
+        f"{motor.name.lower()}_robots = {motor.name.lower()}_robots {sign} CASE WHEN {row}.motor = '{motor.name}' THEN 1 ELSE 0 END"
+        for motor in models.MotorType
+    ]
+    return f"UPDATE alimentations SET {', '.join(assignments)} WHERE id = {row}.alimentation_id;"
+
+def refresh_statement(*where):
+    """UPDATE recomputing the aggregates of the alimentations from their robots"""
+    robots = models.Robot
+    attached = robots.alimentation_id == models.Alimentation.id
+    values = {
+        "current_load": select(func.coalesce(func.sum(power.consumption_expression), 0))
+            .where(attached, robots.isHealthy == True).scalar_subquery(),
+    }
+    for motor in models.MotorType:
+        values[f"{motor.name.lower()}_robots"] = select(func.count()).where(attached, robots.motor == motor).scalar_subquery()
+    return update(models.Alimentation).where(*where).values(values).execution_options(synchronize_session=False)
+
+def _refresh_new_alimentation_sql(dialect) -> str:
+    # Robots may reference an alimentation before it exists: count them once it is created
+    statement = refresh_statement(models.Alimentation.id == text("NEW.id"))
+    return str(statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+def sqlite_statements(dialect):
+    refresh = _refresh_new_alimentation_sql(dialect)
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS robots_load_insert AFTER INSERT ON robots BEGIN {_adjust('NEW', '+')} END",
+        f"CREATE TRIGGER IF NOT EXISTS robots_load_delete AFTER DELETE ON robots BEGIN {_adjust('OLD', '-')} END",
+        f"CREATE TRIGGER IF NOT EXISTS robots_load_update AFTER UPDATE OF {ROBOT_COLUMNS} ON robots "
+        'WHEN OLD."isHealthy" IS NOT NEW."isHealthy" OR OLD.alimentation_id IS NOT NEW.alimentation_id OR OLD.motor IS NOT NEW.motor '
+        f"BEGIN {_adjust('OLD', '-')} {_adjust('NEW', '+')} END",
+        f"CREATE TRIGGER IF NOT EXISTS alimentations_load_insert AFTER INSERT ON alimentations BEGIN {refresh}; END",
+    ]
+
+def postgresql_statements(dialect):
+    refresh = _refresh_new_alimentation_sql(dialect)
+    return [
+        "CREATE OR REPLACE FUNCTION robots_load() RETURNS trigger AS $$ BEGIN "
+        f"IF TG_OP IN ('UPDATE', 'DELETE') THEN {_adjust('OLD', '-')} END IF; "
+        f"IF TG_OP IN ('INSERT', 'UPDATE') THEN {_adjust('NEW', '+')} END IF; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql",
+        f"CREATE OR REPLACE FUNCTION alimentations_load() RETURNS trigger AS $$ BEGIN {refresh}; RETURN NULL; END $$ LANGUAGE plpgsql",
+        "DROP TRIGGER IF EXISTS robots_load_insert ON robots",
+        "CREATE TRIGGER robots_load_insert AFTER INSERT ON robots FOR EACH ROW EXECUTE FUNCTION robots_load()",
+        "DROP TRIGGER IF EXISTS robots_load_delete ON robots",
+        "CREATE TRIGGER robots_load_delete AFTER DELETE ON robots FOR EACH ROW EXECUTE FUNCTION robots_load()",
+        "DROP TRIGGER IF EXISTS robots_load_update ON robots",
+        f"CREATE TRIGGER robots_load_update AFTER UPDATE OF {ROBOT_COLUMNS} ON robots FOR EACH ROW "
+        'WHEN (OLD."isHealthy" IS DISTINCT FROM NEW."isHealthy" OR OLD.alimentation_id IS DISTINCT FROM NEW.alimentation_id '
+        "OR OLD.motor IS DISTINCT FROM NEW.motor) EXECUTE FUNCTION robots_load()",
+        "DROP TRIGGER IF EXISTS alimentations_load_insert ON alimentations",
+        "CREATE TRIGGER alimentations_load_insert AFTER INSERT ON alimentations FOR EACH ROW EXECUTE FUNCTION alimentations_load()",
+    ]
+
+STATEMENTS = {
+    "sqlite": sqlite_statements,
+    "postgresql": postgresql_statements,
+}
+
+def existing_triggers(connection) -> set:
+    if connection.dialect.name == "sqlite":
+        stmt = text("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    else:
+        stmt = text("SELECT tgname FROM pg_trigger WHERE NOT tgisinternal")
+    return set(connection.execute(stmt).scalars()) & set(TRIGGERS)
+
+def install_triggers(connection):
+    """Create the triggers maintaining the aggregates, if they are missing"""
+    statements = STATEMENTS.get(connection.dialect.name)
+    if statements is None:
+        raise NotImplementedError(f"Load aggregate triggers are not available on {connection.dialect.name}")
+    for statement in statements(connection.dialect):
+        connection.execute(text(statement))
+
+def _install_on_create(target, connection, **kw):
+    install_triggers(connection)
+
+# Created along with the robots table, after the alimentations table it references
+event.listen(models.Robot.__table__, "after_create", _install_on_create)
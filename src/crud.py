@@ -1,84 +1,205 @@
+from sqlalchemy import select, insert, update, func
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from . import models, schemas
+from . import models, schemas, propagation, power, pagination, metrics, capacity, dependency_graph, simulation
+from .graph_cache import graph_cache
+from .health_stream import execute_update
+from datetime import datetime, timezone
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _bulk_insert(db: Session, model, rows):
+    """Insert all rows with executemany in a single transaction and return their ids, in order"""
+    if not rows:
+        return []
+    try:
+        stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+        ids = db.scalars(stmt, rows).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return ids
+
 def get_robot(db: Session, robot_id: int):
-    logger.info(f"Fetching robot with ID {robot_id}")
+    logger.info("Fetching robot with ID %s", robot_id)
     db_robot = db.query(models.Robot).filter(models.Robot.id == robot_id).first()
     if db_robot is None:
-        logger.error(f"Robot with ID {robot_id} not found")
+        logger.error("Robot with ID %s not found", robot_id)
         raise HTTPException(status_code=400, detail="Missing object")
     return db_robot
 
-def get_robots(db: Session, skip: int = 0, limit: int = 10):
-    logger.info(f"Fetching robots with skip={skip} and limit={limit}")
-    return db.query(models.Robot).offset(skip).limit(limit).all()
+def get_robots(db: Session, skip: int = 0, limit: int = 10, cursor: str = None):
+    logger.info("Fetching robots with cursor=%s, skip=%s and limit=%s", cursor, skip, limit)
+    return pagination.paginate(db.query(models.Robot), models.Robot, limit, cursor=cursor, skip=skip)
+
+def robot_filters(isHealthy=None, alimentation_id=None, guidage_id=None, licence_id=None, reason=None):
+    filters = []
+    if isHealthy is not None:
+        filters.append(models.Robot.isHealthy == isHealthy)
+    if reason is not None:
+        # Served by the partial index of the reason
+        filters.append(models.has_reason(models.Robot.reason_mask, models.HealthReason[schemas.HealthReason(reason).name.upper()]))
+    if alimentation_id is not None:
+        filters.append(models.Robot.alimentation_id == alimentation_id)
+    if guidage_id is not None:
+        filters.append(models.Robot.guidage_id == guidage_id)
+    if licence_id is not None:
+        filters.append(models.Robot.licence_id == licence_id)
+    return filters
+
+# Columns of the listed robots, in the order of the fields of schemas.Robot
+LIST_COLUMNS = (
+    models.Robot.name,
+    models.Robot.isHealthy,
+    models.Robot.alimentation_id,
+    models.Robot.guidage_id,
+    models.Robot.licence_id,
+    models.Robot.motor,
+    models.Robot.id,
+    models.Robot.reason_mask,
+)
+
+def _robot_item(row):
+    """Robot of a listed row as schemas.Robot would dump it, without building the ORM object"""
+    name, healthy, alimentation_id, guidage_id, licence_id, motor, robot_id, reason_mask = row
+    return {
+        "name": name,
+        "isHealthy": healthy,
+        "alimentation_id": alimentation_id,
+        "guidage_id": guidage_id,
+        "licence_id": licence_id,
+        "motor": motor.value,
+        "id": robot_id,
+        "consumption": models.MOTOR_CONSUMPTION.get(motor, 0),
+        "reasons": models.reason_names(reason_mask or 0),
+    }
+
+def list_robots(db: Session, limit: int = 10, cursor: str = None, skip: int = 0, include_total: bool = False,
+                isHealthy=None, alimentation_id=None, guidage_id=None, licence_id=None, reason=None):
+    """
+    One page of robots, as plain dicts shaped like schemas.RobotsResponse: the rows are
+    read with a Core SELECT, skipping the ORM identity map and attribute instrumentation.
+    """
+    logger.info("Listing robots with cursor=%s, skip=%s and limit=%s", cursor, skip, limit)
+    filters = robot_filters(isHealthy, alimentation_id, guidage_id, licence_id, reason)
+
+    rows, next_cursor = pagination.paginate_rows(db, select(*LIST_COLUMNS).where(*filters), models.Robot.id, limit, cursor=cursor, skip=skip)
+
+    # The total is only computed on demand, and shared between pages for a few seconds
+    total_count = None
+    if include_total:
+        key = ("robots", isHealthy, alimentation_id, guidage_id, licence_id, reason)
+        count = select(func.count()).select_from(models.Robot).where(*filters)
+        total_count = pagination.count_cache.get(key, lambda: db.scalar(count))
+
+    return {"total_count": total_count, "next_cursor": next_cursor, "robots": [_robot_item(row) for row in rows]}
 
 def create_robot(db: Session, robot: schemas.RobotCreate):
-    logger.info(f"Creating robot with name {robot.name}")
+    logger.info("Creating robot with name %s", robot.name)
     db_robot = models.Robot(**robot.model_dump())
     db.add(db_robot)
     db.commit()
     db.refresh(db_robot)
     return db_robot
 
+def create_robots(db: Session, robots: list[schemas.RobotCreate]):
+    logger.info("Creating %s robot(s)", len(robots))
+    return _bulk_insert(db, models.Robot, [robot.model_dump() for robot in robots])
+
 def get_alimentation(db: Session, alimentation_id: int):
-    logger.info(f"Fetching alimentation with ID {alimentation_id}")
+    logger.info("Fetching alimentation with ID %s", alimentation_id)
     db_alimentation = db.query(models.Alimentation).filter(models.Alimentation.id == alimentation_id).first()
     if db_alimentation is None:
-        logger.error(f"Alimentation with ID {alimentation_id} not found")
+        logger.error("Alimentation with ID %s not found", alimentation_id)
         raise HTTPException(status_code=400, detail="Missing object")
     return db_alimentation
 
-def get_alimentations(db: Session, skip: int = 0, limit: int = 10):
-    logger.info(f"Fetching alimentations with skip={skip} and limit={limit}")
-    return db.query(models.Alimentation).offset(skip).limit(limit).all()
+def get_alimentations(db: Session, skip: int = 0, limit: int = 10, cursor: str = None):
+    logger.info("Fetching alimentations with cursor=%s, skip=%s and limit=%s", cursor, skip, limit)
+    return pagination.paginate(db.query(models.Alimentation), models.Alimentation, limit, cursor=cursor, skip=skip)
 
 def create_alimentation(db: Session, alimentation: schemas.AlimentationCreate):
-    logger.info(f"Creating alimentation with type {alimentation.alimentationType}")
+    logger.info("Creating alimentation with type %s", alimentation.alimentationType)
     db_alimentation = models.Alimentation(**alimentation.model_dump())
     db.add(db_alimentation)
     db.commit()
     db.refresh(db_alimentation)
     return db_alimentation
 
+def create_alimentations(db: Session, alimentations: list[schemas.AlimentationCreate]):
+    logger.info("Creating %s alimentation(s)", len(alimentations))
+    return _bulk_insert(db, models.Alimentation, [alimentation.model_dump() for alimentation in alimentations])
+
+# Orders of the most loaded alimentations, each read from its index
+LOAD_ORDERS = {
+    "load": (models.Alimentation.current_load.desc(), models.Alimentation.id.desc()),
+    "headroom": ((models.Alimentation.capacity - models.Alimentation.current_load).asc(), models.Alimentation.id.asc()),
+}
+
+def get_most_loaded_alimentations(db: Session, limit: int = 10, by: str = "load"):
+    """The limit alimentations with the highest load, or the lowest headroom, from the maintained aggregates"""
+    logger.info("Fetching the %s most loaded alimentations by %s", limit, by)
+    return db.query(models.Alimentation).order_by(*LOAD_ORDERS[by]).limit(limit).all()
+
+def check_robot_attachment(db: Session, robot_id: int, alimentation_id: int):
+    """Tell whether the alimentation can supply the robot on top of its current load"""
+    logger.info("Checking whether robot %s can be attached to alimentation %s", robot_id, alimentation_id)
+    db_robot = get_robot(db, robot_id)
+    db_alimentation = get_alimentation(db, alimentation_id)
+    # A healthy robot already attached is part of the current load
+    counted = db_robot.alimentation_id == db_alimentation.id and db_robot.isHealthy
+    load = db_alimentation.current_load + (0 if counted else db_robot.consumption)
+    return {
+        "robot_id": db_robot.id,
+        "alimentation_id": db_alimentation.id,
+        "consumption": db_robot.consumption,
+        "current_load": db_alimentation.current_load,
+        "capacity": db_alimentation.capacity,
+        "headroom": db_alimentation.capacity - load,
+        "can_attach": bool(db_alimentation.isHealthy) and load <= db_alimentation.capacity,
+    }
+
 def get_guidage(db: Session, guidage_id: int):
-    logger.info(f"Fetching guidage with ID {guidage_id}")
+    logger.info("Fetching guidage with ID %s", guidage_id)
     db_guidage = db.query(models.Guidage).filter(models.Guidage.id == guidage_id).first()
     if db_guidage is None:
-        logger.error(f"Guidage with ID {guidage_id} not found")
+        logger.error("Guidage with ID %s not found", guidage_id)
         raise HTTPException(status_code=400, detail="Missing object")
     return db_guidage
 
-def get_guidages(db: Session, skip: int = 0, limit: int = 10):
-    logger.info(f"Fetching guidages with skip={skip} and limit={limit}")
-    return db.query(models.Guidage).offset(skip).limit(limit).all()
+def get_guidages(db: Session, skip: int = 0, limit: int = 10, cursor: str = None):
+    logger.info("Fetching guidages with cursor=%s, skip=%s and limit=%s", cursor, skip, limit)
+    return pagination.paginate(db.query(models.Guidage), models.Guidage, limit, cursor=cursor, skip=skip)
 
 def create_guidage(db: Session, guidage: schemas.GuidageCreate):
-    logger.info(f"Creating guidage")
+    logger.info("Creating guidage")
     db_guidage = models.Guidage(**guidage.model_dump())
     db.add(db_guidage)
     db.commit()
     db.refresh(db_guidage)
     return db_guidage
 
+def create_guidages(db: Session, guidages: list[schemas.GuidageCreate]):
+    logger.info("Creating %s guidage(s)", len(guidages))
+    return _bulk_insert(db, models.Guidage, [guidage.model_dump() for guidage in guidages])
+
 def get_licence(db: Session, licence_id: int):
-    logger.info(f"Fetching licence with ID {licence_id}")
+    logger.info("Fetching licence with ID %s", licence_id)
     db_licence = db.query(models.Licence).filter(models.Licence.id == licence_id).first()
     if db_licence is None:
-        logger.error(f"Licence with ID {licence_id} not found")
+        logger.error("Licence with ID %s not found", licence_id)
         raise HTTPException(status_code=400, detail="Missing object")
     return db_licence
 
-def get_licences(db: Session, skip: int = 0, limit: int = 10):
-    logger.info(f"Fetching licences with skip={skip} and limit={limit}")
-    return db.query(models.Licence).offset(skip).limit(limit).all()
+def get_licences(db: Session, skip: int = 0, limit: int = 10, cursor: str = None):
+    logger.info("Fetching licences with cursor=%s, skip=%s and limit=%s", cursor, skip, limit)
+    return pagination.paginate(db.query(models.Licence), models.Licence, limit, cursor=cursor, skip=skip)
 
 def create_licence(db: Session, licence: schemas.LicenceCreate):
-    logger.info(f"Creating licence with expiration date {licence.expiration_date}")
+    logger.info("Creating licence with expiration date %s", licence.expiration_date)
     db_licence = models.Licence(**licence.model_dump())
     db_licence.check_status()
     db.add(db_licence)
@@ -86,8 +207,19 @@ def create_licence(db: Session, licence: schemas.LicenceCreate):
     db.refresh(db_licence)
     return db_licence
 
+def create_licences(db: Session, licences: list[schemas.LicenceCreate]):
+    logger.info("Creating %s licence(s)", len(licences))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [licence.model_dump() for licence in licences]
+    for row in rows:
+        # Same rule as Licence.check_status
+        row["expiration_date"] = models.naive_utc(row["expiration_date"])
+        if row["expiration_date"] < now:
+            row["isHealthy"] = False
+    return _bulk_insert(db, models.Licence, rows)
+
 def update_licence_status(db: Session, licence_id: int, status: bool):
-    logger.info(f"Updating licence status for ID {licence_id} to {status}")
+    logger.info("Updating licence status for ID %s to %s", licence_id, status)
     db_licence = get_licence(db, licence_id)
     if db_licence.isHealthy != status:
         db_licence.isHealthy = status
@@ -96,117 +228,235 @@ def update_licence_status(db: Session, licence_id: int, status: bool):
         db.refresh(db_licence)
     return db_licence
 
+def _sweep_expired_licences(db: Session) -> list:
+    """Turn off the licences which expired, without committing, and return their ids"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    stmt = (
+        update(models.Licence)
+        .where(models.Licence.expiration_date < now, models.Licence.isHealthy.is_not(False))
+        .values(isHealthy=False)
+        .execution_options(synchronize_session=False)
+    )
+    licence_ids = execute_update(db, stmt, models.Licence, False, "expiration")
+    for licence_id in licence_ids:
+        graph_cache.record(db, models.Licence, licence_id, False)
+    return licence_ids
+
 def update_licences_health_status(db: Session):
     logger.info("Updating all licences health status based on expiration dates")
-    licences = db.query(models.Licence).all()
-    updated_count = 0
-    
-    for licence in licences:
-        original_status = licence.isHealthy
-        licence.check_status()
-        if licence.isHealthy != original_status:
-            updated_count += 1
-            db.commit()
-            db.refresh(licence)
+    updated_count = len(_sweep_expired_licences(db))
+    db.commit()
     
-    logger.info(f"Updated {updated_count} licence(s) health status based on expiration")
+    logger.info("Updated %s licence(s) health status based on expiration", updated_count)
     return {"message": f"Updated {updated_count} licence(s) health status based on expiration"}
 
-def update_power_health_status(db: Session):
-    logger.info("Checking power status for all alimentations.")
-    alimentations = db.query(models.Alimentation).all()
-    for alim in alimentations:
-        if not alim.isHealthy:
-            continue
-
-        connected_robots = db.query(models.Robot).filter(models.Robot.alimentation_id == alim.id).all()
+def expire_licences(db: Session):
+    logger.info("Expiring licences and turning off the robots depending on them")
+    try:
+        expired = _sweep_expired_licences(db)
+        disabled = 0
+        if expired:
+            # Only the descendants of the licences which just expired are re-evaluated
+            disabled = propagation.totals(propagation.propagate_changes(db, {models.Licence: expired}))["disabled"]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info("%s licence(s) expired, %s entities turned off", len(expired), disabled)
+    return {"expired": len(expired), "disabled": disabled}
 
-        healthy_robots = [r for r in connected_robots if r.isHealthy]
+def get_next_licence_expiration(db: Session):
+    return db.query(func.min(models.Licence.expiration_date)).filter(models.Licence.isHealthy == True).scalar()
 
-        current_load = sum(r.power_consumption for r in healthy_robots)
+def shed_overloaded_robots(db: Session, alimentation_ids=None):
+    """Turn off robots on overloaded alimentations without committing, and return their ids"""
+    # The maintained load aggregates give the overloaded alimentations through the headroom index
+    overloaded_alimentations = (
+        select(models.Alimentation.id, models.Alimentation.capacity)
+        .where(models.Alimentation.isHealthy == True)
+        .where(models.Alimentation.capacity - models.Alimentation.current_load < 0)
+    )
+    if alimentation_ids is not None:
+        overloaded_alimentations = overloaded_alimentations.where(models.Alimentation.id.in_(alimentation_ids))
+    overloaded_ids, capacities = power.fetch_int_columns(db, overloaded_alimentations)
 
-        if current_load > alim.capacity:
-            logger.warning(f"Alimentation {alim.id} is overloaded! Capacity: {alim.capacity}, Load: {current_load}")
+    # Load the healthy robots of overloaded alimentations and shed them in one pass
+    robot_columns = [
+        power.fetch_int_columns(db, select(models.Robot.alimentation_id, power.consumption_expression, models.Robot.id).where(
+            models.Robot.isHealthy == True, models.Robot.alimentation_id.in_(chunk)
+        ))
+        for chunk in power.chunks(overloaded_ids.tolist())
+    ]
+    robot_columns = np.concatenate(robot_columns, axis=1) if robot_columns else np.empty((3, 0), dtype=np.int64)
+    robot_ids, overloaded = power.select_robots_to_turn_off(*robot_columns, overloaded_ids, capacities)
 
-            sorted_robots_to_turn_off = sorted(healthy_robots, key=lambda r: (r.power_consumption, r.id), reverse=True)
+    for alimentation_id, capacity, current_load in zip(*overloaded):
+        logger.warning("Alimentation %s is overloaded! Capacity: %s, Load: %s", alimentation_id, capacity, current_load)
 
-            for robot in sorted_robots_to_turn_off:
-                if current_load <= alim.capacity:
-                    break
+    robot_ids = robot_ids.tolist()
+    power.turn_off_robots(db, robot_ids)
+    logger.info("%s robot(s) turned off to reduce load.", len(robot_ids))
+    return robot_ids
 
-                robot.isHealthy = False
-                current_load -= robot.power_consumption
-                db.commit()
-                db.refresh(robot)
-                logger.info(f"Robot {robot.id} turned off on alimentation {alim.id} to reduce load.")
+def update_power_health_status(db: Session, alimentation_ids=None):
+    logger.info("Checking power status for all alimentations.")
+    try:
+        robot_ids = shed_overloaded_robots(db, alimentation_ids)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(robot_ids)
 
 def update_robot_status(db: Session, robot_id: int, status: bool):
-    logger.info(f"Updating robot status for ID {robot_id} to {status}")
+    logger.info("Updating robot status for ID %s to %s", robot_id, status)
+    # Check if related objects are healthy, from the dependency graph cache
+    if status and not graph_cache.robot_parents_healthy(db, robot_id):
+        logger.error("Related objects for robot ID %s are not healthy", robot_id)
+        raise HTTPException(status_code=400, detail="Related objects are not healthy")
     db_robot = get_robot(db, robot_id)
-    if status:
-        # Check if related objects are healthy
-        alimentation = get_alimentation(db, db_robot.alimentation_id)
-        guidage = get_guidage(db, db_robot.guidage_id)
-        licence = get_licence(db, db_robot.licence_id)
-        if (alimentation and not alimentation.isHealthy) or \
-           (guidage and not guidage.isHealthy) or \
-           (licence and not licence.isHealthy):
-            logger.error(f"Related objects for robot ID {robot_id} are not healthy")
-            raise HTTPException(status_code=400, detail="Related objects are not healthy")
-    db_robot.isHealthy = status
+    db_robot.set_status(status)
     db.commit()
     db.refresh(db_robot)
     return db_robot
 
 def update_robots_health_status(db: Session):
     logger.info("Updating robots health status based on related objects")
+    timings = {}
     
     # First, update all licences based on expiration dates
-    update_licences_health_status(db)
-    
-    # Get all unhealthy alimentations
-    unhealthy_alimentations = db.query(models.Alimentation).filter(models.Alimentation.isHealthy == False).all()
-    # Get all unhealthy guidages
-    unhealthy_guidages = db.query(models.Guidage).filter(models.Guidage.isHealthy == False).all()
-    # Get all unhealthy licences
-    unhealthy_licences = db.query(models.Licence).filter(models.Licence.isHealthy == False).all()
-
-    # Update robots linked to unhealthy alimentations
-    for alimentation in unhealthy_alimentations:
-        robots = db.query(models.Robot).filter(models.Robot.alimentation_id == alimentation.id).all()
-        for robot in robots:
-            robot.isHealthy = False
-            db.commit()
-            db.refresh(robot)
-
-    # Update robots linked to unhealthy guidages
-    for guidage in unhealthy_guidages:
-        robots = db.query(models.Robot).filter(models.Robot.guidage_id == guidage.id).all()
-        for robot in robots:
-            robot.isHealthy = False
-            db.commit()
-            db.refresh(robot)
-
-    # Update robots linked to unhealthy licences
-    for licence in unhealthy_licences:
-        robots = db.query(models.Robot).filter(models.Robot.licence_id == licence.id).all()
-        for robot in robots:
-            robot.isHealthy = False
-            db.commit()
-            db.refresh(robot)
-    
-    unhealthy_robots = db.query(models.Robot).filter(models.Robot.isHealthy == False).all()
-    print(f"Unhealthy robots found: {len(unhealthy_robots)}")
-    for robot in unhealthy_robots:
-        alimentation = db.query(models.Alimentation).filter(models.Alimentation.id == robot.alimentation_id).first()
-        guidage = db.query(models.Guidage).filter(models.Guidage.id == robot.guidage_id).first()
-        licence = db.query(models.Licence).filter(models.Licence.id == robot.licence_id).first()
-        if alimentation and alimentation.isHealthy and guidage and guidage.isHealthy and licence and licence.isHealthy:
-            robot.isHealthy = True
-            db.commit()
-            db.refresh(robot)
-
-    update_power_health_status(db)
-    # return {"message": "Unhealthy robots updated if all related objects are healthy."}
-
-    return {"message": "Robots health status updated based on related objects"}
+    with metrics.phase("licence_sweep", timings):
+        update_licences_health_status(db)
+
+    # Then propagate parent health to robots with set-based updates
+    changes = propagation.propagate_robots_health(db, timings)
+
+    with metrics.phase("power_shedding", timings):
+        update_power_health_status(db)
+
+    logger.info("Robots health status updated in %.3fs, by phase: %s", sum(timings.values()), timings)
+    return {"message": "Robots health status updated based on related objects", **changes, "timings": timings}
+
+def _recheck_power(db: Session, parent_ids: dict):
+    # Recovered robots add load, so re-check the alimentations they are connected to
+    alimentation_ids = set(parent_ids.get(models.Alimentation, ()))
+    others = {parent_model: ids for parent_model, ids in parent_ids.items() if parent_model is not models.Alimentation}
+    # Robots below the other parents, at any depth of the dependency graph
+    scope = dependency_graph.graph.affected_scope(models.Robot, others)
+    if scope is not None:
+        alimentation_ids.update(db.scalars(select(models.Robot.alimentation_id).where(scope).distinct()))
+    update_power_health_status(db, list(alimentation_ids))
+
+def update_robots_health_for_parent(db: Session, parent_model, parent_id: int):
+    logger.info("Updating health status of robots linked to %s %s", parent_model.__name__, parent_id)
+    changes = propagation.propagate_parent_health(db, parent_model, parent_id)
+    if changes["recovered"]:
+        with metrics.phase("power_shedding"):
+            _recheck_power(db, {parent_model: [parent_id]})
+
+    return {"message": f"Robots linked to {parent_model.__name__} {parent_id} updated", **changes}
+
+def update_robots_health_for_parents(db: Session, parent_ids: dict):
+    """Update the robots linked to any of the {parent model: parent ids} parents at once"""
+    logger.info("Updating health status of robots linked to %s parent(s)", sum(len(ids) for ids in parent_ids.values()))
+    changes = propagation.propagate_parents_health(db, parent_ids)
+    if changes["recovered"]:
+        with metrics.phase("power_shedding"):
+            _recheck_power(db, parent_ids)
+
+    return {"message": "Robots linked to the changed parents updated", **changes}
+
+ENTITY_MODELS = {
+    schemas.EntityType.robot: models.Robot,
+    schemas.EntityType.alimentation: models.Alimentation,
+    schemas.EntityType.guidage: models.Guidage,
+    schemas.EntityType.licence: models.Licence,
+}
+
+# Entity types other entities depend on
+PARENT_ENTITY_TYPES = tuple(entity_type for entity_type, model in ENTITY_MODELS.items() if dependency_graph.graph.children(model))
+
+def _load_by_ids(db: Session, model, ids):
+    ids = set(ids)
+    if not ids:
+        return {}
+    objects = {obj.id: obj for obj in db.query(model).filter(model.id.in_(ids)).all()}
+    missing = ids - objects.keys()
+    if missing:
+        logger.error("%s with IDs %s not found", model.__name__, sorted(missing))
+        raise HTTPException(status_code=400, detail="Missing object")
+    return objects
+
+def apply_status_changes(db: Session, changes: list[schemas.StatusChange]):
+    """
+    Apply a batch of status changes atomically, then propagate them to the robots
+    once for the whole batch. Returns the robots whose health changed.
+    """
+    logger.info("Applying %s status change(s)", len(changes))
+    try:
+        objects = {
+            entity_type: _load_by_ids(db, model, [change.id for change in changes if change.entity_type == entity_type])
+            for entity_type, model in ENTITY_MODELS.items()
+        }
+        robots = objects[schemas.EntityType.robot]
+        initial_robot_health = {robot_id: robot.isHealthy for robot_id, robot in robots.items()}
+
+        # Later changes of the same entity win
+        for change in changes:
+            obj = objects[change.entity_type][change.id]
+            if change.entity_type == schemas.EntityType.robot:
+                obj.set_status(change.status)
+            else:
+                obj.isHealthy = change.status
+            if change.entity_type == schemas.EntityType.licence:
+                obj.check_status()
+
+        # Robots can only be turned on when their parents are healthy once the batch is applied
+        turned_on = [robot for robot in robots.values() if robot.isHealthy]
+        for model, column in propagation.ROBOT_PARENTS:
+            parents = _load_by_ids(db, model, [getattr(robot, column.key) for robot in turned_on])
+            for robot in turned_on:
+                if not parents[getattr(robot, column.key)].isHealthy:
+                    logger.error("Related objects for robot ID %s are not healthy", robot.id)
+                    raise HTTPException(status_code=400, detail="Related objects are not healthy")
+        db.flush()
+
+        # Propagate to the descendants of the changed parents, except the entities set by the batch
+        changed = {ENTITY_MODELS[entity_type]: list(objects[entity_type]) for entity_type in PARENT_ENTITY_TYPES if objects[entity_type]}
+        excluded = {ENTITY_MODELS[entity_type]: list(entities) for entity_type, entities in objects.items() if entities}
+        propagated = propagation.propagate_changes(db, changed, exclude=excluded, collect={models.Robot})
+        disabled, recovered = propagated.get(models.Robot, ([], []))
+
+        # Robots turned on add load to their alimentations
+        recovered_robots = select(models.Robot.alimentation_id).where(models.Robot.id.in_(recovered + [robot.id for robot in turned_on]))
+        alimentation_ids = set(objects[schemas.EntityType.alimentation]) | set(db.scalars(recovered_robots))
+        shed = shed_overloaded_robots(db, alimentation_ids) if alimentation_ids else []
+        manual = {robot_id: robot.isHealthy for robot_id, robot in robots.items() if robot.isHealthy != initial_robot_health[robot_id]}
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    result = {robot_id: {"id": robot_id, "isHealthy": status, "cause": "manual"} for robot_id, status in manual.items()}
+    for robot_id in disabled:
+        result[robot_id] = {"id": robot_id, "isHealthy": False, "cause": "propagation"}
+    for robot_id in recovered:
+        result[robot_id] = {"id": robot_id, "isHealthy": True, "cause": "propagation"}
+    for robot_id in shed:
+        # A robot turned on by the batch then shed is back to its initial state
+        if result.pop(robot_id, None) is None:
+            result[robot_id] = {"id": robot_id, "isHealthy": False, "cause": "power"}
+    logger.info("%s status change(s) applied, %s robot(s) changed", len(changes), len(result))
+    return {"applied": len(changes), "robots": sorted(result.values(), key=lambda change: change["id"])}
+
+def simulate_status_changes(db: Session, request: schemas.SimulationRequest, limit: int = 1000):
+    """
+    Compute the robots turned off or on and the alimentation loads if the given
+    entities failed and the licences expired, without changing anything.
+    """
+    failures = {}
+    for failure in request.failures:
+        failures.setdefault(ENTITY_MODELS[failure.entity_type], set()).add(failure.id)
+    result = simulation.simulate(db, failures, request.licence_expirations, request.at, limit)
+    logger.info("Simulated %s failure(s): %s robot(s) would change", len(request.failures), result["robots_changed"])
+    return result
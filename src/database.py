@@ -1,13 +1,69 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from . import config
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Async drivers used for each synchronous database URL scheme
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+def engine_options(url: str) -> dict:
+    """Connection and pool options suited to the database of the URL"""
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return {"pool_size": config.DATABASE_POOL_SIZE, "max_overflow": config.DATABASE_MAX_OVERFLOW, "pool_pre_ping": True}
+    options = {"connect_args": {"check_same_thread": False}}
+    if url.database in (None, "", ":memory:"):
+        # An in-memory database only lives as long as its connection: share a single one
+        options["poolclass"] = StaticPool
+    else:
+        # With WAL, connections read concurrently: keep one per thread serving requests
+        options["pool_size"] = config.DATABASE_POOL_SIZE
+        options["max_overflow"] = config.DATABASE_MAX_OVERFLOW
+    return options
+
+def apply_profile(engine, profile: str = config.DATABASE_PROFILE):
+    """Set the pragmas of the performance profile on every new connection of a SQLite engine"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if profile != "performance" or sync_engine.dialect.name != "sqlite":
+        return engine
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in config.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+def create_database_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = config.DATABASE_PROFILE):
+    return apply_profile(create_engine(url, **engine_options(url)), profile)
+
+def create_async_database_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = config.DATABASE_PROFILE):
+    url = async_database_url(url)
+    return apply_profile(create_async_engine(url, **engine_options(url)), profile)
+
+engine = create_database_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_database_engine()
+
+# Objects are not expired on commit: reloading them lazily is not possible outside of the event loop greenlet
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -16,3 +72,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,220 @@
+"""
+Dependency graph of the entities, declaring which entity types depend on which.
+
+An edge is the column of a child entity referencing its parent: an entity with
+an unhealthy parent is turned off, and turned back on once all of its parents
+are healthy. Entities without parents (the roots) only change by API calls.
+Edges closing a cycle are rejected when they are added, so the graph always has
+a topological order, in which every parent comes before its children.
+
+The graph builds the set-based statements propagating the health of the parents
+to one entity type, see src/propagation.py for how they are run.
+"""
+from functools import reduce
+from sqlalchemy import case, literal, or_, select, update
+from . import models
+
+
+class DependencyCycleError(ValueError):
+    """Raised when an edge would make an entity depend on itself"""
+
+
+class Edge:
+    """Column of the child entity type referencing the parent entity type"""
+
+    def __init__(self, column, parent, reason=None):
+        self.column = column
+        self.child = column.class_
+        self.parent = parent
+        # Flag set in the reason column of the child while this parent is unhealthy
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Edge({self.child.__name__}.{self.column.key} -> {self.parent.__name__})"
+
+
+class EntityType:
+
+    def __init__(self, model, reason_column=None):
+        self.model = model
+        self.name = model.__name__.lower()
+        # Integer column holding the flags of the edges to the unhealthy parents, if any
+        self.reason_column = reason_column
+        self.parents = []
+        self.children = []
+
+
+class DependencyGraph:
+    """Entity types and the edges between them, as adjacency lists in both directions"""
+
+    def __init__(self):
+        self.entities = {}
+        self._order = None
+
+    def add_entity(self, model, reason_column=None) -> EntityType:
+        if model in self.entities:
+            raise ValueError(f"{model.__name__} is already registered")
+        entity = self.entities[model] = EntityType(model, reason_column)
+        self._order = None
+        return entity
+
+    def add_edge(self, column, parent, reason=None) -> Edge:
+        """Declare that the entity type of column depends on the parent entity type it references"""
+        edge = Edge(column, parent, reason)
+        for model in (edge.child, parent):
+            if model not in self.entities:
+                raise ValueError(f"{model.__name__} is not registered")
+        path = self._path(edge.child, parent)
+        if path is not None:
+            raise DependencyCycleError(
+                f"{edge!r} closes the cycle {' -> '.join(model.__name__ for model in [parent, *path])}"
+            )
+        self.entities[edge.child].parents.append(edge)
+        self.entities[parent].children.append(edge)
+        self._order = None
+        return edge
+
+    def _path(self, start, target):
+        """Models from start down to target following the children edges, None if target is not a descendant"""
+        stack = [(start, [start])]
+        visited = set()
+        while stack:
+            model, path = stack.pop()
+            if model is target:
+                return path
+            if model in visited:
+                continue
+            visited.add(model)
+            stack.extend((edge.child, path + [edge.child]) for edge in self.entities[model].children)
+        return None
+
+    def parents(self, model) -> list:
+        return self.entities[model].parents
+
+    def children(self, model) -> list:
+        return self.entities[model].children
+
+    @property
+    def order(self) -> tuple:
+        """Entity types in topological order, cached until the graph changes"""
+        if self._order is None:
+            # Kahn's algorithm, keeping the registration order among independent entity types
+            remaining = {model: len(entity.parents) for model, entity in self.entities.items()}
+            ready = [model for model, count in remaining.items() if count == 0]
+            order = []
+            while ready:
+                model = ready.pop(0)
+                order.append(self.entities[model])
+                for edge in self.entities[model].children:
+                    remaining[edge.child] -= 1
+                    if remaining[edge.child] == 0:
+                        ready.append(edge.child)
+            self._order = tuple(order)
+        return self._order
+
+    def derived(self) -> list:
+        """Entity types with parents, whose health is propagated, in topological order"""
+        return [entity for entity in self.order if entity.parents]
+
+    def reason_mask(self, model) -> int:
+        return reduce(lambda mask, edge: mask | int(edge.reason or 0), self.parents(model), 0)
+
+    def event_columns(self, model) -> tuple:
+        """
+        (key, column) pairs describing an entity in the health events: the ids of its
+        parents, and its own id when it is a parent, so that events can be filtered
+        by the parent they relate to.
+        """
+        entity = self.entities[model]
+        columns = [(f"{entity.name}_id", model.id)] if entity.children else []
+        return tuple(columns + [(edge.column.key, edge.column) for edge in entity.parents])
+
+    def affected_scope(self, model, changed: dict):
+        """
+        Clause selecting the entities of model below any of the changed {model: ids}
+        entities, at any depth, or None if none of them is an ancestor of model.
+        """
+        clauses = []
+        for edge in self.parents(model):
+            ids = changed.get(edge.parent)
+            if ids:
+                clauses.append(edge.column.in_(list(ids)))
+            above = self.affected_scope(edge.parent, changed)
+            if above is not None:
+                clauses.append(edge.column.in_(select(edge.parent.id).where(above)))
+        return or_(*clauses) if clauses else None
+
+    def _parent_ids(self, edge, healthy: bool):
+        return select(edge.parent.id).where(edge.parent.isHealthy == healthy)
+
+    def parent_reasons_expression(self, model):
+        """SQL expression of the flags of the unhealthy parents of an entity"""
+        flags = [
+            case((edge.column.in_(self._parent_ids(edge, False)), int(edge.reason)), else_=0)
+            for edge in self.parents(model) if edge.reason is not None
+        ]
+        if not flags:
+            return literal(0)
+        return reduce(lambda left, right: left.op("|")(right), flags)
+
+    def _reason_mask_value(self, model, parent_reasons):
+        # The parent flags are recomputed, the others kept
+        column = self.entities[model].reason_column
+        return column.op("&")(~self.reason_mask(model)).op("|")(parent_reasons)
+
+    def disable_statement(self, model, *scope):
+        """UPDATE turning off the entities, within the scope, with at least one unhealthy parent"""
+        values = {"isHealthy": False}
+        reason_column = self.entities[model].reason_column
+        if reason_column is not None:
+            values[reason_column.key] = self._reason_mask_value(model, self.parent_reasons_expression(model))
+        return (
+            update(model)
+            .where(*scope)
+            .where(model.isHealthy.is_not(False))
+            .where(or_(*(edge.column.in_(self._parent_ids(edge, False)) for edge in self.parents(model))))
+            .values(values)
+            .execution_options(synchronize_session=False)
+        )
+
+    def refresh_reasons_statement(self, model, *scope):
+        """UPDATE recomputing the parent reasons of the entities, within the scope, already turned off"""
+        reason_column = self.entities[model].reason_column
+        parent_reasons = self.parent_reasons_expression(model)
+        return (
+            update(model)
+            .where(*scope)
+            .where(model.isHealthy == False)
+            .where(reason_column.op("&")(self.reason_mask(model)) != parent_reasons)
+            .values({reason_column.key: self._reason_mask_value(model, parent_reasons)})
+            .execution_options(synchronize_session=False)
+        )
+
+    def recover_statement(self, model, *scope):
+        """
+        UPDATE turning back on the unhealthy entities, within the scope, whose parents all exist
+        and are healthy. Entities also down for a reason other than their parents, e.g. turned
+        off manually or shed for load, are left off: only the flags of the edges are cleared.
+        """
+        values = {"isHealthy": True}
+        stmt = update(model).where(*scope).where(model.isHealthy == False)
+        reason_column = self.entities[model].reason_column
+        if reason_column is not None:
+            values[reason_column.key] = 0
+            stmt = stmt.where(reason_column.op("&")(~self.reason_mask(model)) == 0)
+        return (
+            stmt
+            .where(*(edge.column.in_(self._parent_ids(edge, True)) for edge in self.parents(model)))
+            .values(values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+graph = DependencyGraph()
+
+for _model in (models.Alimentation, models.Guidage, models.Licence):
+    graph.add_entity(_model)
+graph.add_entity(models.Robot, reason_column=models.Robot.reason_mask)
+graph.add_edge(models.Robot.alimentation_id, models.Alimentation, models.HealthReason.ALIMENTATION_DOWN)
+graph.add_edge(models.Robot.guidage_id, models.Guidage, models.HealthReason.GUIDAGE_DOWN)
+graph.add_edge(models.Robot.licence_id, models.Licence, models.HealthReason.LICENCE_EXPIRED)
@@ -0,0 +1,96 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from . import models, power
+import csv
+import enum
+import io
+import logging
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the server-side cursor and written to the response at once
+BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    models.Robot.id,
+    models.Robot.name,
+    models.Robot.isHealthy,
+    # Names of the HealthReason flags of the robot, as in the list responses
+    models.Robot.reason_mask.label("reasons"),
+    models.Robot.motor,
+    power.consumption_expression.label("consumption"),
+    models.Robot.alimentation_id,
+    models.Alimentation.isHealthy.label("alimentation_isHealthy"),
+    models.Alimentation.alimentationType.label("alimentationType"),
+    models.Alimentation.capacity.label("alimentation_capacity"),
+    models.Robot.guidage_id,
+    models.Guidage.isHealthy.label("guidage_isHealthy"),
+    models.Robot.licence_id,
+    models.Licence.isHealthy.label("licence_isHealthy"),
+    models.Licence.expiration_date.label("licence_expiration_date"),
+)
+
+FIELDNAMES = [column.key for column in EXPORT_COLUMNS]
+REASONS_INDEX = FIELDNAMES.index("reasons")
+
+def export_statement(*filters):
+    """Robots joined with the state of their alimentation, guidage and licence"""
+    return (
+        select(*EXPORT_COLUMNS)
+        .outerjoin(models.Alimentation, models.Alimentation.id == models.Robot.alimentation_id)
+        .outerjoin(models.Guidage, models.Guidage.id == models.Robot.guidage_id)
+        .outerjoin(models.Licence, models.Licence.id == models.Robot.licence_id)
+        .where(*filters)
+        .order_by(models.Robot.id)
+    )
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+def _partitions(db: Session, *filters):
+    # yield_per streams the rows through a server-side cursor instead of buffering the whole result
+    result = db.execute(export_statement(*filters).execution_options(yield_per=BATCH_SIZE))
+    return result.partitions()
+
+def _batches(db: Session, *filters):
+    for partition in _partitions(db, *filters):
+        batch = [[_plain(value) for value in row] for row in partition]
+        for row in batch:
+            row[REASONS_INDEX] = "|".join(models.reason_names(row[REASONS_INDEX]))
+        yield batch
+
+def _document(row) -> dict:
+    document = dict(zip(FIELDNAMES, row))
+    document["reasons"] = models.reason_names(document["reasons"])
+    return document
+
+def iter_ndjson(db: Session, *filters):
+    """Yield the export as newline-delimited JSON, one robot per line"""
+    count = 0
+    # orjson writes the enums and dates itself
+    for partition in _partitions(db, *filters):
+        count += len(partition)
+        yield b"".join(orjson.dumps(_document(row), option=orjson.OPT_APPEND_NEWLINE) for row in partition)
+    logger.info("Exported %s robot(s) as NDJSON", count)
+
+def iter_csv(db: Session, *filters):
+    """Yield the export as CSV, with a header line"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDNAMES)
+    count = 0
+    for batch in _batches(db, *filters):
+        count += len(batch)
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only export
+    if buffer.tell():
+        yield buffer.getvalue()
+    logger.info("Exported %s robot(s) as CSV", count)
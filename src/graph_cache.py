@@ -0,0 +1,221 @@
+from collections import OrderedDict
+from itertools import chain
+from fastapi import HTTPException
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from . import models, propagation
+import functools
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+PARENT_MODELS = tuple(model for model, _ in propagation.ROBOT_PARENTS)
+CACHED_MODELS = {model.__tablename__: model for model in (models.Robot, *PARENT_MODELS)}
+ROBOT_PARENT_COLUMNS = tuple(column for _, column in propagation.ROBOT_PARENTS)
+
+# Changes flushed by a session, applied to the cache once its transaction commits
+PENDING_KEY = "graph_cache_pending"
+
+_MISSING = object()
+
+@functools.lru_cache(maxsize=None)
+def _url_key(url) -> str:
+    return url.set(drivername=url.get_backend_name()).render_as_string(hide_password=True)
+
+def database_key(bind) -> str:
+    """Identify a database independently of its driver, so sync and async engines share the cache"""
+    return _url_key(bind.engine.url)
+
+def _cached_value(obj):
+    if isinstance(obj, models.Robot):
+        return tuple(getattr(obj, column.key) for column in ROBOT_PARENT_COLUMNS)
+    return obj.isHealthy
+
+class DependencyGraphCache:
+    """
+    Process-local cache of the dependency graph: the health of the alimentations,
+    guidages and licences, and the parents of each robot.
+
+    Entries are read through from the database on a miss, written through when a
+    transaction changing them commits, and evicted least recently used first once
+    max_size entries per table are held. Robot health is not cached: it is changed
+    by set-based updates and read from the database along with the robot.
+    """
+
+    def __init__(self, max_size: int = 100_000):
+        self.max_size = max_size
+        # Database the cache was warmed for, sessions bound to other databases bypass it
+        self.key = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Incremented by every write, so that a read-through racing with a write does not cache a stale value
+        self._generation = 0
+        self._entries = {model: OrderedDict() for model in CACHED_MODELS.values()}
+        self._lock = threading.Lock()
+        # Called with the changes of every committed transaction, e.g. to notify other workers
+        self.subscribers = []
+
+    def enabled_for(self, db: Session) -> bool:
+        return self.key is not None and self.key == database_key(db.get_bind())
+
+    def warm(self, db: Session):
+        """
+        Bind the cache to the database of the session and load up to max_size entries per table.
+        The tables are read without holding the lock: lookups are served, read through, meanwhile.
+        """
+        with self._lock:
+            self.key = database_key(db.get_bind())
+            self._generation += 1
+            for entries in self._entries.values():
+                entries.clear()
+        statements = {model: select(model.id, model.isHealthy) for model in PARENT_MODELS}
+        statements[models.Robot] = select(models.Robot.id, *ROBOT_PARENT_COLUMNS)
+        for model, stmt in statements.items():
+            for _ in range(2):
+                generation = self._generation
+                rows = db.execute(stmt.order_by(model.id).limit(self.max_size)).all()
+                with self._lock:
+                    # Rows read while a write committed may be stale, read them again
+                    if generation != self._generation:
+                        continue
+                    for entity_id, *value in rows:
+                        self._put(model, entity_id, tuple(value) if model is models.Robot else value[0])
+                    break
+            else:
+                logger.warning("%s written while being loaded, read through instead", model.__tablename__)
+        logger.info("Dependency graph cache warmed with %s entries", self.size())
+
+    def reset(self):
+        """Unbind the cache and drop all of its entries and metrics"""
+        with self._lock:
+            self.key = None
+            self._generation += 1
+            for entries in self._entries.values():
+                entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            for entries in self._entries.values():
+                entries.clear()
+
+    def size(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "size": {model.__tablename__: len(entries) for model, entries in self._entries.items()},
+            "max_size": self.max_size,
+        }
+
+    def _get(self, model, entity_id):
+        entries = self._entries[model]
+        with self._lock:
+            value = entries.get(entity_id, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                entries.move_to_end(entity_id)
+                self.hits += 1
+            return value
+
+    def _put(self, model, entity_id, value):
+        entries = self._entries[model]
+        entries[entity_id] = value
+        entries.move_to_end(entity_id)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, db: Session, model, entity_id, stmt):
+        enabled = self.enabled_for(db)
+        if enabled:
+            value = self._get(model, entity_id)
+            if value is not _MISSING:
+                return value
+            generation = self._generation
+        row = db.execute(stmt).first()
+        if row is None:
+            logger.error("%s with ID %s not found", model.__name__, entity_id)
+            raise HTTPException(status_code=400, detail="Missing object")
+        value = row[0] if model is not models.Robot else tuple(row)
+        # Values read while the session holds flushed but uncommitted changes may be rolled back
+        if enabled and not db.info.get(PENDING_KEY):
+            with self._lock:
+                if generation == self._generation:
+                    self._put(model, entity_id, value)
+        return value
+
+    def parent_health(self, db: Session, model, parent_id: int) -> bool:
+        return self._lookup(db, model, parent_id, select(model.isHealthy).where(model.id == parent_id))
+
+    def robot_parents(self, db: Session, robot_id: int) -> tuple:
+        """Ids of the parents of a robot, in the order of propagation.ROBOT_PARENTS"""
+        stmt = select(*ROBOT_PARENT_COLUMNS).where(models.Robot.id == robot_id)
+        return self._lookup(db, models.Robot, robot_id, stmt)
+
+    def robot_parents_healthy(self, db: Session, robot_id: int) -> bool:
+        parent_ids = self.robot_parents(db, robot_id)
+        health = [self.parent_health(db, model, parent_id) for model, parent_id in zip(PARENT_MODELS, parent_ids)]
+        return all(health)
+
+    def record(self, db: Session, model, entity_id: int, value):
+        """Write a change made outside of the ORM through to the cache when the session commits"""
+        db.info.setdefault(PENDING_KEY, []).append((model, entity_id, value))
+
+    def apply(self, changes):
+        with self._lock:
+            self._generation += 1
+            for model, entity_id, value in changes:
+                self._put(model, entity_id, value)
+        for callback in self.subscribers:
+            callback(changes)
+
+    def invalidate(self, keys):
+        """Drop the (model, id) entries changed elsewhere, they are read through again on the next lookup"""
+        with self._lock:
+            self._generation += 1
+            for model, entity_id in keys:
+                self._entries[model].pop(entity_id, None)
+
+graph_cache = DependencyGraphCache()
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_changes(session, flush_context):
+    # new and dirty still list the objects written by this flush, with their ids assigned
+    for obj in chain(session.new, session.dirty):
+        if type(obj) in graph_cache._entries:
+            graph_cache.record(session, type(obj), obj.id, _cached_value(obj))
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_changes(session):
+    changes = session.info.pop(PENDING_KEY, None)
+    if changes and graph_cache.enabled_for(session):
+        graph_cache.apply(changes)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_changes(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+def _record_propagated_changes(db, model, ids, healthy):
+    # Parents can themselves be turned on and off by the set-based propagation
+    if model in PARENT_MODELS:
+        for entity_id in ids:
+            graph_cache.record(db, model, entity_id, healthy)
+
+propagation.listeners.append(_record_propagated_changes)
+
+def _clear_on_drop(target, connection, **kw):
+    if graph_cache.key == database_key(connection):
+        graph_cache.clear()
+
+for _model in CACHED_MODELS.values():
+    event.listen(_model.__table__, "after_drop", _clear_on_drop)
@@ -0,0 +1,205 @@
+"""
+Stream of the health changes committed to the database, pushed to the clients
+subscribed to the /events endpoints.
+
+Changes are recorded by the session writing them, from the attribute history of
+the flushed objects or the RETURNING rows of the set-based UPDATEs, and published
+once its transaction commits. They are only collected while someone listens:
+local subscribers, or the subscribers of the other workers, which announce how
+many they have.
+"""
+from collections import deque
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from . import config
+from .dependency_graph import graph
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Events recorded by a session, published once its transaction commits
+PENDING_KEY = "health_stream_pending"
+
+class SubscriptionDropped(Exception):
+    """Raised to a subscriber which did not keep up with the events"""
+
+class Subscription:
+    """
+    Events matching the filters of one client, buffered until it reads them.
+    A client falling more than buffer_size events behind is dropped rather
+    than slowing down the others or holding an unbounded backlog.
+    """
+
+    def __init__(self, stream, loop, filters: dict, buffer_size: int):
+        self.stream = stream
+        self.loop = loop
+        self.filters = filters
+        self.buffer_size = buffer_size
+        self.dropped = False
+        self._events = deque()
+        self._ready = asyncio.Event()
+
+    def matches(self, health_event: dict) -> bool:
+        return all(health_event.get(field) == value for field, value in self.filters.items())
+
+    def _offer(self, events):
+        # Runs in the event loop of the subscriber
+        if self.dropped:
+            return
+        if len(self._events) + len(events) > self.buffer_size:
+            logger.warning("Dropping a health stream subscriber %s event(s) behind", len(self._events) + len(events))
+            self.dropped = True
+            self._events.clear()
+            self.stream.unsubscribe(self, dropped=True)
+        else:
+            self._events.extend(events)
+        self._ready.set()
+
+    async def get(self, timeout: float = None) -> list:
+        """Wait for the next events, returning an empty list after timeout seconds without any"""
+        if not self._events and not self.dropped:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        if self.dropped:
+            raise SubscriptionDropped()
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+class HealthStream:
+    """Fan-out of the committed health events to the subscriptions of this process"""
+
+    def __init__(self, buffer_size: int = config.STREAM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        # Subscriptions of the other workers by worker id, replaced rather than modified
+        self.remote_subscriptions = {}
+        self.published = 0
+        self.dropped = 0
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        # Called with the events of every committed transaction, e.g. to relay them to other workers
+        self.subscribers = []
+        # Called with the number of subscriptions of this process when it changes, e.g. to announce it to other workers
+        self.subscription_listeners = []
+
+    @property
+    def relayed(self) -> bool:
+        """Whether another worker has subscribers, to which the events of this one are relayed"""
+        return any(self.remote_subscriptions.values())
+
+    @property
+    def active(self) -> bool:
+        return self.relayed or bool(self._subscriptions)
+
+    def subscription_count(self) -> int:
+        return len(self._subscriptions)
+
+    def set_remote_subscriptions(self, worker: str, count: int):
+        """Record the number of subscriptions announced by another worker"""
+        with self._lock:
+            remote = {other: other_count for other, other_count in self.remote_subscriptions.items() if other != worker}
+            if count:
+                remote[worker] = count
+            self.remote_subscriptions = remote
+
+    def subscribe(self, **filters) -> Subscription:
+        """Subscribe the running event loop to the events matching every given filter"""
+        filters = {field: value for field, value in filters.items() if value is not None}
+        subscription = Subscription(self, asyncio.get_running_loop(), filters, self.buffer_size)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            count = len(self._subscriptions)
+        self._notify_count(count)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription, dropped: bool = False):
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.remove(subscription)
+            self.dropped += dropped
+            count = len(self._subscriptions)
+        self._notify_count(count)
+
+    def _notify_count(self, count: int):
+        for callback in self.subscription_listeners:
+            callback(count)
+
+    def publish(self, events, notify: bool = True):
+        """Hand the events to the matching subscriptions, from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self.published += len(events)
+        for subscription in subscriptions:
+            matching = [health_event for health_event in events if subscription.matches(health_event)]
+            if not matching:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, matching)
+            except RuntimeError:
+                # The event loop of the subscriber was closed
+                self.unsubscribe(subscription)
+        if notify:
+            for callback in self.subscribers:
+                callback(events)
+
+    def record(self, db: Session, events):
+        """Publish the events when the transaction of the session commits"""
+        db.info.setdefault(PENDING_KEY, []).extend(events)
+
+health_stream = HealthStream()
+
+def health_event(entity: str, entity_id: int, old, new, cause: str, **parents) -> dict:
+    return {"entity": entity, "id": entity_id, "old": old, "new": new, "cause": cause, **parents}
+
+def execute_update(db: Session, stmt, model, healthy: bool, cause: str, dependency_graph=graph) -> list:
+    """Execute an UPDATE setting the health of entities of model, record their events, and return their ids"""
+    columns = dependency_graph.event_columns(model)
+    rows = db.execute(stmt.returning(model.id, *(column for _, column in columns))).all()
+    if health_stream.active:
+        entity = dependency_graph.entities[model].name
+        keys = [key for key, _ in columns]
+        health_stream.record(db, [
+            health_event(entity, entity_id, not healthy, healthy, cause, **dict(zip(keys, values)))
+            for entity_id, *values in rows
+        ])
+    return [row[0] for row in rows]
+
+def count_update(db: Session, stmt, model, healthy: bool, cause: str, dependency_graph=graph) -> int:
+    """Execute an UPDATE setting the health of entities of model and return their count, only returning their rows when streamed"""
+    if health_stream.active:
+        return len(execute_update(db, stmt, model, healthy, cause, dependency_graph))
+    return db.execute(stmt).rowcount
+
+def _flushed_event(obj):
+    history = inspect(obj).attrs.isHealthy.history
+    if not history.added:
+        return None
+    fields = {key: getattr(obj, column.key) for key, column in graph.event_columns(type(obj))}
+    old = history.deleted[0] if history.deleted else None
+    return health_event(graph.entities[type(obj)].name, obj.id, old, history.added[0], "manual", **fields)
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_events(session, flush_context):
+    # Created objects have no previous state: only the status changes of existing ones are streamed
+    if not health_stream.active:
+        return
+    events = [_flushed_event(obj) for obj in session.dirty if type(obj) in graph.entities]
+    events = [health_event for health_event in events if health_event is not None]
+    if events:
+        health_stream.record(session, events)
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_events(session):
+    events = session.info.pop(PENDING_KEY, None)
+    if events:
+        health_stream.publish(events)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_events(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
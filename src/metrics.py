@@ -0,0 +1,189 @@
+"""
+Request, database and recompute metrics, exposed in the Prometheus text format.
+"""
+from collections import Counter as _StatementCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+INF_BUCKET = 'le="+Inf"'
+
+# Executions of the same SELECT within one request from which it is reported as an N+1 pattern
+N_PLUS_ONE_THRESHOLD = 10
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in values]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per bucket counts (not cumulative), then the sum and the count of the observations
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, bucket)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, INF_BUCKET)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+class GaugeFunction(Metric):
+    """Gauge read from a callback when the metrics are collected"""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, function):
+        super().__init__(name, help)
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        return [f"{self.name} {value if value is not None else 'NaN'}"]
+
+class CounterFunction(GaugeFunction):
+    """Counter read from a callback when the metrics are collected, named with the _total suffix"""
+    type = "counter"
+
+    def __init__(self, name: str, help: str, function):
+        super().__init__(name if name.endswith("_total") else name + "_total", help, function)
+
+REGISTRY = []
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Latency of the HTTP requests", ("method", "route", "status"))
+REQUEST_QUERIES = Histogram("db_queries_per_request", "SQL statements executed per HTTP request", ("route",), COUNT_BUCKETS)
+REQUEST_COMMITS = Counter("db_commits_total", "Transactions committed by HTTP requests", ("route",))
+N_PLUS_ONE = Counter("db_n_plus_one_total", "Requests repeating the same SELECT at least N_PLUS_ONE_THRESHOLD times", ("route",))
+RECOMPUTE_PHASE_SECONDS = Histogram("recompute_phase_duration_seconds", "Duration of the phases of the health recomputes", ("phase",))
+
+class RequestStats:
+    """SQL statements and commits of the request being served"""
+
+    def __init__(self):
+        self.queries = 0
+        self.commits = 0
+        self.statements = _StatementCounter()
+
+    def repeated_selects(self):
+        return [
+            (statement, count) for statement, count in self.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD and statement.lstrip().upper().startswith("SELECT")
+        ]
+
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.statements[statement] += 1
+
+@event.listens_for(Engine, "commit")
+def _count_commit(conn):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.commits += 1
+
+def record_request(method: str, route: str, status: int, duration: float, stats: RequestStats):
+    REQUEST_SECONDS.observe(duration, method=method, route=route, status=status)
+    REQUEST_QUERIES.observe(stats.queries, route=route)
+    if stats.commits:
+        REQUEST_COMMITS.inc(stats.commits, route=route)
+    repeated = stats.repeated_selects()
+    if repeated:
+        N_PLUS_ONE.inc(route=route)
+        for statement, count in repeated:
+            logger.warning("Possible N+1 query on %s %s: executed %s times: %s", method, route, count, ' '.join(statement.split())[:200])
+
+@contextmanager
+def phase(name: str, timings: dict = None):
+    """Time a phase of a health recompute, optionally recording its duration in timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        RECOMPUTE_PHASE_SECONDS.observe(elapsed, phase=name)
+        if timings is not None:
+            timings[name] = elapsed
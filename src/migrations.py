@@ -0,0 +1,109 @@
+"""
+Bring an existing database file up to date with the models.
+
+Usage: python -m src.migrations [database_url]
+"""
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import AddConstraint, CreateColumn
+from .database import Base, SQLALCHEMY_DATABASE_URL
+from . import capacity, propagation
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Statements filling a column added to an existing table, by (table, column)
+BACKFILLS = {
+    ("robots", "reason_mask"): propagation.backfill_reasons_statement,
+    ("alimentations", "current_load"): capacity.refresh_statement,
+}
+
+def _missing_columns(inspector, table):
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    return [column for column in table.columns if column.name not in existing]
+
+
+def _existing_indexes(conn, inspector, table):
+    if conn.dialect.name == "sqlite":
+        # The SQLite reflection skips the expression indexes
+        stmt = text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL")
+        return set(conn.execute(stmt, {"table": table.name}).scalars())
+    return {index["name"] for index in inspector.get_indexes(table.name)}
+
+def _missing_foreign_keys(inspector, table):
+    existing = {
+        (tuple(fk["constrained_columns"]), fk["referred_table"])
+        for fk in inspector.get_foreign_keys(table.name)
+    }
+    return [
+        constraint for constraint in table.foreign_key_constraints
+        if (tuple(constraint.column_keys), constraint.referred_table.name) not in existing
+    ]
+
+def _rebuild_sqlite_table(conn, table, inspector):
+    """SQLite cannot add constraints to an existing table: copy it into a new one"""
+    old_name = f"_{table.name}_old"
+    columns = [column.name for column in table.columns if column.name in {c["name"] for c in inspector.get_columns(table.name)}]
+    quoted = ", ".join(f'"{name}"' for name in columns)
+    indexes = _existing_indexes(conn, inspector, table)
+    conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"'))
+    # Indexes follow the renamed table, free their names for the new one
+    for name in indexes:
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    table.create(conn)
+    conn.execute(text(f'INSERT INTO "{table.name}" ({quoted}) SELECT {quoted} FROM "{old_name}"'))
+    conn.execute(text(f'DROP TABLE "{old_name}"'))
+
+def migrate(engine):
+    """
+    Create missing tables, add missing columns and foreign keys, create
+    missing indexes and triggers, then fill the added columns.
+    Returns the list of applied operations.
+    """
+    operations = []
+    backfills = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(conn)
+                operations.append(f"create table {table.name}")
+                continue
+
+            # Added columns need a server default, filling the existing rows until they are backfilled
+            missing_columns = _missing_columns(inspector, table)
+            backfills.extend((table.name, column.name) for column in missing_columns if (table.name, column.name) in BACKFILLS)
+            missing = _missing_foreign_keys(inspector, table)
+            if missing and conn.dialect.name == "sqlite":
+                _rebuild_sqlite_table(conn, table, inspector)
+                operations.append(f"rebuild table {table.name} with foreign keys")
+                continue
+            for column in missing_columns:
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}'))
+                operations.append(f"add column {table.name}.{column.name}")
+            for constraint in missing:
+                conn.execute(AddConstraint(constraint))
+                operations.append(f"add foreign key {table.name}({', '.join(constraint.column_keys)})")
+
+            existing_indexes = _existing_indexes(conn, inspector, table)
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    operations.append(f"create index {index.name}")
+
+        if capacity.existing_triggers(conn) != set(capacity.TRIGGERS):
+            capacity.install_triggers(conn)
+            operations.append("create load aggregate triggers")
+        # Last, as the rows copied by a rebuild went through the triggers
+        for table_name, column_name in backfills:
+            conn.execute(BACKFILLS[(table_name, column_name)]())
+            operations.append(f"backfill column {table_name}.{column_name}")
+    for operation in operations:
+        logger.info("Migration: %s", operation)
+    return operations
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    url = sys.argv[1] if len(sys.argv) > 1 else SQLALCHEMY_DATABASE_URL
+    migrate(create_engine(url))
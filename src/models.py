@@ -1,8 +1,16 @@
-from sqlalchemy import Column, Integer, String, Boolean, Enum, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Enum, DateTime, Index, ForeignKey, literal_column
+from sqlalchemy.orm import relationship
 from .database import Base
 import enum
+import functools
 from datetime import datetime, timezone
 
+def naive_utc(value: datetime) -> datetime:
+    """Convert a timezone aware date to the naive UTC dates stored in the DateTime columns"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 class BaseModel(Base):
     __abstract__ = True
     id = Column(Integer, primary_key=True, index=True)
@@ -17,14 +25,74 @@ class MotorType(enum.Enum):
     MOYEN = "MOYEN"
     GRAND = "GRAND"
 
+# Consommation d'énergie par type de moteur
+MOTOR_CONSUMPTION = {
+    MotorType.PETIT: 10,
+    MotorType.MOYEN: 20,
+    MotorType.GRAND: 30,
+}
+
+class HealthReason(enum.IntFlag):
+    """Causes of a robot being turned off, stored as a bitmask in Robot.reason_mask"""
+    ALIMENTATION_DOWN = 1
+    GUIDAGE_DOWN = 2
+    # The licence expired, or was turned off
+    LICENCE_EXPIRED = 4
+    SHED_FOR_LOAD = 8
+    MANUAL = 16
+
+@functools.lru_cache(maxsize=None)
+def reason_names(reason_mask: int) -> tuple:
+    """Names of the HealthReason flags of a bitmask, computed once per distinct bitmask"""
+    return tuple(reason.name.lower() for reason in HealthReason if reason_mask & reason)
+
+def has_reason(reason_mask, reason: HealthReason):
+    """
+    Condition on a robot being down for the given reason. The bit is rendered
+    inline, so that the condition matches the partial index of the reason.
+    """
+    return reason_mask.op("&")(literal_column(str(int(reason)))) != literal_column("0")
+
+def _reason_indexes(reason_mask):
+    """One partial index per reason, holding only the robots down for it"""
+    return [
+        Index(
+            f"ix_robots_reason_{reason.name.lower()}", "id",
+            sqlite_where=has_reason(reason_mask, reason),
+            postgresql_where=has_reason(reason_mask, reason),
+        )
+        for reason in HealthReason
+    ]
+
+def _initial_reason_mask(context):
+    # Robots created turned off are down until their status is changed
+    return 0 if context.get_current_parameters().get("isHealthy") is not False else int(HealthReason.MANUAL)
+
 class Robot(BaseModel):
     __tablename__ = "robots"
 
     name = Column(String, index=True)
-    alimentation_id = Column(Integer)
-    guidage_id = Column(Integer)
-    licence_id = Column(Integer)
+    alimentation_id = Column(Integer, ForeignKey("alimentations.id"))
+    guidage_id = Column(Integer, ForeignKey("guidages.id"))
+    licence_id = Column(Integer, ForeignKey("licences.id"))
     motor = Column(Enum(MotorType), nullable=False)
+    # HealthReason flags of an unhealthy robot, 0 when it is healthy
+    reason_mask = Column(Integer, nullable=False, default=_initial_reason_mask, server_default="0")
+
+    alimentation = relationship("Alimentation")
+    guidage = relationship("Guidage")
+    licence = relationship("Licence")
+
+    __table_args__ = (
+        # Covering index for the per-alimentation load computed by the power shedding,
+        # also serving the alimentation_id and alimentation_id + isHealthy filters
+        Index("ix_robots_alimentation_power", "alimentation_id", "isHealthy", "motor"),
+        # Filters supported by GET /robots/, each parent combined with isHealthy
+        Index("ix_robots_guidage_health", "guidage_id", "isHealthy"),
+        Index("ix_robots_licence_health", "licence_id", "isHealthy"),
+        Index("ix_robots_health", "isHealthy"),
+        *_reason_indexes(reason_mask),
+    )
 
     @property
     def consumption(self):
@@ -32,12 +100,17 @@ class Robot(BaseModel):
         Calcule la consommation d'énergie du robot en fonction de son type de moteur.
         Cette propriété est utilisée pour exposer la consommation dans l'API.
         """
-        motor_consumption = {
-            MotorType.PETIT: 10,
-            MotorType.MOYEN: 20,
-            MotorType.GRAND: 30,
-        }
-        return motor_consumption.get(self.motor, 0)
+        return MOTOR_CONSUMPTION.get(self.motor, 0)
+
+    @property
+    def reasons(self):
+        """Names of the HealthReason flags of the robot, exposed in the API"""
+        return list(reason_names(self.reason_mask or 0))
+
+    def set_status(self, status: bool):
+        """Turn the robot on, clearing its reasons, or off manually"""
+        self.isHealthy = status
+        self.reason_mask = 0 if status else (self.reason_mask or 0) | HealthReason.MANUAL
 
     def __str__(self):
         return f"{self.name} id: {self.id}"
@@ -47,6 +120,25 @@ class Alimentation(BaseModel):
 
     alimentationType = Column(Enum(AlimentationType), nullable=False)
     capacity = Column(Integer, nullable=False)
+    # Aggregates of the robots attached to the alimentation, maintained by the triggers of src/capacity.py:
+    # the consumption of the healthy ones, and the number of robots of each motor type
+    current_load = Column(Integer, nullable=False, default=0, server_default="0")
+    petit_robots = Column(Integer, nullable=False, default=0, server_default="0")
+    moyen_robots = Column(Integer, nullable=False, default=0, server_default="0")
+    grand_robots = Column(Integer, nullable=False, default=0, server_default="0")
+
+    @property
+    def headroom(self):
+        """Consumption the alimentation can still supply"""
+        return self.capacity - self.current_load
+
+    @property
+    def robots_per_motor(self):
+        return {motor.name: getattr(self, f"{motor.name.lower()}_robots") for motor in MotorType}
+
+# Most and least loaded alimentations first, read in order from the index
+Index("ix_alimentations_load", Alimentation.current_load, Alimentation.id)
+Index("ix_alimentations_headroom", Alimentation.capacity - Alimentation.current_load, Alimentation.id)
 
 class Guidage(BaseModel):
     __tablename__ = "guidages"
@@ -54,9 +146,10 @@ class Guidage(BaseModel):
 class Licence(BaseModel):
     __tablename__ = "licences"
 
-    expiration_date = Column(DateTime, nullable=False)
+    expiration_date = Column(DateTime, nullable=False, index=True)
 
     def check_status(self):
         # Check if license has expired
+        self.expiration_date = naive_utc(self.expiration_date)
         if self.expiration_date < datetime.now(timezone.utc).replace(tzinfo=None):
             self.isHealthy = False
@@ -0,0 +1,70 @@
+from fastapi import HTTPException
+import base64
+import threading
+import time
+
+def encode_cursor(last_id: int) -> str:
+    """Build the opaque cursor pointing after the given id"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, _, last_id = base64.urlsafe_b64decode(padded.encode()).decode().partition(":")
+        if prefix != "id":
+            raise ValueError(cursor)
+        return int(last_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _page_query(query, id_column, limit: int, cursor: str = None, skip: int = 0):
+    query = query.order_by(id_column)
+    if cursor is not None:
+        query = query.filter(id_column > decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+    # One extra row tells whether there is a next page
+    return query.limit(limit + 1)
+
+def _split_page(items, limit: int):
+    if len(items) > limit:
+        items = items[:limit]
+        return items, encode_cursor(items[-1].id)
+    return items, None
+
+def paginate(query, model, limit: int, cursor: str = None, skip: int = 0):
+    """
+    Return one page of the query ordered by id, and the cursor of the next page.
+    With a cursor, the page starts right after its id through the primary key
+    index instead of skipping rows.
+    """
+    return _split_page(_page_query(query, model.id, limit, cursor, skip).all(), limit)
+
+def paginate_rows(db, stmt, id_column, limit: int, cursor: str = None, skip: int = 0):
+    """Same as paginate for a Core SELECT of id_column, labelled id: the page is made of rows"""
+    return _split_page(db.execute(_page_query(stmt, id_column, limit, cursor, skip)).all(), limit)
+
+class CountCache:
+    """Total counts of list queries, kept for a few seconds instead of being recomputed on every page"""
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0]
+        count = compute()
+        with self._lock:
+            self._counts[key] = (count, now)
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+count_cache = CountCache()
@@ -0,0 +1,83 @@
+from sqlalchemy import case, update
+import numpy as np
+import itertools
+from . import models
+from .health_stream import count_update
+
+# SQL expression of Robot.consumption, so that it can be computed by the database
+consumption_expression = case(
+    {motor.name: consumption for motor, consumption in models.MOTOR_CONSUMPTION.items()},
+    value=models.Robot.motor,
+    else_=0,
+)
+
+# Maximum number of ids bound in a single IN clause, below the SQLite variable limit
+CHUNK_SIZE = 900
+
+def chunks(values, size=CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def fetch_int_columns(db, stmt):
+    """Execute a select of integer columns and return one NumPy array per column"""
+    result = db.execute(stmt)
+    width = len(result.keys())
+    values = np.fromiter(itertools.chain.from_iterable(result), dtype=np.int64)
+    return values.reshape(-1, width).T
+
+def turn_off_robots(db, robot_ids):
+    """Turn off the given robots with one UPDATE per chunk of ids, recording that they were shed"""
+    table = models.Robot.__table__
+    reason_mask = table.c.reason_mask.op("|")(int(models.HealthReason.SHED_FOR_LOAD))
+    for chunk in chunks(robot_ids):
+        count_update(db, update(table).where(table.c.id.in_(chunk)).values(isHealthy=False, reason_mask=reason_mask), models.Robot, False, "power")
+
+def select_robots_to_turn_off(robot_alimentation_ids, robot_consumptions, robot_ids, alimentation_ids, capacities):
+    """
+    Compute the load-shedding decisions of every alimentation at once.
+
+    The robot arrays describe the healthy robots, the alimentation arrays the
+    healthy alimentations. On each overloaded alimentation, robots are turned off
+    by decreasing consumption then decreasing id until the load fits the capacity.
+
+    Returns the ids of the robots to turn off, and the ids, capacities and loads
+    of the overloaded alimentations.
+    """
+    robot_alimentation_ids = np.asarray(robot_alimentation_ids, dtype=np.int64)
+    robot_consumptions = np.asarray(robot_consumptions, dtype=np.int64)
+    robot_ids = np.asarray(robot_ids, dtype=np.int64)
+    alimentation_ids = np.asarray(alimentation_ids, dtype=np.int64)
+    capacities = np.asarray(capacities, dtype=np.int64)
+    empty = np.empty(0, dtype=np.int64)
+    if len(alimentation_ids) == 0 or len(robot_ids) == 0:
+        return empty, (empty, empty, empty)
+
+    # Map each robot to the dense index of its alimentation, dropping unknown ones
+    order = np.argsort(alimentation_ids)
+    sorted_ids = alimentation_ids[order]
+    position = np.minimum(np.searchsorted(sorted_ids, robot_alimentation_ids), len(sorted_ids) - 1)
+    known = sorted_ids[position] == robot_alimentation_ids
+    groups = order[position[known]]
+    consumptions = robot_consumptions[known]
+    ids = robot_ids[known]
+
+    loads = np.bincount(groups, weights=consumptions, minlength=len(alimentation_ids)).astype(np.int64)
+    overloaded = loads > capacities
+    if not overloaded.any():
+        return empty, (empty, empty, empty)
+
+    # Only robots of overloaded alimentations can be turned off
+    candidates = overloaded[groups]
+    groups, consumptions, ids = groups[candidates], consumptions[candidates], ids[candidates]
+
+    # Largest consumer first, highest id first on ties, grouped by alimentation
+    order = np.lexsort((-ids, -consumptions, groups))
+    groups, consumptions, ids = groups[order], consumptions[order], ids[order]
+
+    # Load already removed from the alimentation before reaching each robot
+    removed = np.cumsum(consumptions) - consumptions
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    removed -= np.repeat(removed[starts], np.diff(np.r_[starts, len(groups)]))
+
+    turn_off = loads[groups] - removed > capacities[groups]
+    return ids[turn_off], (alimentation_ids[overloaded], capacities[overloaded], loads[overloaded])
@@ -0,0 +1,191 @@
+from sqlalchemy import case, or_, update
+from sqlalchemy.orm import Session
+from . import models, metrics
+from .dependency_graph import graph
+from .health_stream import count_update, execute_update
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Parent tables a robot depends on, with the robot column referencing each of them
+ROBOT_PARENTS = tuple((edge.parent, edge.column) for edge in graph.parents(models.Robot))
+
+# Reason recorded on the robots of an unhealthy parent, per parent model
+PARENT_REASONS = {edge.parent: edge.reason for edge in graph.parents(models.Robot)}
+PARENT_REASON_MASK = graph.reason_mask(models.Robot)
+
+# Cause of the health changes made by the propagation, in the health stream
+CAUSE = "propagation"
+
+# Called with (session, model, ids, healthy) for the parent entities whose health the propagation changed
+listeners = []
+
+def parent_reasons_expression():
+    """SQL expression of the HealthReason flags of the unhealthy parents of a robot"""
+    return graph.parent_reasons_expression(models.Robot)
+
+def parent_column(parent_model):
+    """Return the robot column referencing the given parent model"""
+    for model, column in ROBOT_PARENTS:
+        if model is parent_model:
+            return column
+    raise ValueError(f"{parent_model.__name__} is not a robot parent")
+
+def disable_statement(*scope):
+    """UPDATE turning off the robots, within the scope, linked to at least one unhealthy parent"""
+    return graph.disable_statement(models.Robot, *scope)
+
+def refresh_reasons_statement(*scope):
+    """UPDATE recomputing the parent reasons of the robots, within the scope, already turned off"""
+    return graph.refresh_reasons_statement(models.Robot, *scope)
+
+def recover_statement(*scope):
+    """UPDATE turning back on the unhealthy robots, within the scope, whose parents all exist and are healthy"""
+    return graph.recover_statement(models.Robot, *scope)
+
+def backfill_reasons_statement():
+    """UPDATE giving their reasons to the unhealthy robots of a database created without them"""
+    parent_reasons = parent_reasons_expression()
+    return (
+        update(models.Robot)
+        .where(models.Robot.isHealthy == False)
+        .values(reason_mask=case((parent_reasons != 0, parent_reasons), else_=int(models.HealthReason.MANUAL)))
+        .execution_options(synchronize_session=False)
+    )
+
+def _update(db: Session, dependency_graph, stmt, model, healthy: bool, collect: bool):
+    children = dependency_graph.children(model)
+    if not (collect or children):
+        return count_update(db, stmt, model, healthy, CAUSE, dependency_graph)
+    ids = execute_update(db, stmt, model, healthy, CAUSE, dependency_graph)
+    if children:
+        for listener in listeners:
+            listener(db, model, ids, healthy)
+    return ids
+
+def disable_entities(db: Session, model, *scope, collect: bool = False, dependency_graph=graph):
+    """
+    Turn off every entity of model linked to at least one unhealthy parent, and
+    update the parent reasons of the ones already turned off.
+    Optional scope clauses restrict the entities being re-evaluated.
+    Returns the ids of the entities whose status actually changed when collected,
+    or when other entities depend on them, else their number.
+    """
+    disabled = _update(db, dependency_graph, dependency_graph.disable_statement(model, *scope), model, False, collect)
+    if dependency_graph.entities[model].reason_column is not None:
+        db.execute(dependency_graph.refresh_reasons_statement(model, *scope))
+    return disabled
+
+def recover_entities(db: Session, model, *scope, collect: bool = False, dependency_graph=graph):
+    """
+    Turn back on every unhealthy entity of model whose parents all exist and are healthy.
+    Optional scope clauses and the result are those of disable_entities.
+    """
+    return _update(db, dependency_graph, dependency_graph.recover_statement(model, *scope), model, True, collect)
+
+def _count(changes) -> int:
+    return changes if isinstance(changes, int) else len(changes)
+
+def totals(changes: dict) -> dict:
+    """Number of entities disabled and recovered by propagate_changes"""
+    return {
+        "disabled": sum(_count(disabled) for disabled, _ in changes.values()),
+        "recovered": sum(_count(recovered) for _, recovered in changes.values()),
+    }
+
+def propagate_all(db: Session, timings: dict = None, dependency_graph=graph) -> dict:
+    """
+    Re-evaluate every entity with parents without committing, in topological order:
+    an entity is evaluated once all of its parents are, whatever the depth of the graph.
+    """
+    disabled = recovered = 0
+    with metrics.phase("propagation", timings):
+        for entity in dependency_graph.derived():
+            disabled += _count(disable_entities(db, entity.model, dependency_graph=dependency_graph))
+    with metrics.phase("recovery", timings):
+        for entity in dependency_graph.derived():
+            recovered += _count(recover_entities(db, entity.model, dependency_graph=dependency_graph))
+    return {"disabled": disabled, "recovered": recovered}
+
+def propagate_changes(db: Session, changed: dict, exclude: dict = None, collect=(), dependency_graph=graph) -> dict:
+    """
+    Propagate the health of the changed {model: ids} entities to their descendants,
+    without committing.
+
+    Entity types are visited in topological order, each one only re-evaluating, through
+    the index on the referencing column, the entities linked to a parent changed by the
+    caller or by the previous levels. The cost thus follows the size of the change, not
+    the size of the fleet, whatever the depth of the graph. The {model: ids} entities of
+    exclude are left as they are.
+
+    Returns the (disabled, recovered) entities of every visited model, as ids for the
+    models in collect and the ones with children, else as numbers.
+    """
+    changed = {model: set(ids) for model, ids in changed.items()}
+    exclude = exclude or {}
+    changes = {}
+    for entity in dependency_graph.derived():
+        clauses = [edge.column.in_(list(changed[edge.parent])) for edge in entity.parents if changed.get(edge.parent)]
+        if not clauses:
+            continue
+        scope = [or_(*clauses)]
+        if exclude.get(entity.model):
+            scope.append(entity.model.id.not_in(list(exclude[entity.model])))
+        keep = entity.model in collect
+        with metrics.phase("propagation"):
+            disabled = disable_entities(db, entity.model, *scope, collect=keep, dependency_graph=dependency_graph)
+        with metrics.phase("recovery"):
+            recovered = recover_entities(db, entity.model, *scope, collect=keep, dependency_graph=dependency_graph)
+        changes[entity.model] = (disabled, recovered)
+        if entity.children:
+            changed.setdefault(entity.model, set()).update(disabled + recovered)
+    return changes
+
+def _committed(db: Session, propagate) -> dict:
+    try:
+        changes = propagate()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return changes
+
+def propagate_robots_health(db: Session, timings: dict = None) -> dict:
+    """
+    Recompute the health of all robots, and of every other entity with parents,
+    with set-based UPDATE statements, applied in a single transaction.
+    """
+    changes = _committed(db, lambda: propagate_all(db, timings))
+    logger.info("Health propagation: %s entities disabled, %s entities recovered", changes['disabled'], changes['recovered'])
+    return changes
+
+def _check_parents(parent_models):
+    for model in parent_models:
+        if not graph.children(model):
+            raise ValueError(f"{model.__name__} is not a parent")
+
+def propagate_parent_health(db: Session, parent_model, parent_id: int) -> dict:
+    """
+    Re-evaluate only the descendants of one parent, through the indexes on the
+    columns referencing it.
+    """
+    _check_parents([parent_model])
+    changes = _committed(db, lambda: totals(propagate_changes(db, {parent_model: [parent_id]})))
+    logger.info(
+        "Health propagation for %s %s: %s entities disabled, %s entities recovered",
+        parent_model.__name__, parent_id, changes["disabled"], changes["recovered"],
+    )
+    return changes
+
+def propagate_parents_health(db: Session, parent_ids: dict) -> dict:
+    """
+    Re-evaluate, in one transaction, the descendants of any of the given
+    parents, passed as a {parent model: parent ids} mapping.
+    """
+    _check_parents(parent_ids)
+    changes = _committed(db, lambda: totals(propagate_changes(db, parent_ids)))
+    logger.info(
+        "Health propagation for %s parent(s): %s entities disabled, %s entities recovered",
+        sum(len(ids) for ids in parent_ids.values()), changes["disabled"], changes["recovered"],
+    )
+    return changes
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import models
+import functools
+import orjson
+import threading
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tables written by a session, whose versions are bumped once its transaction commits
+PENDING_KEY = "response_cache_pending"
+
+# Versions are process-local: the ETags of another worker never match ours
+PROCESS_TOKEN = uuid.uuid4().hex[:12]
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+@functools.lru_cache(maxsize=None)
+def _adapter(response_model) -> TypeAdapter:
+    return TypeAdapter(response_model)
+
+class ResponseCache:
+    """
+    Serialized responses of the read endpoints, keyed on the path and query string.
+
+    Every table has a version counter, bumped when a transaction writing it commits.
+    A response is stored with the versions of the tables it was read from, so a write
+    makes the previous responses unreachable instead of having to find them, and the
+    ETag of a response is its version vector: unchanged polls are answered 304 from
+    the counters alone, without opening a database connection.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._versions = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Called with the tables bumped by every committed transaction, e.g. to notify other workers
+        self.subscribers = []
+
+    def versions(self, tables) -> tuple:
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def etag(self, versions) -> str:
+        return '"' + "-".join([PROCESS_TOKEN, *map(str, versions)]) + '"'
+
+    def bump(self, tables, notify: bool = True):
+        tables = sorted(set(tables))
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+        if notify:
+            for callback in self.subscribers:
+                callback(tables)
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != versions:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, versions, body: bytes, headers: dict):
+        with self._lock:
+            self._entries[key] = (versions, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "not_modified": self.not_modified,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+    async def respond(self, request: Request, tables, response_model, load, validate: bool = True) -> Response:
+        """
+        Answer a GET from the cache, or with the (content, headers) returned by awaiting load().
+        Responses read from tables changed since the client's copy are never served.
+        Without validate, the content is already made of the plain values response_model
+        would dump, and is written as is.
+        """
+        # Read before loading: a write committed meanwhile makes this response stale, not the next one
+        versions = self.versions(tables)
+        etag = self.etag(versions)
+        if _matches(request.headers.get("if-none-match", ""), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        key = (request.url.path, str(request.query_params))
+        entry = self.get(key, versions)
+        if entry is None:
+            content, headers = await load()
+            if validate:
+                adapter = _adapter(response_model)
+                body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+            else:
+                body = orjson.dumps(content)
+            self.put(key, versions, body, headers)
+        else:
+            body, headers = entry
+        return Response(body, media_type="application/json", headers={**headers, "ETag": etag})
+
+response_cache = ResponseCache()
+
+def _pending(session) -> set:
+    return session.info.setdefault(PENDING_KEY, set())
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table is not None:
+            _pending(session).add(table)
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed_tables(orm_execute_state):
+    # Set-based INSERT and UPDATE statements do not go through the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _pending(orm_execute_state.session).add(orm_execute_state.statement.table.name)
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_tables(session):
+    tables = session.info.pop(PENDING_KEY, None)
+    if tables:
+        response_cache.bump(tables)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_tables(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+def _bump_on_ddl(target, connection, **kw):
+    response_cache.bump([target.name], notify=False)
+
+for _table in models.Base.metadata.sorted_tables:
+    event.listen(_table, "after_create", _bump_on_ddl)
+    event.listen(_table, "after_drop", _bump_on_ddl)
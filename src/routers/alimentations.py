@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from .. import crud, schemas
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal, Optional
+from .. import async_crud, models, schemas, bulk
+from ..database import get_async_db
+from ..workers import coordinator
+from ..response_cache import response_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,34 +16,65 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Alimentation)
-def create_alimentation(alimentation: schemas.AlimentationCreate, db: Session = Depends(get_db)):
-    logger.info(f"Creating alimentation with type {alimentation.alimentationType}")
-    return crud.create_alimentation(db=db, alimentation=alimentation)
+async def create_alimentation(alimentation: schemas.AlimentationCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.create_alimentation(db, alimentation=alimentation)
+
+@router.post("/bulk", response_model=schemas.BulkCreateResponse)
+async def create_alimentations(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Create alimentations from a JSON array or an NDJSON body, in a single transaction"""
+    alimentations = await bulk.read_items(request, schemas.AlimentationCreate)
+    ids = await async_crud.create_alimentations(db, alimentations)
+    return {"ids": ids}
+
+@router.get("/most_loaded", response_model=list[schemas.AlimentationLoad])
+async def read_most_loaded_alimentations(
+    limit: Annotated[int, Query(ge=1, le=1000)] = 10,
+    by: Literal["load", "headroom"] = "load",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Alimentations with the highest load, or with the lowest headroom, read in order from an index"""
+    return await async_crud.get_most_loaded_alimentations(db, limit=limit, by=by)
+
+@router.get("/{alimentation_id}/load", response_model=schemas.AlimentationLoad)
+async def read_alimentation_load(alimentation_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.get_alimentation(db, alimentation_id=alimentation_id)
+
+@router.get("/{alimentation_id}/can_attach/{robot_id}", response_model=schemas.AttachmentCheck)
+async def check_robot_attachment(alimentation_id: int, robot_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Tell whether the alimentation can supply the robot on top of its current load"""
+    return await async_crud.check_robot_attachment(db, robot_id=robot_id, alimentation_id=alimentation_id)
 
 @router.get("/{alimentation_id}", response_model=schemas.Alimentation)
-def read_alimentation(alimentation_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Fetching alimentation with ID {alimentation_id}")
-    db_alimentation = crud.get_alimentation(db, alimentation_id=alimentation_id)
+async def read_alimentation(alimentation_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_alimentation = await async_crud.get_alimentation(db, alimentation_id=alimentation_id)
     if db_alimentation is None:
-        logger.error(f"Alimentation with ID {alimentation_id} not found")
+        logger.error("Alimentation with ID %s not found", alimentation_id)
         raise HTTPException(status_code=404, detail="Alimentation not found")
     return db_alimentation
 
 @router.get("/", response_model=list[schemas.Alimentation])
-def read_alimentations(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    logger.info(f"Fetching alimentations with skip={skip} and limit={limit}")
-    alimentations = crud.get_alimentations(db, skip=skip, limit=limit)
-    return alimentations
+async def read_alimentations(
+    request: Request,
+    skip: Annotated[int, Query(deprecated=True)] = 0,
+    limit: Annotated[int, Query(ge=1)] = 10,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def load():
+        alimentations, next_cursor = await async_crud.get_alimentations(db, skip=skip, limit=limit, cursor=cursor)
+        return alimentations, {"X-Next-Cursor": next_cursor} if next_cursor is not None else {}
+    return await response_cache.respond(request, (models.Alimentation.__tablename__,), list[schemas.Alimentation], load)
 
 @router.put("/{alimentation_id}/status", response_model=schemas.Alimentation)
-async def update_alimentation_status(alimentation_id: int, status: bool, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    logger.info(f"Updating alimentation status for ID {alimentation_id} to {status}")
-    db_alimentation = crud.get_alimentation(db, alimentation_id=alimentation_id)
+async def update_alimentation_status(alimentation_id: int, status: bool, db: AsyncSession = Depends(get_async_db)):
+    logger.info("Updating alimentation status for ID %s to %s", alimentation_id, status)
+    db_alimentation = await async_crud.get_alimentation(db, alimentation_id=alimentation_id)
     if db_alimentation is None:
-        logger.error(f"Alimentation with ID {alimentation_id} not found")
+        logger.error("Alimentation with ID %s not found", alimentation_id)
         raise HTTPException(status_code=404, detail="Alimentation not found")
     db_alimentation.isHealthy = status
-    db.commit()
-    db.refresh(db_alimentation)
-    background_tasks.add_task(crud.update_robots_health_status, db)
+    await db.commit()
+    await db.refresh(db_alimentation)
+    # Queued for the recompute scheduler, which coalesces bursts of changes
+    coordinator.propagate(models.Alimentation, alimentation_id)
     return db_alimentation
@@ -0,0 +1,84 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from .. import config
+from ..health_stream import health_stream, SubscriptionDropped
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Close code of the WebSockets dropped for falling behind: "try again later"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+router = APIRouter(
+    prefix="/events",
+    tags=["events"],
+)
+
+def _sse(event_type: str, data) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+async def _iter_sse(subscription):
+    try:
+        # Sent at once, so that clients and proxies see the stream open before the first change
+        yield ": connected\n\n"
+        while True:
+            events = await subscription.get(timeout=config.STREAM_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            yield "".join(_sse("health", health_event) for health_event in events)
+    except SubscriptionDropped:
+        yield _sse("dropped", {"detail": "Too many events behind, reconnect and resynchronize"})
+    finally:
+        health_stream.unsubscribe(subscription)
+
+@router.get("/health")
+async def stream_health_events(
+    alimentation_id: Optional[int] = None,
+    guidage_id: Optional[int] = None,
+    licence_id: Optional[int] = None,
+):
+    """
+    Stream the health changes as Server-Sent Events, once committed, optionally
+    only the ones of an alimentation, guidage or licence and of its robots.
+    """
+    subscription = health_stream.subscribe(alimentation_id=alimentation_id, guidage_id=guidage_id, licence_id=licence_id)
+    logger.info("Health stream subscriber connected with filters %s", subscription.filters)
+    return StreamingResponse(
+        _iter_sse(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _forward(websocket: WebSocket, subscription):
+    try:
+        while True:
+            for health_event in await subscription.get():
+                await websocket.send_text(json.dumps(health_event))
+    except SubscriptionDropped:
+        await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Too many events behind")
+
+@router.websocket("/health/ws")
+async def stream_health_events_ws(
+    websocket: WebSocket,
+    alimentation_id: Optional[int] = None,
+    guidage_id: Optional[int] = None,
+    licence_id: Optional[int] = None,
+):
+    """Send each health change as a JSON text message, with the filters of GET /events/health"""
+    await websocket.accept()
+    subscription = health_stream.subscribe(alimentation_id=alimentation_id, guidage_id=guidage_id, licence_id=licence_id)
+    logger.info("Health WebSocket subscriber connected with filters %s", subscription.filters)
+    sender = asyncio.create_task(_forward(websocket, subscription))
+    try:
+        # Reading notices the client going away even while no event is sent
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        health_stream.unsubscribe(subscription)
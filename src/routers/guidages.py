@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from .. import crud, schemas
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Optional
+from .. import async_crud, models, schemas, bulk
+from ..database import get_async_db
+from ..workers import coordinator
+from ..response_cache import response_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,34 +16,47 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Guidage)
-def create_guidage(guidage: schemas.GuidageCreate, db: Session = Depends(get_db)):
-    logger.info("Creating guidage")
-    return crud.create_guidage(db=db, guidage=guidage)
+async def create_guidage(guidage: schemas.GuidageCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.create_guidage(db, guidage=guidage)
+
+@router.post("/bulk", response_model=schemas.BulkCreateResponse)
+async def create_guidages(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Create guidages from a JSON array or an NDJSON body, in a single transaction"""
+    guidages = await bulk.read_items(request, schemas.GuidageCreate)
+    ids = await async_crud.create_guidages(db, guidages)
+    return {"ids": ids}
 
 @router.get("/{guidage_id}", response_model=schemas.Guidage)
-def read_guidage(guidage_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Fetching guidage with ID {guidage_id}")
-    db_guidage = crud.get_guidage(db, guidage_id=guidage_id)
+async def read_guidage(guidage_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_guidage = await async_crud.get_guidage(db, guidage_id=guidage_id)
     if db_guidage is None:
-        logger.error(f"Guidage with ID {guidage_id} not found")
+        logger.error("Guidage with ID %s not found", guidage_id)
         raise HTTPException(status_code=404, detail="Guidage not found")
     return db_guidage
 
 @router.get("/", response_model=list[schemas.Guidage])
-def read_guidages(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    logger.info(f"Fetching guidages with skip={skip} and limit={limit}")
-    guidages = crud.get_guidages(db, skip=skip, limit=limit)
-    return guidages
+async def read_guidages(
+    request: Request,
+    skip: Annotated[int, Query(deprecated=True)] = 0,
+    limit: Annotated[int, Query(ge=1)] = 10,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def load():
+        guidages, next_cursor = await async_crud.get_guidages(db, skip=skip, limit=limit, cursor=cursor)
+        return guidages, {"X-Next-Cursor": next_cursor} if next_cursor is not None else {}
+    return await response_cache.respond(request, (models.Guidage.__tablename__,), list[schemas.Guidage], load)
 
 @router.put("/{guidage_id}/status", response_model=schemas.Guidage)
-async def update_guidage_status(guidage_id: int, status: bool, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    logger.info(f"Updating guidage status for ID {guidage_id} to {status}")
-    db_guidage = crud.get_guidage(db, guidage_id=guidage_id)
+async def update_guidage_status(guidage_id: int, status: bool, db: AsyncSession = Depends(get_async_db)):
+    logger.info("Updating guidage status for ID %s to %s", guidage_id, status)
+    db_guidage = await async_crud.get_guidage(db, guidage_id=guidage_id)
     if db_guidage is None:
-        logger.error(f"Guidage with ID {guidage_id} not found")
+        logger.error("Guidage with ID %s not found", guidage_id)
         raise HTTPException(status_code=404, detail="Guidage not found")
     db_guidage.isHealthy = status
-    db.commit()
-    db.refresh(db_guidage)
-    background_tasks.add_task(crud.update_robots_health_status, db)
+    await db.commit()
+    await db.refresh(db_guidage)
+    # Queued for the recompute scheduler, which coalesces bursts of changes
+    coordinator.propagate(models.Guidage, guidage_id)
     return db_guidage
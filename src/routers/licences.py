@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from .. import crud, schemas
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Optional
+from .. import async_crud, models, schemas, bulk
+from ..database import get_async_db
+from ..workers import coordinator
+from ..response_cache import response_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,35 +16,52 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Licence)
-def create_licence(licence: schemas.LicenceCreate, db: Session = Depends(get_db)):
-    logger.info(f"Creating licence with expiration date {licence.expiration_date}")
-    return crud.create_licence(db=db, licence=licence)
+async def create_licence(licence: schemas.LicenceCreate, db: AsyncSession = Depends(get_async_db)):
+    db_licence = await async_crud.create_licence(db, licence=licence)
+    coordinator.notify_licences()
+    return db_licence
+
+@router.post("/bulk", response_model=schemas.BulkCreateResponse)
+async def create_licences(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Create licences from a JSON array or an NDJSON body, in a single transaction"""
+    licences = await bulk.read_items(request, schemas.LicenceCreate)
+    ids = await async_crud.create_licences(db, licences)
+    coordinator.notify_licences()
+    return {"ids": ids}
 
 @router.get("/{licence_id}", response_model=schemas.Licence)
-def read_licence(licence_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Fetching licence with ID {licence_id}")
-    db_licence = crud.get_licence(db, licence_id=licence_id)
+async def read_licence(licence_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_licence = await async_crud.get_licence(db, licence_id=licence_id)
     if db_licence is None:
-        logger.error(f"Licence with ID {licence_id} not found")
+        logger.error("Licence with ID %s not found", licence_id)
         raise HTTPException(status_code=404, detail="Licence not found")
     return db_licence
 
 @router.get("/", response_model=list[schemas.Licence])
-def read_licences(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    logger.info(f"Fetching licences with skip={skip} and limit={limit}")
-    licences = crud.get_licences(db, skip=skip, limit=limit)
-    return licences
+async def read_licences(
+    request: Request,
+    skip: Annotated[int, Query(deprecated=True)] = 0,
+    limit: Annotated[int, Query(ge=1)] = 10,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def load():
+        licences, next_cursor = await async_crud.get_licences(db, skip=skip, limit=limit, cursor=cursor)
+        return licences, {"X-Next-Cursor": next_cursor} if next_cursor is not None else {}
+    return await response_cache.respond(request, (models.Licence.__tablename__,), list[schemas.Licence], load)
 
 @router.put("/{licence_id}/status", response_model=schemas.Licence)
-async def update_licence_status(licence_id: int, status: bool, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    logger.info(f"Updating licence status for ID {licence_id} to {status}")
-    db_licence = crud.get_licence(db, licence_id=licence_id)
+async def update_licence_status(licence_id: int, status: bool, db: AsyncSession = Depends(get_async_db)):
+    logger.info("Updating licence status for ID %s to %s", licence_id, status)
+    db_licence = await async_crud.get_licence(db, licence_id=licence_id)
     if db_licence is None:
-        logger.error(f"Licence with ID {licence_id} not found")
+        logger.error("Licence with ID %s not found", licence_id)
         raise HTTPException(status_code=404, detail="Licence not found")
     db_licence.isHealthy = status
     db_licence.check_status()
-    db.commit()
-    db.refresh(db_licence)
-    background_tasks.add_task(crud.update_robots_health_status, db)
+    await db.commit()
+    await db.refresh(db_licence)
+    # Queued for the recompute scheduler, which coalesces bursts of changes
+    coordinator.propagate(models.Licence, licence_id)
+    coordinator.notify_licences()
     return db_licence
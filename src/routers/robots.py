@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Optional, List
-from .. import crud
-from .. import models, schemas
-from ..database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal, Optional, List
+from .. import crud, async_crud, models
+from .. import schemas, export, bulk
+from ..database import get_db, get_async_db
+from ..response_cache import response_cache
+from ..workers import coordinator
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Tables the robot responses are read from, see src/response_cache.py
+ROBOT_TABLES = (models.Robot.__tablename__,)
+
 router = APIRouter(
     prefix="/robots",
     tags=["robots"],
@@ -15,55 +22,87 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Robot)
-def create_robot(robot: schemas.RobotCreate, db: Session = Depends(get_db)):
-    logger.info(f"Creating robot with name {robot.name}")
-    return crud.create_robot(db=db, robot=robot)
+async def create_robot(robot: schemas.RobotCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.create_robot(db, robot=robot)
 
-@router.get("/{robot_id}", response_model=schemas.Robot)
-def read_robot(robot_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Fetching robot with ID {robot_id}")
-    db_robot = crud.get_robot(db, robot_id=robot_id)
-    if db_robot is None:
-        logger.error(f"Robot with ID {robot_id} not found")
-        raise HTTPException(status_code=404, detail="Robot not found")
-    return db_robot
+@router.post("/bulk", response_model=schemas.BulkCreateResponse)
+async def create_robots(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Create robots from a JSON array or an NDJSON body, in a single transaction"""
+    robots = await bulk.read_items(request, schemas.RobotCreate)
+    ids = await async_crud.create_robots(db, robots)
+    return {"ids": ids}
 
-@router.get("/", response_model=schemas.RobotsResponse)
-def read_robots(
-    skip: int = 0,
-    limit: int = 10,
+@router.get("/export")
+def export_robots(
+    format: Literal["ndjson", "csv"] = "ndjson",
     isHealthy: Optional[bool] = None,
     alimentation_id: Optional[int] = None,
     guidage_id: Optional[int] = None,
     licence_id: Optional[int] = None,
+    reason: Optional[schemas.HealthReason] = None,
     db: Session = Depends(get_db)
 ):
-    logger.info("Fetching robots with filters")
-    query = db.query(models.Robot)
-    if isHealthy is not None:
-        query = query.filter(models.Robot.isHealthy == isHealthy)
-    if alimentation_id is not None:
-        query = query.filter(models.Robot.alimentation_id == alimentation_id)
-    if guidage_id is not None:
-        query = query.filter(models.Robot.guidage_id == guidage_id)
-    if licence_id is not None:
-        query = query.filter(models.Robot.licence_id == licence_id)
+    """
+    Stream every robot with the state of its alimentation, guidage and licence.
+    The synchronous session streams through a server-side cursor, iterated in the threadpool.
+    """
+    logger.info("Exporting robots as %s", format)
+    filters = crud.robot_filters(isHealthy, alimentation_id, guidage_id, licence_id, reason)
+    if format == "csv":
+        return StreamingResponse(
+            export.iter_csv(db, *filters),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="robots.csv"'},
+        )
+    return StreamingResponse(export.iter_ndjson(db, *filters), media_type="application/x-ndjson")
 
-    total_count = query.count()
-    robots = query.offset(skip).limit(limit).all()
+@router.get("/{robot_id}", response_model=schemas.Robot)
+async def read_robot(robot_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        db_robot = await async_crud.get_robot(db, robot_id=robot_id)
+        if db_robot is None:
+            logger.error("Robot with ID %s not found", robot_id)
+            raise HTTPException(status_code=404, detail="Robot not found")
+        return db_robot, {}
+    return await response_cache.respond(request, ROBOT_TABLES, schemas.Robot, load)
 
-    return {"total_count": total_count, "robots": robots}
+@router.get("/", response_model=schemas.RobotsResponse)
+async def read_robots(
+    request: Request,
+    skip: Annotated[int, Query(deprecated=True)] = 0,
+    limit: Annotated[int, Query(ge=1)] = 10,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    isHealthy: Optional[bool] = None,
+    alimentation_id: Optional[int] = None,
+    guidage_id: Optional[int] = None,
+    licence_id: Optional[int] = None,
+    reason: Optional[schemas.HealthReason] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def load():
+        robots = await async_crud.list_robots(
+            db, limit=limit, cursor=cursor, skip=skip, include_total=include_total,
+            isHealthy=isHealthy, alimentation_id=alimentation_id, guidage_id=guidage_id, licence_id=licence_id,
+            reason=reason,
+        )
+        return robots, {}
+    # The page is already made of plain values, see crud.list_robots
+    return await response_cache.respond(request, ROBOT_TABLES, schemas.RobotsResponse, load, validate=False)
 
 @router.put("/{robot_id}/status", response_model=schemas.Robot)
-async def update_robot_status(robot_id: int, status: bool, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    logger.info(f"Updating robot status for ID {robot_id} to {status}")
-    db_robot = crud.update_robot_status(db, robot_id=robot_id, status=status)
+async def update_robot_status(robot_id: int, status: bool, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    db_robot = await async_crud.update_robot_status(db, robot_id=robot_id, status=status)
     if db_robot is None:
-        logger.error(f"Robot with ID {robot_id} not found")
+        logger.error("Robot with ID %s not found", robot_id)
         raise HTTPException(status_code=404, detail="Robot not found")
     return db_robot
 
-@router.put("/update_health_status", response_model=dict)
-def update_robots_health_status(db: Session = Depends(get_db)):
-    logger.info("Updating robots health status")
-    return crud.update_robots_health_status(db)
+@router.put("/update_health_status", response_model=dict, status_code=202)
+async def update_robots_health_status():
+    """
+    Request a full health recompute, run by the recompute scheduler of the leader worker
+    so that it never races with the propagation of another worker.
+    """
+    coordinator.recompute_all()
+    return {"message": "Robots health status update requested"}
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated
+from .. import async_crud, schemas
+from ..database import get_async_db
+from ..workers import coordinator
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/status",
+    tags=["status"],
+)
+
+@router.put("/batch", response_model=schemas.BatchStatusResponse)
+async def update_status_batch(batch: schemas.BatchStatusRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Apply status changes of robots, alimentations, guidages and licences in one
+    transaction. Either every change is applied or none of them.
+    """
+    result = await async_crud.apply_status_changes(db, batch.changes)
+    if any(change.entity_type == schemas.EntityType.licence for change in batch.changes):
+        coordinator.notify_licences()
+    return result
+
+@router.post("/simulate", response_model=schemas.SimulationResponse)
+async def simulate_status_changes(
+    scenario: schemas.SimulationRequest,
+    limit: Annotated[int, Query(ge=1, le=100000)] = 1000,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Compute which robots would be turned off or on, and the resulting load of the
+    alimentations, if the given entities failed and the licences expired by the
+    date at. Read-only: nothing is changed.
+    """
+    return await async_crud.simulate_status_changes(db, scenario, limit)
@@ -0,0 +1,221 @@
+from datetime import datetime, timezone
+from . import crud
+from .database import SessionLocal
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LicenceExpiryScheduler:
+    """
+    Background thread expiring licences exactly when the next known expiration
+    date is reached, instead of relying on callers to poll.
+    """
+
+    def __init__(self, session_factory, max_sleep: float = 3600.0):
+        self.session_factory = session_factory
+        # Upper bound of a sleep, so that licences written by other processes are eventually seen
+        self.max_sleep = max_sleep
+        self.next_expiration = None
+        # End of the last sweep, None until the first one, run when the scheduler starts
+        self.last_run_at = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="licence-expiry-scheduler", daemon=True)
+        self._thread.start()
+        logger.info("Licence expiry scheduler started")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("Licence expiry scheduler stopped")
+
+    def notify(self):
+        """Wake the scheduler after a licence was created or changed, so it recomputes its deadline"""
+        self._wake.set()
+
+    def run_once(self):
+        """Expire due licences and return the next known expiration date"""
+        db = self.session_factory()
+        try:
+            crud.expire_licences(db)
+            self.next_expiration = crud.get_next_licence_expiration(db)
+            self.last_run_at = datetime.now(timezone.utc)
+        finally:
+            db.close()
+        return self.next_expiration
+
+    def seconds_until(self, expiration_date) -> float:
+        if expiration_date is None:
+            return self.max_sleep
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return min(max((expiration_date - now).total_seconds(), 0.0), self.max_sleep)
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Cleared before the run, so that a notify during or after it wakes the next wait
+            self._wake.clear()
+            try:
+                next_expiration = self.run_once()
+            except Exception as e:
+                logger.error("Error while expiring licences: %s", e)
+                next_expiration = None
+            timeout = self.seconds_until(next_expiration)
+            logger.debug("Next licence expiration at %s, sleeping %.3fs", next_expiration, timeout)
+            self._wake.wait(timeout)
+
+class RecomputeScheduler:
+    """
+    Background thread recomputing the health of robots after parent changes.
+
+    Triggers received within the debounce window following the first one are
+    coalesced into a single run, scoped to the changed parents, or over the
+    whole fleet when more than max_scoped_parents changed. A change is thus
+    applied within the debounce window plus the duration of up to two runs,
+    and a storm of changes costs at most one run per window. The triggers of a
+    failed run are kept, and retried after a delay doubling up to max_retry_delay.
+    """
+
+    def __init__(self, session_factory, debounce: float = 0.2, max_scoped_parents: int = 900,
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.session_factory = session_factory
+        self.debounce = debounce
+        self.max_scoped_parents = max_scoped_parents
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.failures = 0
+        self.triggers = 0
+        self.runs = 0
+        self.last_run_duration = None
+        self.last_run_at = None
+        self._pending = {}
+        self._full = False
+        self._running = False
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="recompute-scheduler", daemon=True)
+        self._thread.start()
+        logger.info("Recompute scheduler started")
+
+    def stop(self, timeout: float = 5.0):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("Recompute scheduler stopped")
+
+    def request(self, parent_model, parent_id: int):
+        """Recompute the robots linked to a parent whose health changed"""
+        with self._condition:
+            self.triggers += 1
+            self._pending.setdefault(parent_model, set()).add(parent_id)
+            self._condition.notify_all()
+
+    def request_full(self):
+        """Recompute the health of the whole fleet"""
+        with self._condition:
+            self.triggers += 1
+            self._full = True
+            self._condition.notify_all()
+
+    @property
+    def queue_depth(self) -> int:
+        """Distinct pending recomputes, after coalescing"""
+        with self._condition:
+            return sum(len(ids) for ids in self._pending.values()) + self._full
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "triggers": self.triggers,
+            "runs": self.runs,
+            "last_run_duration": self.last_run_duration,
+            "last_run_at": self.last_run_at,
+            "debounce": self.debounce,
+            "failures": self.failures,
+        }
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Wait until every pending recompute ran"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._running and not self._pending and not self._full, timeout)
+
+    def run_once(self):
+        """Run the pending recomputes now, and return their result"""
+        with self._condition:
+            pending, full = self._pending, self._full
+            self._pending, self._full = {}, False
+            self._running = True
+        try:
+            if not pending and not full:
+                return None
+            start = time.perf_counter()
+            db = self.session_factory()
+            try:
+                if full or sum(len(ids) for ids in pending.values()) > self.max_scoped_parents:
+                    result = crud.update_robots_health_status(db)
+                else:
+                    result = crud.update_robots_health_for_parents(db, pending)
+            finally:
+                db.close()
+            self.runs += 1
+            self.last_run_duration = time.perf_counter() - start
+            self.last_run_at = datetime.now(timezone.utc)
+            logger.info("Health recompute of %s took %.3fs", 'the whole fleet' if full else 'changed parents', self.last_run_duration)
+            return result
+        except Exception:
+            with self._condition:
+                # Keep the triggers, the next run applies them with the ones received meanwhile
+                for parent_model, ids in pending.items():
+                    self._pending.setdefault(parent_model, set()).update(ids)
+                self._full = self._full or full
+            raise
+        finally:
+            with self._condition:
+                self._running = False
+                self._condition.notify_all()
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stop or self._pending or self._full)
+                if self._stop:
+                    return
+                # Let the triggers of the window accumulate before running
+                deadline = time.monotonic() + self.debounce
+                while not self._stop and (remaining := deadline - time.monotonic()) > 0:
+                    self._condition.wait(remaining)
+                if self._stop:
+                    return
+            try:
+                self.run_once()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.failures += 1
+                delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+                logger.error("Error while recomputing robots health, retrying in %.1fs: %s", delay, e)
+                with self._condition:
+                    self._condition.wait_for(lambda: self._stop, delay)
+
+licence_scheduler = LicenceExpiryScheduler(SessionLocal)
+recompute_scheduler = RecomputeScheduler(SessionLocal)
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
 from enum import Enum
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional
 
 class AlimentationType(str, Enum):
     solaire = "SOLAIRE"
@@ -12,6 +12,13 @@ class MotorType(str, Enum):
     moyen = "MOYEN"
     grand = "GRAND"
 
+class HealthReason(str, Enum):
+    alimentation_down = "alimentation_down"
+    guidage_down = "guidage_down"
+    licence_expired = "licence_expired"
+    shed_for_load = "shed_for_load"
+    manual = "manual"
+
 class RobotBase(BaseModel):
     name: str
     isHealthy: bool
@@ -27,14 +34,22 @@ class Robot(RobotBase):
     id: int
     # Ajout de la consommation du moteur du robot
     consumption: int
+    # Why the robot is turned off, empty when it is healthy
+    reasons: List[HealthReason] = []
 
     class Config:
         from_attributes = True
 
 class RobotsResponse(BaseModel):
-    total_count: int
+    # Only filled when requested with include_total
+    total_count: Optional[int] = None
+    next_cursor: Optional[str] = None
     robots: List[Robot]
 
+class BulkCreateResponse(BaseModel):
+    # Ids assigned to the created objects, in the order of the request body
+    ids: List[int]
+
 class AlimentationBase(BaseModel):
     alimentationType: AlimentationType
     isHealthy: bool
@@ -49,6 +64,29 @@ class Alimentation(AlimentationBase):
     class Config:
         from_attributes = True
 
+class AlimentationLoad(BaseModel):
+    id: int
+    isHealthy: bool
+    capacity: int
+    # Consumption of the healthy robots attached to the alimentation
+    current_load: int
+    headroom: int
+    # Robots attached to the alimentation, healthy or not
+    robots_per_motor: Dict[MotorType, int]
+
+    class Config:
+        from_attributes = True
+
+class AttachmentCheck(BaseModel):
+    robot_id: int
+    alimentation_id: int
+    consumption: int
+    current_load: int
+    capacity: int
+    # Headroom left once the robot is attached
+    headroom: int
+    can_attach: bool
+
 class GuidageBase(BaseModel):
     isHealthy: bool
 
@@ -73,3 +111,55 @@ class Licence(LicenceBase):
 
     class Config:
         from_attributes = True
+
+class EntityType(str, Enum):
+    robot = "robot"
+    alimentation = "alimentation"
+    guidage = "guidage"
+    licence = "licence"
+
+class StatusChange(BaseModel):
+    entity_type: EntityType
+    id: int
+    status: bool
+
+class BatchStatusRequest(BaseModel):
+    changes: List[StatusChange]
+
+class RobotHealthChange(BaseModel):
+    id: int
+    isHealthy: bool
+    # "manual" for robots changed by the request, "propagation" or "power" otherwise
+    cause: str
+
+class BatchStatusResponse(BaseModel):
+    applied: int
+    robots: List[RobotHealthChange]
+
+class SimulatedFailure(BaseModel):
+    entity_type: EntityType
+    id: int
+
+class SimulationRequest(BaseModel):
+    failures: List[SimulatedFailure] = []
+    # Expiration dates replacing the ones of the given licence ids
+    licence_expirations: Dict[int, datetime] = {}
+    # Licences expired by this date are down, now by default
+    at: Optional[datetime] = None
+
+class SimulatedAlimentationLoad(BaseModel):
+    id: int
+    isHealthy: bool
+    capacity: int
+    current_load: int
+    simulated_load: int
+    # Capacity left under the simulated load
+    headroom: int
+
+class SimulationResponse(BaseModel):
+    robots_changed: int
+    robots_down: int
+    # Robots whose health would change, at most limit of them
+    robots: List[RobotHealthChange]
+    # Alimentations whose health or load would change
+    alimentations: List[SimulatedAlimentationLoad]
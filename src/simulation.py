@@ -0,0 +1,243 @@
+"""
+What-if simulation of parent failures and licence expirations, computed in memory.
+
+The health of every entity, the edges of the dependency graph, the consumption of
+the robots and the capacity of the alimentations are loaded into read-only NumPy
+arrays: a snapshot shared by the simulations until a transaction changes one of
+its tables. A scenario only copies the health arrays it changes, then applies the
+rules of src/propagation.py level by level, in topological order, and the load
+shedding of src/power.py. The database is read to build the snapshot, never written.
+"""
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+from . import models, power
+from .dependency_graph import graph
+from .graph_cache import database_key
+from .response_cache import response_cache
+import numpy as np
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns loaded along with the health of an entity, besides the ids of its parents
+EXTRA_COLUMNS = {
+    models.Robot: (power.consumption_expression,),
+    models.Alimentation: (models.Alimentation.capacity,),
+}
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+class TableSnapshot:
+    """Entities of one type sorted by id, with their health and one column per parent edge"""
+
+    def __init__(self, ids, healthy, parent_ids, extra):
+        self.ids = _read_only(ids)
+        self.healthy = _read_only(healthy.astype(bool))
+        self.parent_ids = [_read_only(column) for column in parent_ids]
+        self.extra = [_read_only(column) for column in extra]
+        # (positions, found) of the parent of each entity in the parent table, per edge
+        self.parents = []
+
+    def positions(self, ids):
+        """Positions of the given ids in the table, and whether each one exists"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return positions, self.ids[positions] == ids
+
+class Snapshot:
+
+    def __init__(self, key, versions, tables: dict, expirations, dependency_graph=graph):
+        self.key = key
+        self.versions = versions
+        self.tables = tables
+        self.graph = dependency_graph
+        # Expiration date of each licence, aligned with the licence table
+        self.expirations = _read_only(expirations)
+        for entity in dependency_graph.order:
+            table = tables[entity.model]
+            table.parents = [tables[edge.parent].positions(ids) for edge, ids in zip(entity.parents, table.parent_ids)]
+        self.baseline = self.settle({model: table.healthy for model, table in tables.items()})
+
+    def propagate(self, health: dict) -> dict:
+        """
+        Health of every entity once failures are propagated, as by propagation.propagate_changes:
+        an entity with an unhealthy parent is turned off. Failures never turn an entity back on.
+        """
+        health = dict(health)
+        for entity in self.graph.derived():
+            table = self.tables[entity.model]
+            down = np.zeros(len(table.ids), dtype=bool)
+            for edge, (positions, found) in zip(entity.parents, table.parents):
+                parent_healthy = health[edge.parent][positions] if len(positions) else np.zeros(0, dtype=bool)
+                down |= found & ~parent_healthy
+            health[entity.model] = health[entity.model] & ~down
+        return health
+
+    def shed(self, health: dict):
+        """Robots turned off by the load shedding of the healthy alimentations, and the resulting loads"""
+        robots, alimentations = self.tables[models.Robot], self.tables[models.Alimentation]
+        robot_healthy = health[models.Robot]
+        positions, found = robots.parents[self._alimentation_edge()]
+        consumptions, = robots.extra
+        capacities, = alimentations.extra
+        alimentation_healthy = health[models.Alimentation]
+        turned_off, _ = power.select_robots_to_turn_off(
+            robots.parent_ids[self._alimentation_edge()][robot_healthy], consumptions[robot_healthy], robots.ids[robot_healthy],
+            alimentations.ids[alimentation_healthy], capacities[alimentation_healthy],
+        )
+        shed = np.zeros(len(robots.ids), dtype=bool)
+        shed[robots.positions(turned_off)[0]] = True
+        attached = robot_healthy & ~shed & found
+        loads = np.bincount(positions[attached], weights=consumptions[attached], minlength=len(alimentations.ids)).astype(np.int64)
+        return shed, loads
+
+    def _alimentation_edge(self) -> int:
+        return [edge.parent for edge in self.graph.parents(models.Robot)].index(models.Alimentation)
+
+    def settle(self, health: dict) -> dict:
+        """Propagated health, shed robots and alimentation loads of a state"""
+        propagated = self.propagate(health)
+        shed, loads = self.shed(propagated)
+        return {"propagated": propagated, "shed": shed, "loads": loads}
+
+def _existing_positions(table: TableSnapshot, model, ids):
+    positions, found = table.positions(ids)
+    if not found.all():
+        logger.error("%s with IDs %s not found", model.__name__, sorted(np.asarray(ids)[~found].tolist()))
+        raise HTTPException(status_code=400, detail="Missing object")
+    return positions
+
+def load_snapshot(db: Session, versions=(), dependency_graph=graph) -> Snapshot:
+    """Read the health and the edges of every entity type into a snapshot"""
+    start = time.perf_counter()
+    tables = {}
+    for entity in dependency_graph.order:
+        model = entity.model
+        columns = [
+            model.id,
+            case((model.isHealthy == False, 0), else_=1),
+            *(func.coalesce(edge.column, 0) for edge in entity.parents),
+            *EXTRA_COLUMNS.get(model, ()),
+        ]
+        ids, healthy, *rest = power.fetch_int_columns(db, select(*columns).order_by(model.id))
+        tables[model] = TableSnapshot(ids, healthy, rest[:len(entity.parents)], rest[len(entity.parents):])
+    expirations = np.array(
+        db.scalars(select(models.Licence.expiration_date).order_by(models.Licence.id)).all(), dtype="datetime64[us]",
+    )
+    snapshot = Snapshot(database_key(db.get_bind()), versions, tables, expirations, dependency_graph)
+    logger.info("Simulation snapshot of %s robots loaded in %.3fs", len(tables[models.Robot].ids), time.perf_counter() - start)
+    return snapshot
+
+class SnapshotCache:
+    """
+    Latest snapshot, rebuilt once a transaction changed one of the tables of the dependency graph.
+    Requests finding it stale at the same time each load their own, the last one read is kept.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def tables(self):
+        return tuple(model.__tablename__ for model in graph.entities)
+
+    def get(self, db: Session) -> Snapshot:
+        key = database_key(db.get_bind())
+        # Read before loading: a write committed meanwhile makes this snapshot stale, not the next one
+        versions = response_cache.versions(self.tables())
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.key == key and snapshot.versions == versions:
+            return snapshot
+        # Loaded without holding the lock: through AsyncSession.run_sync, every query hands the
+        # event loop to the other requests, which would block on the lock the loop thread holds
+        snapshot = load_snapshot(db, versions)
+        with self._lock:
+            current = self.snapshot
+            # Concurrent loads may finish in any order, keep the most recent snapshot
+            if current is None or current.key != key or not all(
+                current_version >= version for current_version, version in zip(current.versions, versions)
+            ):
+                self.snapshot = snapshot
+        return snapshot
+
+    def clear(self):
+        self.snapshot = None
+
+snapshots = SnapshotCache()
+
+def simulate(db: Session, failures: dict, licence_expirations: dict = None, at: datetime = None, limit: int = 1000) -> dict:
+    """
+    Compute which robots change, and the load of the alimentations, if the {model: ids}
+    entities failed and the licences expired by the date at, with the given
+    {licence id: expiration date} overrides. Nothing is written to the database.
+    """
+    snapshot = snapshots.get(db)
+    health = {}
+    for model, ids in failures.items():
+        table = snapshot.tables[model]
+        positions = _existing_positions(table, model, list(ids))
+        # Copy on write: only the health arrays of the failing entity types are copied
+        healthy = health[model] = table.healthy.copy()
+        healthy[positions] = False
+
+    licences = snapshot.tables[models.Licence]
+    expirations = snapshot.expirations
+    if licence_expirations:
+        positions = _existing_positions(licences, models.Licence, list(licence_expirations))
+        expirations = expirations.copy()
+        expirations[positions] = np.array([models.naive_utc(date) for date in licence_expirations.values()], dtype="datetime64[us]")
+    at = np.datetime64(models.naive_utc(at or datetime.now(timezone.utc)), "us")
+    expired = expirations < at
+    if expired.any():
+        healthy = health.get(models.Licence)
+        health[models.Licence] = (healthy if healthy is not None else licences.healthy) & ~expired
+
+    baseline = snapshot.baseline
+    scenario = snapshot.settle({model: health.get(model, table.healthy) for model, table in snapshot.tables.items()})
+
+    robots = snapshot.tables[models.Robot]
+    before = baseline["propagated"][models.Robot] & ~baseline["shed"]
+    after = scenario["propagated"][models.Robot] & ~scenario["shed"]
+    changed = np.flatnonzero(before != after)
+    causes = np.where(
+        scenario["propagated"][models.Robot][changed] != baseline["propagated"][models.Robot][changed], "propagation", "power",
+    )
+    if models.Robot in failures:
+        causes[np.isin(robots.ids[changed], list(failures[models.Robot]))] = "manual"
+
+    alimentations = snapshot.tables[models.Alimentation]
+    capacities, = alimentations.extra
+    alimentation_healthy = scenario["propagated"][models.Alimentation]
+    affected = np.flatnonzero(
+        (baseline["loads"] != scenario["loads"]) | (baseline["propagated"][models.Alimentation] != alimentation_healthy)
+    )
+    return {
+        "robots_changed": len(changed),
+        "robots_down": int(np.count_nonzero(before[changed])),
+        "robots": [
+            {"id": robot_id, "isHealthy": healthy, "cause": cause}
+            for robot_id, healthy, cause in zip(robots.ids[changed[:limit]].tolist(), after[changed[:limit]].tolist(), causes[:limit].tolist())
+        ],
+        "alimentations": [
+            {
+                "id": alimentation_id,
+                "isHealthy": healthy,
+                "capacity": capacity,
+                "current_load": current_load,
+                "simulated_load": simulated_load,
+                "headroom": capacity - simulated_load,
+            }
+            for alimentation_id, healthy, capacity, current_load, simulated_load in zip(
+                alimentations.ids[affected].tolist(), alimentation_healthy[affected].tolist(), capacities[affected].tolist(),
+                baseline["loads"][affected].tolist(), scenario["loads"][affected].tolist(),
+            )
+        ],
+    }
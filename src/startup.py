@@ -0,0 +1,78 @@
+"""
+Work done once the application accepts requests: loading the caches.
+
+The caches are read through on a miss, so requests are served while they are
+being loaded, only slower. /ready reports the progress of every task.
+"""
+from .database import SessionLocal
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Warmup:
+    """Background thread running the warm-up tasks in order, recording the progress of each one"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self.tasks = {}
+        self.progress = {}
+        self.started_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, task):
+        """Register a task called with a session, in registration order"""
+        self.tasks[name] = task
+        self.progress[name] = {"status": "pending", "duration": None, "error": None}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.started_at = time.monotonic()
+        with self._lock:
+            for progress in self.progress.values():
+                progress.update(status="pending", duration=None, error=None)
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        for name, task in self.tasks.items():
+            self._update(name, status="running")
+            start = time.perf_counter()
+            try:
+                with self.session_factory() as db:
+                    task(db)
+                self._update(name, status="done", duration=time.perf_counter() - start)
+            except Exception as e:
+                # The cache is then read through, requests are still served
+                logger.error("Warm-up task %s failed: %s", name, e)
+                self._update(name, status="failed", duration=time.perf_counter() - start, error=str(e))
+        logger.info("Warm-up finished in %.3fs", time.monotonic() - self.started_at)
+
+    def _update(self, name: str, **values):
+        with self._lock:
+            self.progress[name].update(values)
+
+    @property
+    def done(self) -> bool:
+        return self.started_at is not None and all(
+            progress["status"] in ("done", "failed") for progress in self.progress.values()
+        )
+
+    def status(self) -> dict:
+        with self._lock:
+            tasks = {name: dict(progress) for name, progress in self.progress.items()}
+        return {
+            "started": self.started_at is not None,
+            "warm": self.done,
+            "uptime": time.monotonic() - self.started_at if self.started_at is not None else None,
+            "tasks": tasks,
+        }
+
+warmup = Warmup()
@@ -0,0 +1,324 @@
+"""
+Coordination between the uvicorn workers serving the API.
+
+Workers broadcast the entities changed by their transactions on a change bus,
+so the others drop them from their local caches, and elect a leader: the only
+worker running the licence expiry scheduler and the health propagation, which
+would otherwise race on the same database. They also announce how many clients
+subscribed to their health stream, and relay their health events to the others
+only while some have.
+
+Set DEPENDENCIES_GAME_RUN_DIR to a directory shared by the workers to enable
+the Unix socket bus and the leader election lock file. Without it the process
+is the only worker, and leader.
+"""
+from . import config, pagination
+from .graph_cache import graph_cache, CACHED_MODELS
+from .health_stream import health_stream
+from .response_cache import response_cache
+from .scheduler import RecomputeScheduler, licence_scheduler, recompute_scheduler
+import fcntl
+import glob
+import json
+import os
+import socket
+import threading
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Changes per message, keeping datagrams well below the socket buffer size
+MAX_CHANGES_PER_MESSAGE = 1000
+MAX_EVENTS_PER_MESSAGE = 250
+MAX_DATAGRAM_SIZE = 65536
+
+class LocalBus:
+    """
+    In-process change bus. Buses sharing the same channel list deliver each
+    message to all the others, synchronously, standing for separate workers.
+    """
+
+    def __init__(self, channel: list = None):
+        self.channel = channel if channel is not None else []
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def start(self):
+        if self not in self.channel:
+            self.channel.append(self)
+
+    def stop(self):
+        if self in self.channel:
+            self.channel.remove(self)
+
+    def publish(self, message: dict):
+        for bus in list(self.channel):
+            if bus is not self:
+                bus._deliver(message)
+
+    def _deliver(self, message: dict):
+        for callback in self._subscribers:
+            callback(message)
+
+class UnixSocketBus(LocalBus):
+    """
+    Change bus between the processes of one host: every worker binds a Unix
+    datagram socket in a shared directory, and publishing sends the message to
+    each socket found there.
+    """
+
+    def __init__(self, directory: str, worker_id: str = None):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"worker-{worker_id or os.getpid()}.sock")
+        self._receiver = None
+        self._sender = None
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # A worker not reading its socket must not block the others
+        self._sender.settimeout(1.0)
+        self._thread = threading.Thread(target=self._receive, name="change-bus", daemon=True)
+        self._thread.start()
+        logger.info("Change bus listening on %s", self.path)
+
+    def stop(self):
+        if self._receiver is None:
+            return
+        # Shutting the socket down unblocks the receiving thread
+        try:
+            self._receiver.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._receiver.close()
+        self._sender.close()
+        self._thread.join(5.0)
+        self._receiver = self._sender = self._thread = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def publish(self, message: dict):
+        data = json.dumps(message).encode()
+        for path in glob.glob(os.path.join(self.directory, "worker-*.sock")):
+            if path == self.path:
+                continue
+            try:
+                self._sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket left behind by a worker which exited
+                logger.info("Removing stale worker socket %s", path)
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                logger.warning("Could not notify worker %s: %s", path, e)
+
+    def _receive(self):
+        while True:
+            try:
+                data = self._receiver.recv(MAX_DATAGRAM_SIZE)
+            except OSError:
+                return
+            if not data:
+                return
+            try:
+                self._deliver(json.loads(data))
+            except Exception as e:
+                logger.error("Error while handling a worker message: %s", e)
+
+class LeaderElection:
+    """
+    Elect the worker holding an exclusive lock on a file. The lock is released
+    by the system when the leader exits, so another worker can take over.
+    Without a lock file, the process is always the leader.
+    """
+
+    def __init__(self, lock_path: str = None):
+        self.lock_path = lock_path
+        self.is_leader = lock_path is None
+        self._file = None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        self.is_leader = True
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+            self.is_leader = False
+
+class WorkerCoordinator:
+    """
+    Broadcast the changes committed by this worker, invalidate the local caches
+    on the changes of the others, and run the leader tasks on the elected worker.
+    """
+
+    def __init__(self, bus, election, recompute: RecomputeScheduler, scheduler=licence_scheduler, election_interval: float = 5.0):
+        self.bus = bus
+        self.election = election
+        # Health recomputes only run on the leader, coalesced by its scheduler
+        self.recompute = recompute
+        self.scheduler = scheduler
+        self.election_interval = election_interval
+        # Identifies the health stream subscriptions announced by this worker
+        self.worker_id = uuid.uuid4().hex
+        self.bus.subscribe(self._handle)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.election.is_leader
+
+    def start(self):
+        self._stop.clear()
+        self.bus.start()
+        graph_cache.subscribers.append(self.broadcast_changes)
+        response_cache.subscribers.append(self.broadcast_versions)
+        health_stream.subscribers.append(self.broadcast_health)
+        health_stream.subscription_listeners.append(self.announce_subscriptions)
+        # The running workers answer with their own subscriptions
+        self.announce_subscriptions(health_stream.subscription_count(), query=True)
+        if self.election.try_acquire():
+            self._become_leader()
+        else:
+            self._thread = threading.Thread(target=self._campaign, name="leader-election", daemon=True)
+            self._thread.start()
+            logger.info("Worker started as follower")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        if self.broadcast_changes in graph_cache.subscribers:
+            graph_cache.subscribers.remove(self.broadcast_changes)
+        if self.broadcast_versions in response_cache.subscribers:
+            response_cache.subscribers.remove(self.broadcast_versions)
+        if self.broadcast_health in health_stream.subscribers:
+            health_stream.subscribers.remove(self.broadcast_health)
+        if self.announce_subscriptions in health_stream.subscription_listeners:
+            health_stream.subscription_listeners.remove(self.announce_subscriptions)
+            self.announce_subscriptions(0)
+        health_stream.remote_subscriptions = {}
+        if self.is_leader:
+            self.scheduler.stop()
+            self.recompute.stop()
+        self.election.release()
+        self.bus.stop()
+
+    def _become_leader(self, takeover: bool = False):
+        logger.info("Worker elected leader")
+        self.scheduler.start()
+        self.recompute.start()
+        if takeover:
+            # Requests sent to the previous leader may have been lost
+            self.recompute.request_full()
+
+    def _campaign(self):
+        while not self._stop.wait(self.election_interval):
+            if self.election.try_acquire():
+                self._become_leader(takeover=True)
+                return
+
+    def broadcast_changes(self, changes):
+        """Publish the (model, id, value) changes committed by this worker"""
+        keys = [[model.__tablename__, entity_id] for model, entity_id, _ in changes]
+        try:
+            for start in range(0, len(keys), MAX_CHANGES_PER_MESSAGE):
+                self.bus.publish({"type": "changes", "keys": keys[start:start + MAX_CHANGES_PER_MESSAGE]})
+        except Exception as e:
+            logger.error("Error while broadcasting changes: %s", e)
+
+    def broadcast_versions(self, tables):
+        """Publish the tables written by a transaction committed by this worker"""
+        try:
+            self.bus.publish({"type": "versions", "tables": tables})
+        except Exception as e:
+            logger.error("Error while broadcasting table versions: %s", e)
+
+    def broadcast_health(self, events):
+        """Publish the health events committed by this worker to the subscribers of the others"""
+        if not health_stream.relayed:
+            return
+        try:
+            for start in range(0, len(events), MAX_EVENTS_PER_MESSAGE):
+                self.bus.publish({"type": "health", "events": events[start:start + MAX_EVENTS_PER_MESSAGE]})
+        except Exception as e:
+            logger.error("Error while broadcasting health events: %s", e)
+
+    def announce_subscriptions(self, count: int, query: bool = False):
+        """Publish the number of health stream subscriptions of this worker, asking the others for theirs with query"""
+        try:
+            self.bus.publish({"type": "subscriptions", "worker": self.worker_id, "count": count, "query": query})
+        except Exception as e:
+            logger.error("Error while announcing health stream subscriptions: %s", e)
+
+    def notify_licences(self):
+        """Wake the licence expiry scheduler of the leader after a licence was created or changed"""
+        if self.is_leader:
+            self.scheduler.notify()
+        else:
+            self.bus.publish({"type": "licences"})
+
+    def propagate(self, parent_model, parent_id: int):
+        """Propagate the health of a parent to its robots, on the leader"""
+        if self.is_leader:
+            self.recompute.request(parent_model, parent_id)
+        else:
+            self.bus.publish({"type": "propagate", "entity": parent_model.__tablename__, "id": parent_id})
+
+    def recompute_all(self):
+        """Recompute the health of the whole fleet, on the leader"""
+        if self.is_leader:
+            self.recompute.request_full()
+        else:
+            self.bus.publish({"type": "recompute_all"})
+
+    def _handle(self, message: dict):
+        if message["type"] == "changes":
+            graph_cache.invalidate((CACHED_MODELS[table], entity_id) for table, entity_id in message["keys"])
+            pagination.count_cache.clear()
+        elif message["type"] == "versions":
+            response_cache.bump(message["tables"], notify=False)
+        elif message["type"] == "health":
+            health_stream.publish(message["events"], notify=False)
+        elif message["type"] == "subscriptions":
+            health_stream.set_remote_subscriptions(message["worker"], message["count"])
+            if message["query"] and health_stream.subscription_count():
+                self.announce_subscriptions(health_stream.subscription_count())
+        elif message["type"] == "licences" and self.is_leader:
+            self.scheduler.notify()
+        elif message["type"] == "propagate" and self.is_leader:
+            self.recompute.request(CACHED_MODELS[message["entity"]], message["id"])
+        elif message["type"] == "recompute_all" and self.is_leader:
+            self.recompute.request_full()
+
+def _default_coordinator():
+    if config.RUN_DIR is None:
+        return WorkerCoordinator(LocalBus(), LeaderElection(), recompute_scheduler)
+    return WorkerCoordinator(UnixSocketBus(config.RUN_DIR), LeaderElection(os.path.join(config.RUN_DIR, "leader.lock")), recompute_scheduler)
+
+coordinator = _default_coordinator()
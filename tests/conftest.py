@@ -0,0 +1,125 @@
+import pytest
+import sys
+import os
+import random
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, simulation
+from src.database import Base
+from src.graph_cache import graph_cache
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Engine on a database file of the test's temporary directory"""
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db", connect_args={"check_same_thread": False})
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def db_session(engine, session_factory):
+    """Create a fresh database for each test"""
+    # The caches outlive the databases they were loaded from
+    graph_cache.reset()
+    simulation.snapshots.clear()
+    Base.metadata.create_all(bind=engine)
+    db = session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+        graph_cache.reset()
+        simulation.snapshots.clear()
+
+
+@pytest.fixture
+def make_fleet(db_session):
+    """Builder of small fleets with healthy parents, numbered from 1
+
+    Each robot is given as (alimentation_id, guidage_id, licence_id, motor, isHealthy)
+    and named A, B, C... The alimentations have the given capacities and alternate
+    nuclear and solar, the licences expire after the given numbers of days.
+    """
+    def make(robots, capacities=(100,), guidages=1, licence_days=(30,)):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        types = [models.AlimentationType.NUCLEAIRE, models.AlimentationType.SOLAIRE]
+        db_session.add_all(
+            [models.Alimentation(id=i, alimentationType=types[(i - 1) % 2], isHealthy=True, capacity=capacity) for i, capacity in enumerate(capacities, 1)]
+            + [models.Guidage(id=i, isHealthy=True) for i in range(1, guidages + 1)]
+            + [models.Licence(id=i, isHealthy=True, expiration_date=now + timedelta(days=days)) for i, days in enumerate(licence_days, 1)]
+        )
+        db_session.commit()
+        db_session.add_all([
+            models.Robot(id=i, name=chr(ord("A") + i - 1), isHealthy=healthy, alimentation_id=alimentation_id, guidage_id=guidage_id, licence_id=licence_id, motor=motor)
+            for i, (alimentation_id, guidage_id, licence_id, motor, healthy) in enumerate(robots, 1)
+        ])
+        db_session.commit()
+
+    return make
+
+
+@pytest.fixture
+def make_random_fleet(db_session):
+    """Builder of seeded random fleets, with unhealthy parents and robots
+
+    The unhealthy robots are down for a parent, or for a reason of their own
+    keeping them off. Some robots may point to a missing alimentation.
+    """
+    def make(seed, robot_count=300, alimentations=20, guidages=10, licences=10, capacities=(100000,),
+             unhealthy_parent_ratio=0.2, unhealthy_robot_ratio=0.5, missing_alimentation_ratio=0.05):
+        rng = random.Random(seed)
+        future_date = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=30)
+        fleet = SimpleNamespace(
+            alimentations=[
+                models.Alimentation(alimentationType=rng.choice(list(models.AlimentationType)), isHealthy=rng.random() >= unhealthy_parent_ratio, capacity=rng.choice(capacities))
+                for _ in range(alimentations)
+            ],
+            guidages=[models.Guidage(isHealthy=rng.random() >= unhealthy_parent_ratio) for _ in range(guidages)],
+            licences=[models.Licence(isHealthy=rng.random() >= unhealthy_parent_ratio, expiration_date=future_date) for _ in range(licences)],
+        )
+        db_session.add_all(fleet.alimentations + fleet.guidages + fleet.licences)
+        db_session.commit()
+
+        reasons = [models.HealthReason.GUIDAGE_DOWN, models.HealthReason.MANUAL, models.HealthReason.SHED_FOR_LOAD]
+        fleet.robots = []
+        for i in range(robot_count):
+            healthy = rng.random() >= unhealthy_robot_ratio
+            fleet.robots.append(models.Robot(
+                name=f"Robot_{i}",
+                isHealthy=healthy,
+                reason_mask=0 if healthy else int(rng.choice(reasons)),
+                alimentation_id=rng.choice(fleet.alimentations).id if rng.random() >= missing_alimentation_ratio else 9999,
+                guidage_id=rng.choice(fleet.guidages).id,
+                licence_id=rng.choice(fleet.licences).id,
+                motor=rng.choice(list(models.MotorType)),
+            ))
+        db_session.add_all(fleet.robots)
+        db_session.commit()
+        return fleet
+
+    return make
+
+
+@pytest.fixture
+def statements(engine):
+    """Record the SQL statements sent to the test database"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
@@ -0,0 +1,112 @@
+import pytest
+import sys
+import os
+from sqlalchemy import select, text
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud, schemas
+
+
+@pytest.fixture
+def make_capacity_fleet(make_random_fleet):
+    """Random fleets of small alimentations, every robot attached to one"""
+    def make(seed):
+        return make_random_fleet(
+            seed, robot_count=200, alimentations=10, guidages=5, licences=5, capacities=(50, 100, 300),
+            unhealthy_robot_ratio=0.3, missing_alimentation_ratio=0,
+        )
+    return make
+
+
+def aggregates(db):
+    """Maintained aggregates of every alimentation"""
+    db.expire_all()
+    return {
+        alimentation.id: (alimentation.current_load, alimentation.robots_per_motor)
+        for alimentation in db.query(models.Alimentation)
+    }
+
+
+def recomputed_aggregates(db):
+    """Aggregates summed from the robots"""
+    result = {alimentation_id: [0, {motor.name: 0 for motor in models.MotorType}] for alimentation_id in db.scalars(select(models.Alimentation.id))}
+    for robot in db.query(models.Robot):
+        result[robot.alimentation_id][0] += robot.consumption if robot.isHealthy else 0
+        result[robot.alimentation_id][1][robot.motor.name] += 1
+    return {alimentation_id: tuple(values) for alimentation_id, values in result.items()}
+
+
+class TestLoadAggregates:
+
+    @pytest.mark.parametrize("seed", [1, 2])
+    def test_aggregates_follow_every_write_path(self, db_session, make_capacity_fleet, seed):
+        """Test that inserts, bulk inserts, propagation, shedding, batches and deletes keep the aggregates exact"""
+        fleet = make_capacity_fleet(seed)
+        alimentations, guidages = fleet.alimentations, fleet.guidages
+        assert aggregates(db_session) == recomputed_aggregates(db_session)
+
+        crud.create_robots(db_session, [
+            schemas.RobotCreate(
+                name=f"Bulk_{i}", isHealthy=i % 3 != 0, alimentation_id=alimentations[i % len(alimentations)].id,
+                guidage_id=guidages[0].id, licence_id=fleet.licences[0].id, motor=list(schemas.MotorType)[i % 3],
+            )
+            for i in range(30)
+        ])
+        assert aggregates(db_session) == recomputed_aggregates(db_session)
+
+        crud.update_robots_health_status(db_session)
+        assert aggregates(db_session) == recomputed_aggregates(db_session)
+
+        crud.apply_status_changes(db_session, [
+            schemas.StatusChange(entity_type=schemas.EntityType.guidage, id=guidages[0].id, status=not guidages[0].isHealthy),
+            schemas.StatusChange(entity_type=schemas.EntityType.alimentation, id=alimentations[0].id, status=True),
+        ])
+        assert aggregates(db_session) == recomputed_aggregates(db_session)
+
+        db_session.execute(text("DELETE FROM robots WHERE id % 7 = 0"))
+        db_session.commit()
+        assert aggregates(db_session) == recomputed_aggregates(db_session)
+
+    def test_most_loaded_alimentations(self, db_session, make_capacity_fleet):
+        """Test that alimentations are listed by decreasing load, or increasing headroom"""
+        make_capacity_fleet(3)
+        loads = db_session.execute(select(models.Alimentation.id, models.Alimentation.current_load, models.Alimentation.capacity)).all()
+
+        by_load = crud.get_most_loaded_alimentations(db_session, limit=3)
+        by_headroom = crud.get_most_loaded_alimentations(db_session, limit=3, by="headroom")
+
+        assert [a.id for a in by_load] == [row.id for row in sorted(loads, key=lambda row: (row.current_load, row.id), reverse=True)[:3]]
+        assert [a.id for a in by_headroom] == [row.id for row in sorted(loads, key=lambda row: (row.capacity - row.current_load, row.id))[:3]]
+
+    def test_check_robot_attachment(self, db_session):
+        """Test that a robot fits an alimentation when its consumption fits the headroom"""
+        db_session.add_all([
+            models.Alimentation(id=1, alimentationType=models.AlimentationType.NUCLEAIRE, isHealthy=True, capacity=40),
+            models.Alimentation(id=2, alimentationType=models.AlimentationType.NUCLEAIRE, isHealthy=True, capacity=100),
+        ])
+        db_session.commit()
+        db_session.add_all([
+            models.Robot(id=1, name="A", isHealthy=True, alimentation_id=1, guidage_id=1, licence_id=1, motor=models.MotorType.MOYEN),
+            models.Robot(id=2, name="B", isHealthy=True, alimentation_id=2, guidage_id=1, licence_id=1, motor=models.MotorType.GRAND),
+        ])
+        db_session.commit()
+
+        assert crud.check_robot_attachment(db_session, 2, 1)["can_attach"] == False
+        assert crud.check_robot_attachment(db_session, 2, 1)["headroom"] == -10
+        assert crud.check_robot_attachment(db_session, 1, 2)["can_attach"] == True
+        # Already part of the load of its alimentation
+        assert crud.check_robot_attachment(db_session, 1, 1)["headroom"] == 20
+
+    def test_overloaded_alimentations_are_found_through_the_headroom_index(self, db_session):
+        """Test that the load shedding reads the overloaded alimentations from the index"""
+        plan = db_session.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM alimentations WHERE capacity - current_load < 0"
+        )).all()
+
+        assert "ix_alimentations_headroom" in " ".join(row[-1] for row in plan)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
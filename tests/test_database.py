@@ -0,0 +1,58 @@
+import pytest
+import asyncio
+import sys
+import os
+from sqlalchemy import text
+from sqlalchemy.pool import StaticPool
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import create_database_engine, create_async_database_engine, engine_options
+
+
+class TestDatabaseProfile:
+
+    def test_performance_profile_pragmas(self, tmp_path):
+        """Test that every connection of the performance profile is tuned"""
+        engine = create_database_engine(f"sqlite:///{tmp_path}/profile.db", profile="performance")
+        try:
+            with engine.connect() as connection:
+                assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+                # NORMAL
+                assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+                assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+                assert connection.execute(text("PRAGMA cache_size")).scalar() == -64 * 1024
+        finally:
+            engine.dispose()
+
+    def test_default_profile_keeps_sqlite_defaults(self, tmp_path):
+        """Test that the default profile does not change the journal mode"""
+        engine = create_database_engine(f"sqlite:///{tmp_path}/profile.db", profile="default")
+        try:
+            with engine.connect() as connection:
+                assert connection.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+        finally:
+            engine.dispose()
+
+    def test_async_engine_profile(self, tmp_path):
+        """Test that the aiosqlite connections get the same pragmas"""
+        async def journal_mode():
+            engine = create_async_database_engine(f"sqlite:///{tmp_path}/profile.db", profile="performance")
+            try:
+                async with engine.connect() as connection:
+                    return (await connection.execute(text("PRAGMA journal_mode"))).scalar()
+            finally:
+                await engine.dispose()
+
+        assert asyncio.run(journal_mode()) == "wal"
+
+    def test_pool_strategy(self):
+        """Test the pool chosen for each kind of database"""
+        assert engine_options("sqlite://")["poolclass"] is StaticPool
+        assert engine_options("sqlite:///./test.db")["connect_args"] == {"check_same_thread": False}
+        assert engine_options("postgresql://user@localhost/dependencies_game")["pool_pre_ping"] == True
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,165 @@
+import pytest
+import sys
+import os
+from sqlalchemy import Column, Integer, Boolean, ForeignKey
+from sqlalchemy.orm import declarative_base
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import propagation
+from src.dependency_graph import DependencyGraph, DependencyCycleError
+
+
+# A deeper chain than the application's: robots depend on guidages, which depend on
+# sensor arrays, and a licence is shared by the guidages and the robots
+GraphBase = declarative_base()
+
+
+class SensorArray(GraphBase):
+    __tablename__ = "sensor_arrays"
+    id = Column(Integer, primary_key=True)
+    isHealthy = Column(Boolean, nullable=False)
+    # Only declared as an edge by the cycle detection test
+    calibration_robot_id = Column(Integer)
+
+
+class Licence(GraphBase):
+    __tablename__ = "licences"
+    id = Column(Integer, primary_key=True)
+    isHealthy = Column(Boolean, nullable=False)
+
+
+class Guidage(GraphBase):
+    __tablename__ = "guidages"
+    id = Column(Integer, primary_key=True)
+    isHealthy = Column(Boolean, nullable=False)
+    sensor_array_id = Column(Integer, ForeignKey("sensor_arrays.id"), index=True)
+    licence_id = Column(Integer, ForeignKey("licences.id"), index=True)
+    backup_guidage_id = Column(Integer)
+
+
+class Robot(GraphBase):
+    __tablename__ = "robots"
+    id = Column(Integer, primary_key=True)
+    isHealthy = Column(Boolean, nullable=False)
+    guidage_id = Column(Integer, ForeignKey("guidages.id"), index=True)
+    licence_id = Column(Integer, ForeignKey("licences.id"), index=True)
+
+
+def build_graph():
+    graph = DependencyGraph()
+    for model in (Robot, Guidage, SensorArray, Licence):
+        graph.add_entity(model)
+    graph.add_edge(Robot.guidage_id, Guidage)
+    graph.add_edge(Robot.licence_id, Licence)
+    graph.add_edge(Guidage.sensor_array_id, SensorArray)
+    graph.add_edge(Guidage.licence_id, Licence)
+    return graph
+
+
+@pytest.fixture
+def db_session(engine, session_factory):
+    """Create a fresh database with two sensor arrays, three guidages and six robots"""
+    GraphBase.metadata.create_all(bind=engine)
+    db = session_factory()
+    db.add_all([SensorArray(id=1, isHealthy=True), SensorArray(id=2, isHealthy=True), Licence(id=1, isHealthy=True)])
+    db.add_all([Guidage(id=i, isHealthy=True, sensor_array_id=1 if i < 3 else 2, licence_id=1) for i in (1, 2, 3)])
+    db.add_all([Robot(id=i, isHealthy=True, guidage_id=(i + 1) // 2, licence_id=1) for i in range(1, 7)])
+    db.commit()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def health(db, model):
+    db.expire_all()
+    return {entity.id: entity.isHealthy for entity in db.query(model).order_by(model.id)}
+
+
+class TestDependencyGraph:
+
+    def test_topological_order(self):
+        """Test that every entity type comes after its parents"""
+        order = [entity.model for entity in build_graph().order]
+
+        assert order.index(SensorArray) < order.index(Guidage) < order.index(Robot)
+        assert order.index(Licence) < order.index(Guidage)
+        assert [entity.model for entity in build_graph().derived()] == [Guidage, Robot]
+
+    def test_cycles_are_rejected_at_registration(self):
+        """Test that an edge making an entity depend on itself is rejected and not added"""
+        graph = build_graph()
+
+        with pytest.raises(DependencyCycleError, match="Robot -> SensorArray -> Guidage -> Robot"):
+            graph.add_edge(SensorArray.calibration_robot_id, Robot)
+        with pytest.raises(DependencyCycleError, match="Guidage -> Guidage"):
+            graph.add_edge(Guidage.backup_guidage_id, Guidage)
+        assert [edge.child for edge in graph.children(Robot)] == []
+        assert [entity.model for entity in graph.derived()] == [Guidage, Robot]
+
+    def test_changes_propagate_through_every_level(self, db_session):
+        """Test that a sensor array turns off its guidages, then their robots, and back on"""
+        graph = build_graph()
+        db_session.get(SensorArray, 1).isHealthy = False
+        db_session.commit()
+
+        changes = propagation.propagate_changes(db_session, {SensorArray: [1]}, collect={Robot}, dependency_graph=graph)
+
+        assert changes == {Guidage: ([1, 2], []), Robot: ([1, 2, 3, 4], [])}
+        assert health(db_session, Robot) == {1: False, 2: False, 3: False, 4: False, 5: True, 6: True}
+
+        db_session.get(SensorArray, 1).isHealthy = True
+        db_session.commit()
+        changes = propagation.propagate_changes(db_session, {SensorArray: [1]}, dependency_graph=graph)
+
+        assert propagation.totals(changes) == {"disabled": 0, "recovered": 6}
+        assert all(health(db_session, Robot).values())
+
+    def test_shared_parent_reaches_every_child_type(self, db_session):
+        """Test that a parent of several entity types propagates to all of them, in order"""
+        graph = build_graph()
+        db_session.get(Licence, 1).isHealthy = False
+        db_session.commit()
+
+        changes = propagation.propagate_changes(db_session, {Licence: [1]}, dependency_graph=graph)
+
+        assert propagation.totals(changes) == {"disabled": 9, "recovered": 0}
+        assert not any(health(db_session, Guidage).values())
+
+    def test_only_the_changed_subgraph_is_visited(self, db_session, statements):
+        """Test that a level whose entities did not change stops the propagation"""
+        graph = build_graph()
+        db_session.get(Guidage, 3).isHealthy = False
+        db_session.get(SensorArray, 2).isHealthy = False
+        db_session.commit()
+        statements.clear()
+
+        # Guidage 3 was already off: none of the robots needs to be re-evaluated
+        changes = propagation.propagate_changes(db_session, {SensorArray: [2]}, dependency_graph=graph)
+
+        assert changes == {Guidage: ([], [])}
+        assert not any("UPDATE robots" in statement for statement in statements)
+
+    def test_full_propagation_follows_the_topological_order(self, db_session):
+        """Test that one fleet-wide pass settles every level"""
+        graph = build_graph()
+        db_session.get(SensorArray, 2).isHealthy = False
+        db_session.commit()
+
+        changes = propagation.propagate_all(db_session, dependency_graph=graph)
+
+        assert changes == {"disabled": 3, "recovered": 0}
+        assert health(db_session, Robot) == {1: True, 2: True, 3: True, 4: True, 5: False, 6: False}
+
+    def test_event_columns_describe_the_parents_at_every_level(self):
+        """Test that an intermediate entity is described by its own id and the ids of its parents"""
+        graph = build_graph()
+
+        assert [key for key, _ in graph.event_columns(Guidage)] == ["guidage_id", "sensor_array_id", "licence_id"]
+        assert [key for key, _ in graph.event_columns(Robot)] == ["guidage_id", "licence_id"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
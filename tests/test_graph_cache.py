@@ -0,0 +1,107 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud
+from src.graph_cache import graph_cache, DependencyGraphCache
+
+
+@pytest.fixture
+def fleet(db_session, make_fleet):
+    """One alimentation, one guidage, two licences and two robots, with a warm cache"""
+    make_fleet([
+        (1, 1, 1, models.MotorType.PETIT, False),
+        (1, 1, 2, models.MotorType.PETIT, False),
+    ], licence_days=(30, 30))
+    graph_cache.warm(db_session)
+
+
+class TestGraphCache:
+
+    def test_status_validation_does_not_query_parents(self, db_session, fleet, statements):
+        """Test that turning a robot on is validated from the cache"""
+        crud.update_robot_status(db_session, 1, True)
+
+        assert not any(table in statement for statement in statements for table in ("alimentations", "guidages", "licences"))
+        assert graph_cache.misses == 0
+        assert graph_cache.hits == 4
+
+    def test_unhealthy_parent_is_rejected_from_cache(self, db_session, fleet, statements):
+        """Test that a cached unhealthy parent rejects the change without any query"""
+        crud.update_licence_status(db_session, 2, False)
+        statements.clear()
+
+        with pytest.raises(HTTPException):
+            crud.update_robot_status(db_session, 2, True)
+        assert statements == []
+
+    def test_parent_changes_are_written_through_on_commit(self, db_session, fleet):
+        """Test that ORM changes reach the cache only once committed"""
+        guidage = db_session.get(models.Guidage, 1)
+        guidage.isHealthy = False
+        db_session.flush()
+        db_session.rollback()
+        assert graph_cache.parent_health(db_session, models.Guidage, 1) == True
+
+        guidage = db_session.get(models.Guidage, 1)
+        guidage.isHealthy = False
+        db_session.commit()
+        assert graph_cache.parent_health(db_session, models.Guidage, 1) == False
+
+    def test_created_robots_are_cached(self, db_session, fleet, statements):
+        """Test that created robots and parents are written through"""
+        guidage = models.Guidage(isHealthy=True)
+        db_session.add(guidage)
+        db_session.commit()
+        robot = models.Robot(name="C", isHealthy=False, alimentation_id=1, guidage_id=guidage.id, licence_id=1, motor=models.MotorType.PETIT)
+        db_session.add(robot)
+        db_session.commit()
+        robot_id = robot.id
+        statements.clear()
+
+        assert graph_cache.robot_parents_healthy(db_session, robot_id) == True
+        assert statements == []
+
+    def test_expired_licences_are_written_through(self, db_session, fleet):
+        """Test that the set-based licence sweep updates the cache"""
+        db_session.get(models.Licence, 1).expiration_date = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=1)
+        db_session.commit()
+
+        crud.expire_licences(db_session)
+
+        assert graph_cache.parent_health(db_session, models.Licence, 1) == False
+
+    def test_missing_objects_are_not_cached(self, db_session, fleet):
+        """Test that an unknown robot is still reported as missing"""
+        with pytest.raises(HTTPException):
+            crud.update_robot_status(db_session, 42, True)
+
+    def test_eviction(self, db_session, fleet):
+        """Test that the least recently used entries are evicted beyond max_size"""
+        cache = DependencyGraphCache(max_size=1)
+        cache.warm(db_session)
+        assert cache.stats()["size"]["licences"] == 1
+
+        cache.parent_health(db_session, models.Licence, 1)
+        cache.parent_health(db_session, models.Licence, 2)
+        cache.parent_health(db_session, models.Licence, 2)
+
+        assert cache.misses == 1
+        assert cache.hits == 2
+        assert cache.evictions == 1
+
+    def test_other_databases_bypass_the_cache(self, db_session, fleet):
+        """Test that the cache is only used for the database it was warmed for"""
+        graph_cache.reset()
+
+        assert graph_cache.robot_parents_healthy(db_session, 1) == True
+        assert graph_cache.size() == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,210 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timezone, timedelta
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud, propagation
+
+
+def expected_health(db, robot):
+    """Reference rules of the historical row-by-row implementation"""
+    parents = [
+        db.get(models.Alimentation, robot.alimentation_id),
+        db.get(models.Guidage, robot.guidage_id),
+        db.get(models.Licence, robot.licence_id),
+    ]
+    if any(parent is not None and not parent.isHealthy for parent in parents):
+        return False
+    if all(parent is not None and parent.isHealthy for parent in parents):
+        return robot.isHealthy or not robot.reason_mask & ~propagation.PARENT_REASON_MASK
+    return robot.isHealthy
+
+
+class TestHealthPropagation:
+
+    @pytest.mark.parametrize("seed", [1, 2, 3])
+    def test_propagation_matches_reference_rules(self, db_session, make_random_fleet, seed):
+        """Test that set-based propagation gives the same result as the row-by-row rules"""
+        robots = make_random_fleet(seed).robots
+        expected = {robot.id: expected_health(db_session, robot) for robot in robots}
+        changed = sum(1 for robot in robots if expected[robot.id] != robot.isHealthy)
+
+        result = propagation.propagate_robots_health(db_session)
+
+        actual = {robot.id: robot.isHealthy for robot in db_session.query(models.Robot).all()}
+        assert actual == expected
+        assert result["disabled"] + result["recovered"] == changed
+
+    def test_propagation_is_idempotent(self, db_session, make_random_fleet):
+        """Test that a second run does not change anything"""
+        make_random_fleet(4)
+        propagation.propagate_robots_health(db_session)
+
+        result = propagation.propagate_robots_health(db_session)
+
+        assert result == {"disabled": 0, "recovered": 0}
+
+    def test_update_robots_health_status_reports_changes(self, db_session):
+        """Test that the crud entry point reports the number of changed robots"""
+        future_date = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=30)
+        alimentation = models.Alimentation(alimentationType=models.AlimentationType.SOLAIRE, isHealthy=False, capacity=100)
+        guidage = models.Guidage(isHealthy=True)
+        licence = models.Licence(isHealthy=True, expiration_date=future_date)
+        db_session.add_all([alimentation, guidage, licence])
+        db_session.commit()
+        robot = models.Robot(
+            name="Test Robot",
+            isHealthy=True,
+            alimentation_id=alimentation.id,
+            guidage_id=guidage.id,
+            licence_id=licence.id,
+            motor=models.MotorType.PETIT,
+        )
+        db_session.add(robot)
+        db_session.commit()
+
+        result = crud.update_robots_health_status(db_session)
+
+        db_session.refresh(robot)
+        assert robot.isHealthy == False
+        assert result["disabled"] == 1
+        assert result["recovered"] == 0
+        assert set(result["timings"]) == {"licence_sweep", "propagation", "recovery", "power_shedding"}
+
+    def test_parent_propagation_only_touches_linked_robots(self, db_session):
+        """Test that a parent status change only re-evaluates the robots referencing it"""
+        future_date = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=30)
+        flipped = models.Guidage(isHealthy=False)
+        other = models.Guidage(isHealthy=False)
+        alimentation = models.Alimentation(alimentationType=models.AlimentationType.NUCLEAIRE, isHealthy=True, capacity=100)
+        licence = models.Licence(isHealthy=True, expiration_date=future_date)
+        db_session.add_all([flipped, other, alimentation, licence])
+        db_session.commit()
+        linked = models.Robot(name="Linked", isHealthy=True, alimentation_id=alimentation.id,
+                              guidage_id=flipped.id, licence_id=licence.id, motor=models.MotorType.PETIT)
+        unrelated = models.Robot(name="Unrelated", isHealthy=True, alimentation_id=alimentation.id,
+                                 guidage_id=other.id, licence_id=licence.id, motor=models.MotorType.PETIT)
+        db_session.add_all([linked, unrelated])
+        db_session.commit()
+
+        result = crud.update_robots_health_for_parent(db_session, models.Guidage, flipped.id)
+
+        db_session.refresh(linked)
+        db_session.refresh(unrelated)
+        assert linked.isHealthy == False
+        assert unrelated.isHealthy == True
+        assert result["disabled"] == 1
+
+        flipped.isHealthy = True
+        db_session.commit()
+        result = crud.update_robots_health_for_parent(db_session, models.Guidage, flipped.id)
+
+        db_session.refresh(linked)
+        assert linked.isHealthy == True
+        assert result["recovered"] == 1
+
+    @pytest.mark.parametrize("seed", [1, 2])
+    def test_reasons_match_unhealthy_parents(self, db_session, make_random_fleet, seed):
+        """Test that the robots turned off by the propagation record each unhealthy parent"""
+        robots = make_random_fleet(seed).robots
+        propagation.propagate_robots_health(db_session)
+
+        for robot in robots:
+            db_session.refresh(robot)
+            expected = 0
+            for model, column in propagation.ROBOT_PARENTS:
+                parent = db_session.get(model, getattr(robot, column.key))
+                if parent is not None and not parent.isHealthy:
+                    expected |= propagation.PARENT_REASONS[model]
+            if robot.isHealthy:
+                assert robot.reason_mask == 0
+            else:
+                assert robot.reason_mask & propagation.PARENT_REASON_MASK == expected
+
+    def test_reasons_follow_parent_changes(self, db_session):
+        """Test that the reasons of a robot down for several parents are updated one parent at a time"""
+        future_date = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=30)
+        alimentation = models.Alimentation(alimentationType=models.AlimentationType.NUCLEAIRE, isHealthy=True, capacity=100)
+        guidage = models.Guidage(isHealthy=True)
+        licence = models.Licence(isHealthy=True, expiration_date=future_date)
+        db_session.add_all([alimentation, guidage, licence])
+        db_session.commit()
+        robot = models.Robot(name="Robot", isHealthy=True, alimentation_id=alimentation.id,
+                             guidage_id=guidage.id, licence_id=licence.id, motor=models.MotorType.PETIT)
+        db_session.add(robot)
+        db_session.commit()
+        assert robot.reasons == []
+
+        def change(parent, healthy):
+            parent.isHealthy = healthy
+            db_session.commit()
+            crud.update_robots_health_for_parent(db_session, type(parent), parent.id)
+            db_session.refresh(robot)
+
+        change(alimentation, False)
+        assert robot.reasons == ["alimentation_down"]
+        change(guidage, False)
+        assert robot.reasons == ["alimentation_down", "guidage_down"]
+        change(alimentation, True)
+        assert (robot.isHealthy, robot.reasons) == (False, ["guidage_down"])
+        change(guidage, True)
+        assert (robot.isHealthy, robot.reasons) == (True, [])
+
+        crud.update_robot_status(db_session, robot.id, False)
+        assert robot.reasons == ["manual"]
+
+    def test_manual_and_shed_robots_are_not_recovered(self, db_session):
+        """Test that robots down for a reason of their own stay off through the sweeps and parent recoveries"""
+        future_date = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=30)
+        alimentation = models.Alimentation(alimentationType=models.AlimentationType.NUCLEAIRE, isHealthy=True, capacity=25)
+        guidage = models.Guidage(isHealthy=True)
+        licence = models.Licence(isHealthy=True, expiration_date=future_date)
+        db_session.add_all([alimentation, guidage, licence])
+        db_session.commit()
+        db_session.add_all([
+            models.Robot(id=i, name=f"Robot {i}", isHealthy=True, alimentation_id=alimentation.id,
+                         guidage_id=guidage.id, licence_id=licence.id, motor=models.MotorType.PETIT)
+            for i in (1, 2, 3)
+        ])
+        db_session.commit()
+
+        def state():
+            db_session.expire_all()
+            return {robot.id: (robot.isHealthy, robot.reason_mask) for robot in db_session.query(models.Robot).order_by(models.Robot.id)}
+
+        crud.update_robot_status(db_session, 1, False)
+        crud.update_power_health_status(db_session)
+        assert state() == {1: (False, 16), 2: (True, 0), 3: (True, 0)}
+        alimentation.capacity = 15
+        db_session.commit()
+        crud.update_power_health_status(db_session)
+        assert state() == {1: (False, 16), 2: (True, 0), 3: (False, 8)}
+
+        for _ in range(2):
+            result = crud.update_robots_health_status(db_session)
+            assert (result["disabled"], result["recovered"]) == (0, 0)
+            assert state() == {1: (False, 16), 2: (True, 0), 3: (False, 8)}
+
+        guidage.isHealthy = False
+        db_session.commit()
+        crud.update_robots_health_for_parent(db_session, models.Guidage, guidage.id)
+        guidage.isHealthy = True
+        db_session.commit()
+        crud.update_robots_health_for_parent(db_session, models.Guidage, guidage.id)
+        assert state() == {1: (False, 16), 2: (True, 0), 3: (False, 8)}
+
+        # Turned back on explicitly
+        crud.update_robot_status(db_session, 1, True)
+        assert state()[1] == (True, 0)
+
+    def test_parent_propagation_rejects_unknown_parent(self, db_session):
+        """Test that only robot parents can scope a propagation"""
+        with pytest.raises(ValueError):
+            propagation.propagate_parent_health(db_session, models.Robot, 1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,170 @@
+import pytest
+import sys
+import os
+import asyncio
+from datetime import datetime
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud, schemas
+from src.health_stream import health_stream, SubscriptionDropped
+from src.routers.events import _iter_sse
+
+
+@pytest.fixture
+def fleet(make_fleet):
+    """Two alimentations, one guidage, two licences and three robots"""
+    make_fleet([
+        (1, 1, 1, models.MotorType.PETIT, True),
+        (2, 1, 1, models.MotorType.MOYEN, True),
+        (2, 1, 2, models.MotorType.MOYEN, True),
+    ], capacities=(100, 100), licence_days=(30, 30))
+
+
+def set_health(db_session, model, entity_id, status):
+    """Change the health of a parent the way its status endpoint does"""
+    db_session.get(model, entity_id).isHealthy = status
+    db_session.commit()
+
+
+def summary(events):
+    return [(event["entity"], event["id"], event["old"], event["new"], event["cause"]) for event in events]
+
+
+async def next_events(subscription):
+    return await subscription.get(timeout=1)
+
+
+class TestHealthStream:
+
+    def test_committed_changes_are_streamed_with_their_cause(self, db_session, fleet):
+        """Test that a parent change and the robot changes it propagates are streamed once committed"""
+        async def scenario():
+            subscription = health_stream.subscribe()
+            try:
+                crud.apply_status_changes(db_session, [schemas.StatusChange(entity_type=schemas.EntityType.alimentation, id=2, status=False)])
+                first = await next_events(subscription)
+                crud.update_robots_health_for_parent(db_session, models.Alimentation, 2)
+                set_health(db_session, models.Alimentation, 2, True)
+                crud.update_robots_health_for_parent(db_session, models.Alimentation, 2)
+                second = await next_events(subscription)
+                return first, second
+            finally:
+                health_stream.unsubscribe(subscription)
+
+        first, second = asyncio.run(scenario())
+
+        assert summary(first) == [
+            ("alimentation", 2, True, False, "manual"),
+            ("robot", 2, True, False, "propagation"),
+            ("robot", 3, True, False, "propagation"),
+        ]
+        assert summary(second) == [
+            ("alimentation", 2, False, True, "manual"),
+            ("robot", 2, False, True, "propagation"),
+            ("robot", 3, False, True, "propagation"),
+        ]
+
+    def test_events_are_filtered_by_parent(self, db_session, fleet):
+        """Test that a subscriber only receives the events of its licence and of the robots using it"""
+        async def scenario():
+            subscription = health_stream.subscribe(licence_id=2)
+            try:
+                set_health(db_session, models.Guidage, 1, False)
+                crud.update_robots_health_for_parent(db_session, models.Guidage, 1)
+                crud.update_licence_status(db_session, 2, False)
+                return await next_events(subscription)
+            finally:
+                health_stream.unsubscribe(subscription)
+
+        events = asyncio.run(scenario())
+
+        assert summary(events) == [("robot", 3, True, False, "propagation"), ("licence", 2, True, False, "manual")]
+        assert events[0]["licence_id"] == 2
+
+    def test_expired_licences_and_shed_robots_are_streamed(self, db_session, fleet):
+        """Test that the set-based licence sweep and load shedding stream their changes"""
+        async def scenario():
+            subscription = health_stream.subscribe()
+            try:
+                db_session.get(models.Licence, 2).expiration_date = datetime(2000, 1, 1)
+                db_session.get(models.Alimentation, 2).capacity = 10
+                db_session.commit()
+                crud.expire_licences(db_session)
+                crud.update_power_health_status(db_session)
+                return await next_events(subscription)
+            finally:
+                health_stream.unsubscribe(subscription)
+
+        events = asyncio.run(scenario())
+
+        assert summary(events) == [
+            ("licence", 2, True, False, "expiration"),
+            ("robot", 3, True, False, "propagation"),
+            ("robot", 2, True, False, "power"),
+        ]
+
+    def test_rolled_back_changes_are_not_streamed(self, db_session, fleet):
+        """Test that nothing is published for a transaction which does not commit"""
+        async def scenario():
+            subscription = health_stream.subscribe()
+            try:
+                db_session.get(models.Robot, 1).set_status(False)
+                db_session.flush()
+                db_session.rollback()
+                return await subscription.get(timeout=0.1)
+            finally:
+                health_stream.unsubscribe(subscription)
+
+        assert asyncio.run(scenario()) == []
+
+    def test_slow_subscribers_are_dropped(self, db_session, fleet, monkeypatch):
+        """Test that a subscriber falling more than its buffer behind is dropped, the others kept"""
+        monkeypatch.setattr(health_stream, "buffer_size", 2)
+        dropped = health_stream.dropped
+
+        async def scenario():
+            slow = health_stream.subscribe()
+            filtered = health_stream.subscribe(alimentation_id=1)
+            try:
+                set_health(db_session, models.Guidage, 1, False)
+                crud.update_robots_health_for_parent(db_session, models.Guidage, 1)
+                await asyncio.sleep(0)
+                with pytest.raises(SubscriptionDropped):
+                    await slow.get(timeout=1)
+                return health_stream.subscription_count(), summary(await filtered.get(timeout=1))
+            finally:
+                health_stream.unsubscribe(slow)
+                health_stream.unsubscribe(filtered)
+
+        count, events = asyncio.run(scenario())
+
+        assert count == 1
+        assert events == [("robot", 1, True, False, "propagation")]
+        assert health_stream.dropped == dropped + 1
+
+    def test_server_sent_events_format(self, db_session, fleet):
+        """Test that the SSE stream writes one health event per change, then a dropped event"""
+        async def scenario():
+            subscription = health_stream.subscribe(alimentation_id=1)
+            stream = _iter_sse(subscription)
+            chunks = [await anext(stream)]
+            crud.update_robot_status(db_session, 1, False)
+            chunks.append(await anext(stream))
+            subscription._offer([{}] * (subscription.buffer_size + 1))
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        connected, health, dropped = asyncio.run(scenario())
+
+        assert connected == ": connected\n\n"
+        assert health.startswith("event: health\ndata: ")
+        assert '"cause": "manual"' in health and health.endswith("\n\n")
+        assert dropped.startswith("event: dropped\n")
+        assert health_stream.subscription_count() == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
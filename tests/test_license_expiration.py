@@ -1,33 +1,14 @@
 import pytest
 import sys
+import time
 import os
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 # Add the parent directory to the path to import src modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src import models, crud, schemas
-from src.database import Base
-
-
-# Create test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test_license.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-@pytest.fixture
-def db_session():
-    """Create a fresh database for each test"""
-    Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-        Base.metadata.drop_all(bind=engine)
+from src.scheduler import LicenceExpiryScheduler
 
 
 class TestLicenseExpiration:
@@ -110,6 +91,24 @@ class TestLicenseExpiration:
         license = crud.create_licence(db_session, license_data)
         assert license.isHealthy == False
     
+    def test_license_creation_with_timezone_aware_dates(self, db_session):
+        """Test that aware expiration dates are compared, and stored, as naive UTC dates"""
+        paris = timezone(timedelta(hours=2))
+        now = datetime.now(paris)
+        expired = now - timedelta(minutes=30)
+        valid = now + timedelta(minutes=30)
+        
+        license = crud.create_licence(db_session, schemas.LicenceCreate(isHealthy=True, expiration_date=expired))
+        licence_ids = crud.create_licences(db_session, [
+            schemas.LicenceCreate(isHealthy=True, expiration_date=expired),
+            schemas.LicenceCreate(isHealthy=True, expiration_date=valid),
+        ])
+        
+        bulk = [db_session.get(models.Licence, licence_id) for licence_id in licence_ids]
+        assert license.isHealthy == False
+        assert [licence.isHealthy for licence in bulk] == [False, True]
+        assert bulk[1].expiration_date == valid.astimezone(timezone.utc).replace(tzinfo=None)
+    
     def test_update_robots_health_status_calls_license_update(self, db_session):
         """Test that updating robot health status also updates license statuses"""
         # Create an expired license
@@ -154,6 +153,90 @@ class TestLicenseExpiration:
         assert expired_license.isHealthy == False
         assert robot.isHealthy == False  # Robot should be unhealthy due to expired license
 
+    def test_expire_licences_turns_off_dependent_robots(self, db_session):
+        """Test that expiring licences also turns off the robots depending on them"""
+        past_date = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=1)
+        expired_license = models.Licence(isHealthy=True, expiration_date=past_date)
+        alimentation = models.Alimentation(alimentationType=models.AlimentationType.SOLAIRE, isHealthy=True, capacity=100)
+        guidage = models.Guidage(isHealthy=True)
+        db_session.add_all([expired_license, alimentation, guidage])
+        db_session.commit()
+        robot = models.Robot(
+            name="Test Robot",
+            isHealthy=True,
+            alimentation_id=alimentation.id,
+            guidage_id=guidage.id,
+            licence_id=expired_license.id,
+            motor=models.MotorType.PETIT
+        )
+        db_session.add(robot)
+        db_session.commit()
+
+        result = crud.expire_licences(db_session)
+
+        db_session.refresh(expired_license)
+        db_session.refresh(robot)
+        assert expired_license.isHealthy == False
+        assert robot.isHealthy == False
+        assert result == {"expired": 1, "disabled": 1}
+
+    def test_get_next_licence_expiration_ignores_unhealthy_licenses(self, db_session):
+        """Test that the next expiration is the earliest one among healthy licenses"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        db_session.add_all([
+            models.Licence(isHealthy=False, expiration_date=now + timedelta(days=1)),
+            models.Licence(isHealthy=True, expiration_date=now + timedelta(days=2)),
+            models.Licence(isHealthy=True, expiration_date=now + timedelta(days=3)),
+        ])
+        db_session.commit()
+
+        assert crud.get_next_licence_expiration(db_session) == now + timedelta(days=2)
+
+    def test_scheduler_expires_license_at_expiration_date(self, db_session, session_factory):
+        """Test that the scheduler wakes up when the next license expires"""
+        expiration_date = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=0.5)
+        license = models.Licence(isHealthy=True, expiration_date=expiration_date)
+        db_session.add(license)
+        db_session.commit()
+        scheduler = LicenceExpiryScheduler(session_factory)
+
+        scheduler.start()
+        try:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                db_session.refresh(license)
+                if not license.isHealthy:
+                    break
+                time.sleep(0.05)
+        finally:
+            scheduler.stop()
+
+        assert license.isHealthy == False
+        assert datetime.now(timezone.utc).replace(tzinfo=None) >= expiration_date
+
+    def test_scheduler_reruns_after_a_notify_during_a_run(self, db_session, session_factory):
+        """Test that a licence changed while a sweep runs is swept right after it, not after max_sleep"""
+        runs = []
+        scheduler = LicenceExpiryScheduler(session_factory, max_sleep=60)
+        run_once = scheduler.run_once
+
+        def run_and_notify():
+            runs.append(None)
+            if len(runs) == 1:
+                scheduler.notify()
+            return run_once()
+
+        scheduler.run_once = run_and_notify
+        scheduler.start()
+        try:
+            deadline = time.monotonic() + 5
+            while len(runs) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+
+        assert len(runs) >= 2
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
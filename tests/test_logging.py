@@ -0,0 +1,48 @@
+import json
+import logging
+import queue
+import sys
+import os
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_config import JsonFormatter, SamplingFilter, DeferredQueueHandler
+
+
+def make_record(name="src.crud", level=logging.INFO, msg="Robot %s updated", args=(1,), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestStructuredLogging:
+
+    def test_json_formatter_adds_extra_fields(self):
+        """Test that the JSON lines hold the formatted message and the extra fields"""
+        entry = json.loads(JsonFormatter().format(make_record(robot_id=1)))
+        assert entry["message"] == "Robot 1 updated"
+        assert entry["level"] == "INFO"
+        assert entry["logger"] == "src.crud"
+        assert entry["robot_id"] == 1
+        assert "args" not in entry and "msg" not in entry
+
+    def test_sampling_filter(self):
+        """Test that 1 record of every N is kept per message, and warnings always"""
+        sampling = SamplingFilter({"src.crud": 10, "src": 1})
+        kept = [sampling.filter(make_record(args=(i,))) for i in range(25)]
+        assert kept.count(True) == 3
+        assert sampling.filter(make_record(msg="Other %s"))
+        assert all(sampling.filter(make_record(level=logging.WARNING)) for _ in range(5))
+        assert all(sampling.filter(make_record(name="src.workers")) for _ in range(5))
+
+    def test_queue_handler_defers_formatting(self):
+        """Test that the records are enqueued unformatted, with their arguments"""
+        log_queue = queue.SimpleQueue()
+        handler = DeferredQueueHandler(log_queue)
+        record = make_record()
+        handler.handle(record)
+        queued = log_queue.get_nowait()
+        assert queued is record
+        assert queued.args == (1,)
+        assert not hasattr(queued, "message")
@@ -0,0 +1,83 @@
+import pytest
+import sys
+import os
+from sqlalchemy import create_engine, inspect, text
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models
+from src.migrations import migrate
+
+
+# Schema created by the first version of the models, without foreign keys nor dependency indexes
+LEGACY_SCHEMA = [
+    'CREATE TABLE robots (id INTEGER NOT NULL, "isHealthy" BOOLEAN, name VARCHAR, alimentation_id INTEGER, '
+    'guidage_id INTEGER, licence_id INTEGER, motor VARCHAR(5) NOT NULL, PRIMARY KEY (id))',
+    'CREATE INDEX ix_robots_id ON robots (id)',
+    'CREATE INDEX ix_robots_name ON robots (name)',
+    'CREATE TABLE alimentations (id INTEGER NOT NULL, "isHealthy" BOOLEAN, "alimentationType" VARCHAR(9) NOT NULL, '
+    'capacity INTEGER NOT NULL, PRIMARY KEY (id))',
+    'CREATE TABLE guidages (id INTEGER NOT NULL, "isHealthy" BOOLEAN, PRIMARY KEY (id))',
+    'CREATE TABLE licences (id INTEGER NOT NULL, "isHealthy" BOOLEAN, expiration_date DATETIME NOT NULL, PRIMARY KEY (id))',
+]
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    """Create a database file with the legacy schema and one robot"""
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO robots (id, \"isHealthy\", name, alimentation_id, guidage_id, licence_id, motor) "
+            "VALUES (7, 1, 'Legacy Robot', 1, 2, 3, 'GRAND')"
+        ))
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+
+
+def test_migrate_adds_foreign_keys_and_indexes(legacy_engine):
+    """Test that a legacy database gets the robot foreign keys and indexes"""
+    migrate(legacy_engine)
+
+    inspector = inspect(legacy_engine)
+    foreign_keys = {fk["constrained_columns"][0]: fk["referred_table"] for fk in inspector.get_foreign_keys("robots")}
+    indexes = {index["name"] for index in inspector.get_indexes("robots")}
+    assert foreign_keys == {"alimentation_id": "alimentations", "guidage_id": "guidages", "licence_id": "licences"}
+    assert {"ix_robots_alimentation_power", "ix_robots_guidage_health", "ix_robots_licence_health"} <= indexes
+    assert "ix_licences_expiration_date" in {index["name"] for index in inspector.get_indexes("licences")}
+
+
+def test_migrate_backfills_robot_reasons(legacy_engine):
+    """Test that the reasons of the unhealthy robots of a legacy database are filled"""
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO guidages (id, \"isHealthy\") VALUES (2, 0)"))
+        conn.execute(text(
+            "INSERT INTO robots (id, \"isHealthy\", name, alimentation_id, guidage_id, licence_id, motor) "
+            "VALUES (8, 0, 'Guidage Down', 1, 2, 3, 'PETIT'), (9, 0, 'Turned Off', 1, 5, 3, 'PETIT')"
+        ))
+
+    operations = migrate(legacy_engine)
+
+    assert "backfill column robots.reason_mask" in operations
+    with legacy_engine.connect() as conn:
+        masks = dict(conn.execute(text("SELECT id, reason_mask FROM robots")).all())
+    assert masks == {7: 0, 8: models.HealthReason.GUIDAGE_DOWN, 9: models.HealthReason.MANUAL}
+
+
+def test_migrate_keeps_data_and_is_idempotent(legacy_engine):
+    """Test that migrating keeps existing rows and that a second run does nothing"""
+    migrate(legacy_engine)
+
+    assert migrate(legacy_engine) == []
+    with legacy_engine.connect() as conn:
+        row = conn.execute(text("SELECT id, name, alimentation_id, guidage_id, licence_id, motor FROM robots")).one()
+    assert tuple(row) == (7, "Legacy Robot", 1, 2, 3, "GRAND")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,82 @@
+import pytest
+import sys
+import os
+import random
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud, power
+
+
+def expected_turned_off(alimentations, robots):
+    """Reference implementation of the historical per-alimentation loop"""
+    turned_off = set()
+    for alim in alimentations:
+        if not alim.isHealthy:
+            continue
+        healthy_robots = [r for r in robots if r.alimentation_id == alim.id and r.isHealthy]
+        current_load = sum(r.consumption for r in healthy_robots)
+        for robot in sorted(healthy_robots, key=lambda r: (r.consumption, r.id), reverse=True):
+            if current_load <= alim.capacity:
+                break
+            turned_off.add(robot.id)
+            current_load -= robot.consumption
+    return turned_off
+
+
+class TestPowerShedding:
+
+    def test_largest_consumer_then_highest_id_is_turned_off_first(self):
+        """Test the shedding order on a single overloaded alimentation"""
+        robot_ids, overloaded = power.select_robots_to_turn_off(
+            robot_alimentation_ids=[1, 1, 1, 1],
+            robot_consumptions=[30, 10, 30, 20],
+            robot_ids=[1, 2, 3, 4],
+            alimentation_ids=[1],
+            capacities=[35],
+        )
+
+        assert list(robot_ids) == [3, 1]
+        assert list(overloaded[0]) == [1]
+        assert list(overloaded[2]) == [90]
+
+    def test_unknown_alimentations_are_ignored(self):
+        """Test that robots on unknown or unhealthy alimentations are left alone"""
+        robot_ids, overloaded = power.select_robots_to_turn_off([7, 7], [30, 30], [1, 2], [1], [10])
+
+        assert len(robot_ids) == 0
+        assert len(overloaded[0]) == 0
+
+    @pytest.mark.parametrize("seed", [1, 2, 3])
+    def test_update_power_health_status_matches_reference(self, db_session, seed):
+        """Test that the batch solver gives the same result as the historical loop"""
+        rng = random.Random(seed)
+        alimentations = [
+            models.Alimentation(alimentationType=models.AlimentationType.SOLAIRE, isHealthy=rng.random() > 0.2, capacity=rng.choice([0, 50, 100, 200]))
+            for _ in range(15)
+        ]
+        db_session.add_all(alimentations)
+        db_session.commit()
+        robots = [
+            models.Robot(name=f"Robot_{i}", isHealthy=rng.random() > 0.3, alimentation_id=rng.choice(alimentations).id,
+                         guidage_id=1, licence_id=1, motor=rng.choice(list(models.MotorType)))
+            for i in range(200)
+        ]
+        db_session.add_all(robots)
+        db_session.commit()
+        expected = expected_turned_off(alimentations, robots)
+        healthy_before = {robot.id for robot in robots if robot.isHealthy}
+
+        turned_off = crud.update_power_health_status(db_session)
+
+        healthy_after = {robot.id for robot in db_session.query(models.Robot).filter(models.Robot.isHealthy == True)}
+        assert healthy_before - healthy_after == expected
+        assert turned_off == len(expected)
+
+        shed = {robot.id for robot in db_session.query(models.Robot).filter(models.has_reason(models.Robot.reason_mask, models.HealthReason.SHED_FOR_LOAD))}
+        assert shed == expected
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
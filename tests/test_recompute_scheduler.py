@@ -0,0 +1,106 @@
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models
+from src.scheduler import RecomputeScheduler
+
+
+@pytest.fixture
+def fleet(make_fleet):
+    """Two guidages, one alimentation, one licence and one robot per guidage"""
+    make_fleet([
+        (1, 1, 1, models.MotorType.PETIT, True),
+        (1, 2, 1, models.MotorType.PETIT, True),
+    ], guidages=2)
+
+
+def robot_health(db_session):
+    db_session.expire_all()
+    return {robot.id: robot.isHealthy for robot in db_session.query(models.Robot).order_by(models.Robot.id)}
+
+
+class TestRecomputeScheduler:
+
+    def test_triggers_are_coalesced(self, db_session, fleet, session_factory):
+        """Test that a burst of triggers is applied by a single scoped run"""
+        scheduler = RecomputeScheduler(session_factory)
+        db_session.query(models.Guidage).update({models.Guidage.isHealthy: False})
+        db_session.commit()
+        for _ in range(1000):
+            scheduler.request(models.Guidage, 1)
+            scheduler.request(models.Guidage, 2)
+
+        assert scheduler.queue_depth == 2
+        result = scheduler.run_once()
+
+        assert result["disabled"] == 2
+        assert robot_health(db_session) == {1: False, 2: False}
+        assert scheduler.queue_depth == 0
+        assert scheduler.runs == 1
+        assert scheduler.triggers == 2000
+        assert scheduler.last_run_duration is not None
+
+    def test_too_many_parents_run_a_full_recompute(self, db_session, fleet, session_factory):
+        """Test that the scoped run falls back to the whole fleet beyond max_scoped_parents"""
+        scheduler = RecomputeScheduler(session_factory, max_scoped_parents=1)
+        db_session.get(models.Guidage, 1).isHealthy = False
+        db_session.commit()
+        scheduler.request(models.Guidage, 2)
+        scheduler.request(models.Licence, 1)
+
+        result = scheduler.run_once()
+
+        assert result["message"] == "Robots health status updated based on related objects"
+        assert robot_health(db_session) == {1: False, 2: True}
+
+    def test_background_thread_applies_changes(self, db_session, fleet, session_factory):
+        """Test that the started scheduler runs the requested recomputes within its window"""
+        scheduler = RecomputeScheduler(session_factory, debounce=0.01)
+        scheduler.start()
+        try:
+            db_session.get(models.Guidage, 2).isHealthy = False
+            db_session.commit()
+            scheduler.request(models.Guidage, 2)
+            assert scheduler.wait_idle(5.0)
+        finally:
+            scheduler.stop()
+
+        assert robot_health(db_session) == {1: True, 2: False}
+        assert scheduler.stats()["queue_depth"] == 0
+
+
+    def test_failed_run_keeps_its_triggers(self, db_session, fleet, session_factory):
+        """Test that the triggers of a run whose session cannot be opened are retried in the background"""
+        calls = []
+
+        def flaky_session_factory():
+            calls.append(None)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return session_factory()
+
+        scheduler = RecomputeScheduler(flaky_session_factory, debounce=0.01, retry_delay=0.01)
+        db_session.get(models.Guidage, 2).isHealthy = False
+        db_session.commit()
+        scheduler.request(models.Guidage, 2)
+        with pytest.raises(RuntimeError):
+            scheduler.run_once()
+        assert scheduler.queue_depth == 1
+
+        calls.clear()
+        scheduler.start()
+        try:
+            assert scheduler.wait_idle(5.0)
+        finally:
+            scheduler.stop()
+
+        assert len(calls) == 2
+        assert scheduler.failures == 1
+        assert robot_health(db_session) == {1: True, 2: False}
+
+if __name__ == "__main__":
+    pytest.main([__file__])
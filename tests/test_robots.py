@@ -1,17 +1,23 @@
 import pytest
 import sys
 import os
+import csv
+import io
+import json
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from datetime import datetime, timezone
 
 # Add the parent directory to the path to import src modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src import app
-from src.database import Base, get_db
-from src import models
+from src.database import Base, get_db, get_async_db, async_database_url
+from src import models, metrics, schemas
+from src.response_cache import response_cache
+from src.workers import coordinator
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_robots.db"
@@ -28,6 +34,16 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+async_engine = create_async_engine(async_database_url(SQLALCHEMY_DATABASE_URL))
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Override the get_async_db dependency as well, used by the async routes
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+app.dependency_overrides[get_async_db] = override_get_async_db
+
 client = TestClient(app)
 
 @pytest.fixture(scope="function")
@@ -68,10 +84,347 @@ def test_read_robots_includes_consumption(db_session):
     # Make a request to the /robots endpoint
     response = client.get("/robots")
     assert response.status_code == 200
-    robots = response.json()
+    robots = response.json()["robots"]
 
     # Check that the response contains the robot with the consumption key
     assert len(robots) == 1
     assert "consumption" in robots[0]
     assert robots[0]["consumption"] == 10  # PETIT motor has a consumption of 10
     assert robots[0]["name"] == "Test Robot 1"
+
+def create_robots(db_session, count):
+    alimentation = models.Alimentation(alimentationType="SOLAIRE", isHealthy=True, capacity=100)
+    guidage = models.Guidage(isHealthy=True)
+    licence = models.Licence(isHealthy=True, expiration_date=datetime.now(timezone.utc))
+    db_session.add_all([alimentation, guidage, licence])
+    db_session.commit()
+    db_session.add_all([
+        models.Robot(
+            name=f"Robot {i}",
+            isHealthy=i % 2 == 0,
+            alimentation_id=alimentation.id,
+            guidage_id=guidage.id,
+            licence_id=licence.id,
+            motor=models.MotorType.MOYEN,
+        )
+        for i in range(count)
+    ])
+    db_session.commit()
+
+def test_read_robots_cursor_pagination(db_session):
+    """
+    Test that following next_cursor walks through every robot exactly once.
+    """
+    create_robots(db_session, 7)
+
+    ids = []
+    cursor = None
+    while True:
+        params = {"limit": 3, "isHealthy": True}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/robots/", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        ids.extend(robot["id"] for robot in page["robots"])
+        assert page["total_count"] is None
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == sorted(ids)
+    assert len(ids) == 4
+
+def test_read_robots_total_count_is_opt_in(db_session):
+    """
+    Test that the total count is only returned when requested.
+    """
+    create_robots(db_session, 5)
+
+    response = client.get("/robots/", params={"limit": 2, "include_total": True, "alimentation_id": 1})
+
+    assert response.json()["total_count"] == 5
+    assert len(response.json()["robots"]) == 2
+
+def test_read_robots_rejects_invalid_cursor(db_session):
+    """
+    Test that a malformed cursor is reported as a client error.
+    """
+    response = client.get("/robots/", params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+
+def test_read_robots_filtered_by_reason(db_session):
+    """
+    Test that robots can be listed by the reason they are turned off, which is returned with them.
+    """
+    # Robot 2 is created turned off
+    create_robots(db_session, 3)
+    client.put("/robots/3/status", params={"status": False})
+
+    response = client.get("/robots/", params={"reason": "manual"})
+
+    assert [robot["id"] for robot in response.json()["robots"]] == [2, 3]
+    assert response.json()["robots"][1]["reasons"] == ["manual"]
+    assert client.get("/robots/", params={"reason": "unknown"}).status_code == 422
+
+def test_alimentation_load_endpoints(db_session):
+    """
+    Test the load of an alimentation, the most loaded ones and the attachment check.
+    """
+    create_robots(db_session, 4)
+
+    load = client.get("/alimentations/1/load").json()
+    most_loaded = client.get("/alimentations/most_loaded", params={"limit": 1}).json()
+    check = client.get("/alimentations/1/can_attach/2").json()
+
+    # Robots 1 and 3 are healthy, with MOYEN motors
+    assert load["current_load"] == 40
+    assert load["headroom"] == 60
+    assert load["robots_per_motor"] == {"PETIT": 0, "MOYEN": 4, "GRAND": 0}
+    assert most_loaded == [load]
+    assert (check["headroom"], check["can_attach"]) == (40, True)
+
+def test_read_guidages_returns_next_cursor_header(db_session):
+    """
+    Test that parent list endpoints return the next cursor in a header.
+    """
+    db_session.add_all([models.Guidage(isHealthy=True) for _ in range(3)])
+    db_session.commit()
+
+    first = client.get("/guidages/", params={"limit": 2})
+    second = client.get("/guidages/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+
+    assert [guidage["id"] for guidage in first.json()] == [1, 2]
+    assert [guidage["id"] for guidage in second.json()] == [3]
+    assert "X-Next-Cursor" not in second.headers
+
+def test_read_robot_not_modified_without_querying(db_session):
+    """
+    Test that a poll with the ETag of the current robot is answered 304 without any query.
+    """
+    create_robots(db_session, 1)
+    first = client.get("/robots/1")
+    assert first.status_code == 200
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        second = client.get("/robots/1", headers={"If-None-Match": first.headers["ETag"]})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+
+    assert second.status_code == 304
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert statements == []
+
+def test_read_robots_cache_invalidated_by_updates(db_session):
+    """
+    Test that cached robot responses are served until a robot is written, then read again.
+    """
+    create_robots(db_session, 2)
+    first = client.get("/robots/", params={"limit": 1})
+    hits = response_cache.hits
+
+    assert client.get("/robots/", params={"limit": 1}).json() == first.json()
+    assert response_cache.hits == hits + 1
+
+    client.put("/robots/1/status", params={"status": False})
+    second = client.get("/robots/", params={"limit": 1}, headers={"If-None-Match": first.headers["ETag"]})
+
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert second.json()["robots"][0]["isHealthy"] == False
+
+def test_list_robots_matches_the_response_schema(db_session):
+    """
+    Test that the robots listed from Core rows are serialized exactly as schemas.Robot dumps them.
+    """
+    create_robots(db_session, 3)
+    client.put("/robots/1/status", params={"status": False})
+
+    response = client.get("/robots/", params={"limit": 2, "include_total": True})
+
+    db_session.expire_all()
+    robots = db_session.query(models.Robot).order_by(models.Robot.id).limit(2).all()
+    expected = schemas.RobotsResponse(total_count=3, next_cursor=response.json()["next_cursor"], robots=robots)
+    assert response.content == expected.model_dump_json().encode()
+    assert response.json()["robots"][0]["reasons"] == ["manual"]
+
+def test_export_robots_ndjson(db_session):
+    """
+    Test that the NDJSON export streams every robot with its dependencies state.
+    """
+    create_robots(db_session, 3)
+
+    response = client.get("/robots/export")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [1, 2, 3]
+    assert lines[0]["motor"] == "MOYEN"
+    assert lines[0]["consumption"] == 20
+    assert lines[0]["alimentation_isHealthy"] is True
+    assert lines[0]["alimentationType"] == "SOLAIRE"
+    assert [line["reasons"] for line in lines] == [[], ["manual"], []]
+
+def test_export_robots_csv_with_filters(db_session):
+    """
+    Test that the CSV export has a header and honours the list filters.
+    """
+    create_robots(db_session, 4)
+
+    response = client.get("/robots/export", params={"format": "csv", "isHealthy": False})
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == ["2", "4"]
+    assert rows[0]["guidage_isHealthy"] == "True"
+    assert rows[0]["reasons"] == "manual"
+
+def test_bulk_create_from_json_array(db_session):
+    """
+    Test that the bulk endpoints create every object and return their ids in order.
+    """
+    response = client.post("/guidages/bulk", json=[{"isHealthy": True}, {"isHealthy": False}])
+    assert response.status_code == 200
+    assert response.json() == {"ids": [1, 2]}
+
+    robots = [
+        {"name": f"Bulk {i}", "isHealthy": True, "alimentation_id": 1, "guidage_id": 2, "licence_id": 1, "motor": "GRAND"}
+        for i in range(3)
+    ]
+    response = client.post("/robots/bulk", json=robots)
+
+    assert response.json() == {"ids": [1, 2, 3]}
+    assert db_session.query(models.Robot).filter(models.Robot.motor == models.MotorType.GRAND).count() == 3
+
+def test_bulk_create_from_ndjson(db_session):
+    """
+    Test that the bulk endpoints accept NDJSON bodies and apply the license expiration rule.
+    """
+    body = "\n".join([
+        json.dumps({"isHealthy": True, "expiration_date": "2000-01-01T00:00:00"}),
+        json.dumps({"isHealthy": True, "expiration_date": "2999-01-01T00:00:00"}),
+    ])
+
+    response = client.post("/licences/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.json() == {"ids": [1, 2]}
+    licences = db_session.query(models.Licence).order_by(models.Licence.id).all()
+    assert [licence.isHealthy for licence in licences] == [False, True]
+
+def test_bulk_create_validates_everything_before_inserting(db_session):
+    """
+    Test that one invalid item rejects the whole batch.
+    """
+    response = client.post("/alimentations/bulk", json=[
+        {"alimentationType": "SOLAIRE", "isHealthy": True, "capacity": 50},
+        {"alimentationType": "EOLIENNE", "isHealthy": True, "capacity": 50},
+    ])
+
+    assert response.status_code == 422
+    assert db_session.query(models.Alimentation).count() == 0
+
+def test_update_status_batch(db_session):
+    """
+    Test that the batch endpoint applies every change and returns the robot health changes.
+    """
+    create_robots(db_session, 2)
+
+    response = client.put("/status/batch", json={"changes": [
+        {"entity_type": "guidage", "id": 1, "status": False},
+        {"entity_type": "alimentation", "id": 1, "status": False},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json() == {"applied": 2, "robots": [{"id": 1, "isHealthy": False, "cause": "propagation"}]}
+
+    response = client.put("/status/batch", json={"changes": [{"entity_type": "robot", "id": 99, "status": False}]})
+    assert response.status_code == 400
+
+
+def test_simulate_status_changes(db_session):
+    """
+    Test that the simulation endpoint returns the robots a failure would turn off, without changing them.
+    """
+    create_robots(db_session, 2)
+
+    response = client.post("/status/simulate", json={
+        "failures": [{"entity_type": "guidage", "id": 1}], "at": "2000-01-01T00:00:00Z",
+    })
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["robots"] == [{"id": 1, "isHealthy": False, "cause": "propagation"}]
+    assert [(load["id"], load["simulated_load"]) for load in result["alimentations"]] == [(1, 0)]
+    db_session.expire_all()
+    assert db_session.get(models.Robot, 1).isHealthy
+
+    response = client.post("/status/simulate", json={"licence_expirations": {"99": "2000-01-01T00:00:00Z"}})
+    assert response.status_code == 400
+
+
+def test_full_recompute_is_requested_from_the_leader(db_session, monkeypatch):
+    """
+    Test that the full sweep endpoint hands the recompute to the coordinator instead of running it.
+    """
+    requests = []
+    monkeypatch.setattr(coordinator, "recompute_all", lambda: requests.append(None))
+
+    response = client.put("/robots/update_health_status")
+
+    assert response.status_code == 202
+    assert requests == [None]
+
+
+def test_health_events_websocket(db_session):
+    """
+    Test that the WebSocket stream sends the committed health changes of the subscribed guidage.
+    """
+    create_robots(db_session, 2)
+
+    with client.websocket_connect("/events/health/ws?guidage_id=1") as websocket:
+        client.put("/status/batch", json={"changes": [{"entity_type": "guidage", "id": 1, "status": False}]})
+
+        assert websocket.receive_json() == {"entity": "guidage", "id": 1, "old": True, "new": False, "cause": "manual", "guidage_id": 1}
+        assert websocket.receive_json() == {
+            "entity": "robot", "id": 1, "old": True, "new": False, "cause": "propagation",
+            "alimentation_id": 1, "guidage_id": 1, "licence_id": 1,
+        }
+
+
+def test_metrics_endpoint_reports_requests_and_queries(db_session):
+    """
+    Test that /metrics exposes the latency histogram and the query count of each route.
+    """
+    create_robots(db_session, 2)
+    queries_before = metrics.REQUEST_QUERIES.count(route="/robots/")
+
+    assert client.get("/robots/").status_code == 200
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/robots/",status="200"}' in response.text
+    assert metrics.REQUEST_QUERIES.count(route="/robots/") == queries_before + 1
+    assert "# TYPE recompute_queue_depth gauge" in response.text
+    assert "# TYPE response_cache_hits_total counter" in response.text
+    assert "\nresponse_cache_hits_total " in response.text
+
+def test_repeated_selects_are_flagged_as_n_plus_one():
+    """
+    Test that a SELECT repeated within one request is reported as an N+1 pattern.
+    """
+    stats = metrics.RequestStats()
+    for _ in range(metrics.N_PLUS_ONE_THRESHOLD):
+        stats.statements["SELECT guidages.id FROM guidages WHERE guidages.id = ?"] += 1
+    stats.statements["UPDATE robots SET name = ?"] += 20
+    before = metrics.N_PLUS_ONE.value(route="/test")
+
+    metrics.record_request("GET", "/test", 200, 0.01, stats)
+
+    assert stats.repeated_selects() == [("SELECT guidages.id FROM guidages WHERE guidages.id = ?", metrics.N_PLUS_ONE_THRESHOLD)]
+    assert metrics.N_PLUS_ONE.value(route="/test") == before + 1
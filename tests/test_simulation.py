@@ -0,0 +1,156 @@
+import pytest
+import sys
+import os
+import asyncio
+import threading
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud, async_crud, schemas, simulation
+from src.database import async_database_url
+
+
+@pytest.fixture
+def fleet(make_fleet):
+    """Two alimentations, two guidages, two licences and four robots consuming 10, 20, 20 and 20"""
+    make_fleet([
+        (1, 1, 1, models.MotorType.PETIT, True),
+        (1, 2, 1, models.MotorType.MOYEN, True),
+        (2, 1, 2, models.MotorType.MOYEN, True),
+        (2, 2, 2, models.MotorType.MOYEN, True),
+    ], capacities=(100, 100), guidages=2, licence_days=(30, 60))
+
+
+def scenario(*failures, **kwargs):
+    return schemas.SimulationRequest(
+        failures=[schemas.SimulatedFailure(entity_type=entity_type, id=entity_id) for entity_type, entity_id in failures], **kwargs,
+    )
+
+
+def changes(result):
+    return [(robot["id"], robot["isHealthy"], robot["cause"]) for robot in result["robots"]]
+
+
+def health(db_session):
+    db_session.expire_all()
+    return {robot.id: robot.isHealthy for robot in db_session.query(models.Robot).order_by(models.Robot.id)}
+
+
+class TestSimulation:
+
+    def test_failures_turn_off_their_robots(self, db_session, fleet):
+        """Test that a failing parent turns off the robots depending on it, and a failing robot itself"""
+        result = crud.simulate_status_changes(db_session, scenario(
+            (schemas.EntityType.guidage, 2), (schemas.EntityType.robot, 3),
+        ))
+
+        assert changes(result) == [(2, False, "propagation"), (3, False, "manual"), (4, False, "propagation")]
+        assert result["robots_changed"] == result["robots_down"] == 3
+        assert [(load["id"], load["current_load"], load["simulated_load"], load["headroom"]) for load in result["alimentations"]] == [
+            (1, 30, 10, 90), (2, 40, 0, 100),
+        ]
+
+    def test_shed_robots_stay_off(self, db_session, fleet):
+        """Test that a robot turned off by the load shedding is not turned back on by the freed capacity"""
+        db_session.get(models.Alimentation, 2).capacity = 30
+        db_session.commit()
+        crud.update_power_health_status(db_session)
+
+        result = crud.simulate_status_changes(db_session, scenario((schemas.EntityType.guidage, 1)))
+
+        assert changes(result) == [(1, False, "propagation"), (3, False, "propagation")]
+        assert [(load["id"], load["current_load"], load["simulated_load"], load["headroom"]) for load in result["alimentations"]] == [
+            (1, 30, 20, 80), (2, 20, 0, 30),
+        ]
+
+    def test_licences_expiring_by_a_date(self, db_session, fleet):
+        """Test that the licences expired at the simulated date, or by an overridden date, go down"""
+        in_45_days = datetime.now(timezone.utc) + timedelta(days=45)
+
+        expired_by_date = crud.simulate_status_changes(db_session, scenario(at=in_45_days))
+        overridden = crud.simulate_status_changes(db_session, scenario(licence_expirations={2: datetime(2000, 1, 1)}))
+
+        assert changes(expired_by_date) == [(1, False, "propagation"), (2, False, "propagation")]
+        assert changes(overridden) == [(3, False, "propagation"), (4, False, "propagation")]
+
+    def test_database_is_not_written(self, db_session, fleet, statements):
+        """Test that a simulation only reads the database"""
+        statements.clear()
+        result = crud.simulate_status_changes(db_session, scenario((schemas.EntityType.alimentation, 1)))
+
+        assert result["robots_changed"] == 2
+        assert all(statement.lstrip().upper().startswith("SELECT") for statement in statements)
+        assert all(health(db_session).values())
+
+    def test_unknown_entity_is_rejected(self, db_session, fleet):
+        """Test that a failure of an entity which does not exist is an error"""
+        with pytest.raises(HTTPException) as error:
+            crud.simulate_status_changes(db_session, scenario((schemas.EntityType.licence, 99)))
+
+        assert error.value.status_code == 400
+
+    def test_snapshot_is_reused_until_a_commit(self, db_session, fleet):
+        """Test that simulations share a snapshot, rebuilt once the health of an entity changed"""
+        crud.simulate_status_changes(db_session, scenario())
+        snapshot = simulation.snapshots.snapshot
+        crud.simulate_status_changes(db_session, scenario((schemas.EntityType.guidage, 1)))
+        assert simulation.snapshots.snapshot is snapshot
+
+        crud.update_robot_status(db_session, 1, False)
+        result = crud.simulate_status_changes(db_session, scenario((schemas.EntityType.guidage, 1)))
+
+        assert simulation.snapshots.snapshot is not snapshot
+        assert changes(result) == [(3, False, "propagation")]
+
+    def test_concurrent_simulations_load_the_snapshot(self, db_session, fleet, engine):
+        """Test that simulations arriving together on the event loop, without a snapshot, all complete"""
+        results = []
+
+        async def simulate_concurrently():
+            async_engine = create_async_engine(async_database_url(str(engine.url)))
+            session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+            async def simulate(guidage_id):
+                async with session_factory() as db:
+                    return await async_crud.simulate_status_changes(db, scenario((schemas.EntityType.guidage, guidage_id)))
+            try:
+                results.extend(await asyncio.gather(simulate(1), simulate(2), simulate(1)))
+            finally:
+                await async_engine.dispose()
+
+        # A deadlock blocks the event loop thread itself: wait for it from another thread
+        thread = threading.Thread(target=asyncio.run, args=(simulate_concurrently(),), daemon=True)
+        thread.start()
+        thread.join(10)
+
+        assert not thread.is_alive()
+        assert [changes(result) for result in results] == [
+            [(1, False, "propagation"), (3, False, "propagation")],
+            [(2, False, "propagation"), (4, False, "propagation")],
+            [(1, False, "propagation"), (3, False, "propagation")],
+        ]
+        assert simulation.snapshots.snapshot is not None
+
+    def test_simulation_agrees_with_the_applied_changes(self, db_session, fleet):
+        """Test that the simulated robots are the ones changed by the same batch applied for real"""
+        db_session.get(models.Alimentation, 2).capacity = 30
+        db_session.commit()
+        crud.update_power_health_status(db_session)
+        failures = [(schemas.EntityType.licence, 1), (schemas.EntityType.guidage, 2)]
+
+        simulated = crud.simulate_status_changes(db_session, scenario(*failures))
+        applied = crud.apply_status_changes(db_session, [
+            schemas.StatusChange(entity_type=entity_type, id=entity_id, status=False) for entity_type, entity_id in failures
+        ])
+
+        assert {(robot["id"], robot["isHealthy"]) for robot in simulated["robots"]} == {
+            (robot["id"], robot["isHealthy"]) for robot in applied["robots"]
+        }
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
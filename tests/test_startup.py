@@ -0,0 +1,84 @@
+import pytest
+import sys
+import os
+import sqlite3
+import subprocess
+import threading
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src
+from src.startup import Warmup
+
+
+class FakeSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def test_import_does_not_touch_the_database(tmp_path):
+    """Test that importing the application neither connects to the database nor creates tables"""
+    database = tmp_path / "import.db"
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}"}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    subprocess.run([sys.executable, "-c", "import src"], cwd=root, env=env, check=True, capture_output=True)
+
+    if database.exists():
+        with sqlite3.connect(database) as conn:
+            assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() == []
+
+
+def test_warmup_runs_in_the_background():
+    """Test that the tasks run in a background thread, in order, and report their progress"""
+    release = threading.Event()
+    calls = []
+    warmup = Warmup(session_factory=FakeSession)
+    warmup.add("slow", lambda db: (calls.append("slow"), release.wait(5)))
+    warmup.add("failing", lambda db: 1 / 0)
+
+    warmup.start()
+    status = warmup.status()
+    release.set()
+    warmup.join(5)
+
+    assert status["started"] and not status["warm"]
+    assert status["tasks"]["failing"]["status"] == "pending"
+    assert calls == ["slow"]
+    assert warmup.done
+    assert warmup.status()["tasks"]["slow"]["status"] == "done"
+    assert warmup.status()["tasks"]["failing"]["status"] == "failed"
+    assert "division by zero" in warmup.status()["tasks"]["failing"]["error"]
+
+
+def test_ready_endpoint(monkeypatch):
+    """Test that /ready answers once started, and with warm=true only once the caches are loaded"""
+    release = threading.Event()
+    warmup = Warmup(session_factory=FakeSession)
+    warmup.add("graph_cache", lambda db: release.wait(5))
+    monkeypatch.setattr(src, "warmup", warmup)
+    client = TestClient(src.app)
+
+    assert client.get("/ready").status_code == 503
+
+    warmup.start()
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["tasks"]["graph_cache"]["status"] == "running"
+    assert "licence_sweep" in response.json()["tasks"]
+    assert client.get("/ready", params={"warm": True}).status_code == 503
+
+    release.set()
+    warmup.join(5)
+    response = client.get("/ready", params={"warm": True})
+    assert response.status_code == 200
+    assert response.json()["warm"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,99 @@
+import pytest
+import sys
+import os
+from fastapi import HTTPException
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models, crud, schemas
+
+
+@pytest.fixture
+def fleet(make_fleet):
+    """Two alimentations, one guidage, one licence and three robots"""
+    make_fleet([
+        (1, 1, 1, models.MotorType.PETIT, True),
+        (2, 1, 1, models.MotorType.MOYEN, True),
+        (2, 1, 1, models.MotorType.MOYEN, False),
+    ], capacities=(100, 30))
+
+
+def change(entity_type, id, status):
+    return schemas.StatusChange(entity_type=entity_type, id=id, status=status)
+
+
+def robot_health(db_session):
+    db_session.expire_all()
+    return {robot.id: robot.isHealthy for robot in db_session.query(models.Robot).order_by(models.Robot.id)}
+
+
+class TestStatusBatch:
+
+    def test_parent_changes_are_propagated_once(self, db_session, fleet):
+        """Test that robots of changed parents are updated and reported"""
+        result = crud.apply_status_changes(db_session, [
+            change("alimentation", 1, False),
+            change("guidage", 1, False),
+        ])
+
+        assert robot_health(db_session) == {1: False, 2: False, 3: False}
+        assert result["applied"] == 2
+        assert result["robots"] == [
+            {"id": 1, "isHealthy": False, "cause": "propagation"},
+            {"id": 2, "isHealthy": False, "cause": "propagation"},
+        ]
+
+    def test_manual_robot_changes_are_not_overridden(self, db_session, fleet):
+        """Test that a robot turned off by the batch stays off after propagation"""
+        crud.apply_status_changes(db_session, [change("guidage", 1, False)])
+
+        result = crud.apply_status_changes(db_session, [
+            change("guidage", 1, True),
+            change("robot", 1, False),
+        ])
+
+        # Robot 1 stays off, robot 3 recovers too but alimentation 2 cannot power both robots and sheds it again
+        assert robot_health(db_session) == {1: False, 2: True, 3: False}
+        assert result["robots"] == [{"id": 2, "isHealthy": True, "cause": "propagation"}]
+
+    def test_recovered_robots_are_shed_when_overloaded(self, db_session, fleet):
+        """Test that load shedding runs on the alimentations of recovered robots"""
+        crud.apply_status_changes(db_session, [change("licence", 1, False)])
+
+        result = crud.apply_status_changes(db_session, [change("licence", 1, True)])
+
+        # Alimentation 2 only powers 30 units: robot 3 (highest id) is shed again
+        assert robot_health(db_session) == {1: True, 2: True, 3: False}
+        assert [robot["id"] for robot in result["robots"]] == [1, 2]
+
+    def test_batch_is_atomic(self, db_session, fleet):
+        """Test that an invalid change rejects the whole batch"""
+        with pytest.raises(HTTPException):
+            crud.apply_status_changes(db_session, [
+                change("alimentation", 2, False),
+                change("guidage", 42, False),
+            ])
+
+        assert db_session.get(models.Alimentation, 2).isHealthy == True
+        assert robot_health(db_session) == {1: True, 2: True, 3: False}
+
+    def test_robot_cannot_be_turned_on_with_unhealthy_parent(self, db_session, fleet):
+        """Test that parent health is checked against the state after the batch"""
+        with pytest.raises(HTTPException):
+            crud.apply_status_changes(db_session, [
+                change("guidage", 1, False),
+                change("robot", 3, True),
+            ])
+
+        result = crud.apply_status_changes(db_session, [
+            change("alimentation", 1, True),
+            change("robot", 3, True),
+        ])
+        # Turned on, then shed by its overloaded alimentation: no net change
+        assert result["robots"] == []
+        assert robot_health(db_session) == {1: True, 2: True, 3: False}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,214 @@
+import pytest
+import sys
+import os
+import asyncio
+import threading
+
+# Add the parent directory to the path to import src modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import models
+from src.graph_cache import graph_cache
+from src.response_cache import response_cache
+from src.health_stream import health_stream
+from src.scheduler import RecomputeScheduler
+from src.workers import LocalBus, UnixSocketBus, LeaderElection, WorkerCoordinator
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.started = False
+        self.notified = 0
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def notify(self):
+        self.notified += 1
+
+
+@pytest.fixture
+def workers(tmp_path, session_factory):
+    """A leader and a follower, connected by an in-process bus"""
+    channel = []
+    lock_path = str(tmp_path / "leader.lock")
+    leader = WorkerCoordinator(LocalBus(channel), LeaderElection(lock_path), RecomputeScheduler(session_factory, debounce=0.01), FakeScheduler())
+    follower = WorkerCoordinator(LocalBus(channel), LeaderElection(lock_path), RecomputeScheduler(session_factory, debounce=0.01), FakeScheduler())
+    leader.start()
+    follower.start()
+    yield leader, follower
+    follower.stop()
+    leader.stop()
+
+
+class TestWorkers:
+
+    def test_local_bus_delivers_to_other_workers(self):
+        """Test that a message reaches every other bus of the channel"""
+        channel = []
+        buses = [LocalBus(channel) for _ in range(3)]
+        received = [[] for _ in buses]
+        for bus, messages in zip(buses, received):
+            bus.subscribe(messages.append)
+            bus.start()
+
+        buses[0].publish({"type": "licences"})
+
+        assert received == [[], [{"type": "licences"}], [{"type": "licences"}]]
+
+    def test_unix_socket_bus(self, tmp_path):
+        """Test that messages are exchanged between sockets of the run directory"""
+        sender = UnixSocketBus(str(tmp_path), worker_id="a")
+        receiver = UnixSocketBus(str(tmp_path), worker_id="b")
+        received = threading.Event()
+        messages = []
+        receiver.subscribe(lambda message: (messages.append(message), received.set()))
+        sender.start()
+        receiver.start()
+        try:
+            sender.publish({"type": "changes", "keys": [["guidages", 1]]})
+            assert received.wait(5.0)
+        finally:
+            sender.stop()
+            receiver.stop()
+
+        assert messages == [{"type": "changes", "keys": [["guidages", 1]]}]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_single_leader_is_elected(self, tmp_path):
+        """Test that the lock file elects one leader, replaced once it leaves"""
+        first = LeaderElection(str(tmp_path / "leader.lock"))
+        second = LeaderElection(str(tmp_path / "leader.lock"))
+
+        assert first.try_acquire() == True
+        assert second.try_acquire() == False
+
+        first.release()
+        assert second.try_acquire() == True
+        second.release()
+
+    def test_only_the_leader_runs_the_scheduler(self, workers):
+        """Test that licence notifications of a follower reach the leader scheduler"""
+        leader, follower = workers
+        assert leader.scheduler.started and not follower.scheduler.started
+
+        follower.notify_licences()
+
+        assert leader.scheduler.notified == 1
+        assert follower.scheduler.notified == 0
+
+    def test_followers_propagate_on_the_leader(self, db_session, make_fleet, workers):
+        """Test that a propagation requested by a follower is run by the leader"""
+        leader, follower = workers
+        make_fleet([(1, 1, 1, models.MotorType.PETIT, True)])
+        db_session.get(models.Guidage, 1).isHealthy = False
+        db_session.commit()
+
+        follower.propagate(models.Guidage, 1)
+        assert leader.recompute.wait_idle(5.0)
+
+        db_session.expire_all()
+        assert db_session.get(models.Robot, 1).isHealthy == False
+
+    def test_full_recompute_runs_on_the_leader(self, db_session, workers):
+        """Test that a full recompute requested by a follower is run by the leader only"""
+        leader, follower = workers
+
+        follower.recompute_all()
+        assert leader.recompute.wait_idle(5.0)
+
+        assert (leader.recompute.runs, follower.recompute.runs) == (1, 0)
+
+    def test_committed_changes_invalidate_other_workers(self, db_session, workers):
+        """Test that the changes committed by a worker are dropped from the cache of the others"""
+        leader, follower = workers
+        messages = []
+        follower.bus.subscribe(messages.append)
+        db_session.add(models.Guidage(id=1, isHealthy=True))
+        db_session.commit()
+        graph_cache.warm(db_session)
+
+        db_session.get(models.Guidage, 1).isHealthy = False
+        db_session.commit()
+
+        # Both workers share this process cache: the follower invalidated the entry written by the commit
+        assert [message for message in messages if message["type"] == "changes"] == [{"type": "changes", "keys": [["guidages", 1]]}]
+        assert graph_cache.stats()["size"]["guidages"] == 0
+
+    def test_committed_tables_bump_versions_of_other_workers(self, db_session, workers):
+        """Test that the tables written by a worker are announced to the others"""
+        leader, follower = workers
+        messages = []
+        follower.bus.subscribe(messages.append)
+        versions = response_cache.versions(["guidages"])
+
+        db_session.add(models.Guidage(id=1, isHealthy=True))
+        db_session.commit()
+
+        assert {"type": "versions", "tables": ["guidages"]} in messages
+        # Both workers share this process cache: bumped by the commit, then by the workers receiving the message
+        assert response_cache.versions(["guidages"])[0] > versions[0] + 1
+
+    def test_health_events_are_relayed_to_other_workers(self, db_session, workers):
+        """Test that the health changes committed by a worker reach the subscribers of the others"""
+        leader, follower = workers
+        messages = []
+        follower.bus.subscribe(messages.append)
+        follower.announce_subscriptions(1)
+        db_session.add(models.Guidage(id=1, isHealthy=True))
+        db_session.commit()
+
+        db_session.get(models.Guidage, 1).isHealthy = False
+        db_session.commit()
+
+        assert [message for message in messages if message["type"] == "health"] == [{"type": "health", "events": [
+            {"entity": "guidage", "id": 1, "old": True, "new": False, "cause": "manual", "guidage_id": 1},
+        ]}]
+
+    def test_health_events_are_not_collected_without_subscribers(self, db_session, workers):
+        """Test that the workers only collect and relay their health changes while one of them has subscribers"""
+        leader, follower = workers
+        messages = []
+        follower.bus.subscribe(messages.append)
+
+        async def subscribe_and_leave():
+            subscription = health_stream.subscribe()
+            active = health_stream.active
+            health_stream.unsubscribe(subscription)
+            return active
+
+        assert asyncio.run(subscribe_and_leave())
+        db_session.add(models.Guidage(id=1, isHealthy=True))
+        db_session.commit()
+        db_session.get(models.Guidage, 1).isHealthy = False
+        db_session.commit()
+
+        announced = [(message["worker"], message["count"]) for message in messages if message["type"] == "subscriptions"]
+        assert announced == [(leader.worker_id, 1), (leader.worker_id, 0)]
+        assert not health_stream.active
+        assert not [message for message in messages if message["type"] == "health"]
+
+    def test_started_worker_learns_the_subscriptions_of_the_others(self, tmp_path, session_factory, workers, monkeypatch):
+        """Test that the running workers with subscribers announce them to a worker joining, and forget it once stopped"""
+        leader, follower = workers
+        monkeypatch.setattr(health_stream, "subscription_count", lambda: 2)
+        messages = []
+        joining = WorkerCoordinator(LocalBus(leader.bus.channel), LeaderElection(str(tmp_path / "leader.lock")), RecomputeScheduler(session_factory), FakeScheduler())
+        joining.bus.subscribe(messages.append)
+
+        joining.start()
+        try:
+            assert sorted((message["worker"], message["count"]) for message in messages if message["type"] == "subscriptions") == sorted([
+                (leader.worker_id, 2), (follower.worker_id, 2),
+            ])
+            assert health_stream.remote_subscriptions[joining.worker_id] == 2
+        finally:
+            joining.stop()
+        assert joining.worker_id not in health_stream.remote_subscriptions
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])